@@ -9,6 +9,11 @@
 import math , pygame , random
 from pygame.locals import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import extra , sound
 from quiet_season import Quiet_Season
 from primitives import *
@@ -25,6 +30,7 @@ class Alien_Season(Quiet_Season):
         self.name = "Alien"
         self.new_aliens = False
         self.t2_announced = False
+        self.swarm = None
 
 
 
@@ -74,6 +80,9 @@ class Alien_Season(Quiet_Season):
                         if not isinstance(item, City_Node) ]
 
     def Per_Period(self):
+        # The list of aliens is about to change.
+        self.__Store()
+
         if ( self.alien_tech_level >= 1.7 ):
             # More sophisticated aliens.
             # They replan their strategy before each wave.
@@ -87,7 +96,7 @@ class Alien_Season(Quiet_Season):
         # Make a wave of bug-eyed monsters. Here's where they start:
         num_aliens = random.randint(2,2 + int(self.alien_tech_level))
         alien_angle = random.random() * TWO_PI
-        (cx,cy) = GRID_CENTRE
+        (cx,cy) = Get_Map_Centre()
         alien_radius = cx + cy
 
         # Here's where they end up
@@ -136,25 +145,63 @@ class Alien_Season(Quiet_Season):
         return 16 
 
     def Per_Frame(self, frame_time):
-        for alien in self.alien_list:
-            alien.Per_Frame(frame_time)
+        if (( self.swarm == None ) and ( numpy != None )
+        and ( len(self.alien_list) >= SWARM_SIZE )):
+            self.swarm = Alien_Swarm(self.alien_list)
+
+        if ( self.swarm != None ):
+            self.swarm.Per_Frame(frame_time)
+        else:
+            for alien in self.alien_list:
+                alien.Per_Frame(frame_time)
 
         if ( self.new_aliens ):
             sound.FX("ring")
             self.new_aliens = False
 
     def Draw(self, output, update_area):
+        if ( self.swarm != None ):
+            self.swarm.Draw(output, update_area)
+            return
         for alien in self.alien_list:
             alien.Draw(output, update_area)
 
         
     def Get_Extra_Info(self):
-        count = len([ x for x in self.alien_list if x.rookie ])
+        if ( self.swarm != None ):
+            count = self.swarm.Rookies()
+        else:
+            count = len([ x for x in self.alien_list if x.rookie ])
         if ( count != 0 ):
             return [ ((255,0,0), 16, "Aliens approaching!" )]
         else:
             return []
 
+    def Fingerprint(self):
+        if ( self.swarm != None ):
+            self.swarm.Store()
+        return [ (a.pos, a.done, [ t.pos for t in
+                    [ a.current_target ] + a.targets if t != None ])
+                for a in self.alien_list ]
+
+    def __Store(self):
+        # Bring the aliens up to date and stop using the swarm.
+        if ( self.swarm != None ):
+            self.swarm.Store()
+            self.swarm = None
+
+    def __getstate__(self):
+        # The aliens are saved, rather than the swarm.
+        if ( self.swarm != None ):
+            self.swarm.Store()
+        state = self.__dict__.copy()
+        state[ 'swarm' ] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.swarm = None
+
 class Alien:
     def __init__(self):
         self.pos = None             # set externally
@@ -219,9 +266,9 @@ class Alien:
                 if ( self.countdown < 0 ):
                     # time to move on to next target
                     self.current_target = None
-                elif ( self.current_target.Take_Damage(self.alien_tech_level) ):
+                elif ( self.net.Damage(self.current_target,
+                            self.alien_tech_level, "aliens") ):
                     # Destroyed it!
-                    self.net.Destroy(self.current_target, "aliens")
                     self.current_target = None
                 else:
                     self.net.Popup(self.current_target)
@@ -244,13 +291,13 @@ class Alien:
                 else:
                     self.in_zone = True
 
-            self.bbox = Rect(x,y,1,1)
             for (i,a) in enumerate([ 0, TWO_THIRDS_PI, - TWO_THIRDS_PI ]):
                 px = x + ( math.cos(a + ha) * self.SIZE )
                 py = y + ( math.sin(a + ha) * self.SIZE )
                 (px,py) = Grid_To_Scr((px,py))
                 self.points[ i ] = (int(px), int(py))
-                self.bbox.union_ip(Rect(self.points[ i ], (1,1)))
+            self.bbox = Rect(self.points[ 0 ], (1,1)).unionall(
+                    [ Rect(p, (1,1)) for p in self.points ])
 
             if ( fire ):
                 tgt = Grid_To_Scr(self.current_target.pos)
@@ -262,6 +309,9 @@ class Alien:
                 alien_firing_sound.Set(1.0)
 
     def Draw(self, output, update_area):
+        if (( self.bbox == None )
+        or ( not self.bbox.colliderect(output.get_rect()) )):
+            return # not placed yet, or off the screen
         pygame.draw.polygon(output, self.colour1, self.points) 
         pygame.draw.polygon(output, self.colour2, self.points, 1) 
         if ( self.laser != None ):
@@ -270,6 +320,198 @@ class Alien:
         update_area(self.bbox)
 
 
+# Swarms.
+#
+# An Alien_Swarm holds every alien of a season in NumPy arrays, one
+# entry per alien in the order of the season's alien list, and moves
+# them all in one batched step per frame by the rules of
+# Alien.Per_Frame. Choosing a target and attacking it are still done
+# alien by alien, in the same order as before: the aliens' moves
+# don't depend on each other or on the damage done, so moving them
+# all first makes no difference.
+#
+# While a season has a swarm, the arrays are up to date and the Alien
+# objects (apart from their targets) are not; Store() updates them.
+# The swarm is dropped whenever the list of aliens changes, and made
+# again when next needed. Moving fewer than SWARM_SIZE aliens is
+# quicker one by one, so they don't get a swarm.
+
+SWARM_SIZE = 24
+
+class Alien_Swarm:
+    def __init__(self, aliens):
+        self.aliens = list(aliens)
+        n = len(self.aliens)
+
+        def Column(values, dtype=float):
+            return numpy.fromiter(values, dtype, n)
+        a = self.aliens
+        self.x = Column(alien.pos[ 0 ] for alien in a)
+        self.y = Column(alien.pos[ 1 ] for alien in a)
+        self.attack_angle = Column(alien.attack_angle for alien in a)
+        self.heading = Column(getattr(alien, 'heading', 0.0) for alien in a)
+        self.rotation = Column(alien.rotation for alien in a)
+        self.speed = Column(alien.speed for alien in a)
+        self.countdown = Column(alien.countdown for alien in a)
+        self.in_zone = Column((getattr(alien, 'in_zone', False)
+                    for alien in a), bool)
+        self.rookie = Column((alien.rookie for alien in a), bool)
+        self.done = Column((alien.done for alien in a), bool)
+        self.has_target = Column((alien.current_target != None
+                    for alien in a), bool)
+        self.tx = numpy.zeros(n)     # the targets' positions
+        self.ty = numpy.zeros(n)
+        for i in numpy.flatnonzero(self.has_target).tolist():
+            (self.tx[ i ], self.ty[ i ]) = a[ i ].current_target.pos
+
+        # What is drawn: a triangle in screen coordinates, the
+        # rectangle around it, and maybe a laser (see Alien.Draw).
+        self.px = numpy.array([ [ p[ 0 ] for p in alien.points ]
+                    for alien in a ], int).reshape(n, 3)
+        self.py = numpy.array([ [ p[ 1 ] for p in alien.points ]
+                    for alien in a ], int).reshape(n, 3)
+        self.placed = Column((alien.bbox != None for alien in a), bool)
+        self.bbox = numpy.array([ tuple(alien.bbox or (0, 0, 0, 0))
+                    for alien in a ], int).reshape(n, 4)
+        self.firing = Column((alien.laser != None for alien in a), bool)
+        self.lx = Column(( alien.laser or (None, (0, 0)) )[ 1 ][ 0 ]
+                    for alien in a)
+        self.ly = Column(( alien.laser or (None, (0, 0)) )[ 1 ][ 1 ]
+                    for alien in a)
+
+    def Per_Frame(self, frame_time):
+        self.firing[ : ] = False
+        steady = self.has_target.copy()
+        for i in numpy.flatnonzero(~ ( steady | self.done )).tolist():
+            self.__Retarget(i)
+
+        # Move, as Alien.Per_Frame does.
+        (x, y, ha) = (self.x, self.y, self.heading)
+        aa = self.attack_angle
+        tx = self.tx + ( numpy.cos(aa) * Alien.ATTACK_DIST )
+        ty = self.ty + ( numpy.sin(aa) * Alien.ATTACK_DIST )
+        zone = steady & self.in_zone
+        dist = numpy.hypot(tx - x, ty - y)
+        moving = steady & ~ self.in_zone & ( dist > 0.1 )
+
+        self.speed = numpy.where(moving, numpy.minimum(
+                    self.speed + Alien.ACC_PER_SECOND_PER_SECOND,
+                    Alien.MAX_DISTANCE_PER_SECOND), self.speed)
+        s = numpy.minimum(self.speed * float(frame_time), dist)
+        self.x = x = numpy.where(zone, tx,
+                    numpy.where(moving, x + ( numpy.cos(ha) * s ), x))
+        self.y = y = numpy.where(zone, ty,
+                    numpy.where(moving, y + ( numpy.sin(ha) * s ), y))
+        self.attack_angle = numpy.where(zone, aa + self.rotation, aa)
+        self.heading = numpy.where(zone, ha + self.rotation, ha)
+        self.countdown = numpy.where(zone, self.countdown - frame_time,
+                    self.countdown)
+        self.in_zone |= steady & ~ moving
+        self.rookie &= ~ zone
+
+        # Attack, alien by alien.
+        sound = False
+        for i in numpy.flatnonzero(zone).tolist():
+            alien = self.aliens[ i ]
+            if ( self.countdown[ i ] < 0 ):
+                # time to move on to next target
+                alien.current_target = None
+            elif ( alien.net.Damage(alien.current_target,
+                        alien.alien_tech_level, "aliens") ):
+                # Destroyed it!
+                alien.current_target = None
+            else:
+                alien.net.Popup(alien.current_target)
+                self.firing[ i ] = True
+                sound = sound or ( len(alien.targets) != 0 )
+                continue
+            self.has_target[ i ] = False
+
+        # Work out what to draw. The triangle was pointing along
+        # the heading from the start of the frame.
+        for (j, a) in enumerate([ 0, TWO_THIRDS_PI, - TWO_THIRDS_PI ]):
+            (px, py) = Grid_To_Scr((x + ( numpy.cos(a + ha) * Alien.SIZE ),
+                        y + ( numpy.sin(a + ha) * Alien.SIZE )))
+            self.px[ :, j ] = numpy.where(steady, px.astype(int),
+                        self.px[ :, j ])
+            self.py[ :, j ] = numpy.where(steady, py.astype(int),
+                        self.py[ :, j ])
+        (self.lx, self.ly) = Grid_To_Scr((self.tx, self.ty))
+        left = self.px.min(1)
+        top = self.py.min(1)
+        right = self.px.max(1) + 1
+        bottom = self.py.max(1) + 1
+        (lx, ly) = (self.lx.astype(int), self.ly.astype(int))
+        f = self.firing
+        left = numpy.where(f, numpy.minimum(left, lx), left)
+        top = numpy.where(f, numpy.minimum(top, ly), top)
+        right = numpy.where(f, numpy.maximum(right, lx + 1), right)
+        bottom = numpy.where(f, numpy.maximum(bottom, ly + 1), bottom)
+        self.bbox[ steady ] = numpy.column_stack((left, top,
+                    right - left, bottom - top))[ steady ]
+        self.placed |= steady
+
+        if ( sound ):
+            global alien_firing_sound
+            alien_firing_sound.Set(1.0)
+
+    def __Retarget(self, i):
+        alien = self.aliens[ i ]
+        if ( len(alien.targets) == 0 ):
+            alien.done = self.done[ i ] = True
+            return
+        alien.current_target = alien.targets.pop(0)
+        self.countdown[ i ] = Alien.MAX_TIME_PER_TARGET
+
+        # Compute initial attack angle
+        (tx, ty) = alien.current_target.pos
+        aa = math.atan2( float(self.y[ i ]) - ty , float(self.x[ i ]) - tx )
+        self.attack_angle[ i ] = aa
+        # Face target
+        self.heading[ i ] = aa + math.pi
+
+        (self.tx[ i ], self.ty[ i ]) = (tx, ty)
+        self.in_zone[ i ] = False
+        self.has_target[ i ] = True
+
+    def Draw(self, output, update_area):
+        (w, h) = output.get_size()
+        (left, top, width, height) = self.bbox.T
+        visible = ( self.placed & ( left < w ) & ( left + width > 0 )
+                    & ( top < h ) & ( top + height > 0 ))
+        for i in numpy.flatnonzero(visible).tolist():
+            alien = self.aliens[ i ]
+            points = zip(self.px[ i ].tolist(), self.py[ i ].tolist())
+            pygame.draw.polygon(output, alien.colour1, points) 
+            pygame.draw.polygon(output, alien.colour2, points, 1) 
+            if ( self.firing[ i ] ):
+                pygame.draw.line(output, (255, 255, 255), points[ 0 ],
+                        (float(self.lx[ i ]), float(self.ly[ i ])))
+            update_area(Rect(self.bbox[ i ].tolist()))
+
+    def Rookies(self):
+        return int(numpy.count_nonzero(self.rookie))
+
+    def Store(self):
+        for (i, alien) in enumerate(self.aliens):
+            alien.pos = (float(self.x[ i ]), float(self.y[ i ]))
+            alien.attack_angle = float(self.attack_angle[ i ])
+            alien.speed = float(self.speed[ i ])
+            alien.countdown = float(self.countdown[ i ])
+            alien.rotation = float(self.rotation[ i ])
+            alien.rookie = bool(self.rookie[ i ])
+            if ( self.has_target[ i ] or hasattr(alien, 'heading') ):
+                alien.heading = float(self.heading[ i ])
+                alien.in_zone = bool(self.in_zone[ i ])
+            alien.points = zip(self.px[ i ].tolist(), self.py[ i ].tolist())
+            alien.bbox = alien.laser = None
+            if ( self.placed[ i ] ):
+                alien.bbox = Rect(self.bbox[ i ].tolist())
+            if ( self.firing[ i ] ):
+                alien.laser = (alien.points[ 0 ],
+                        (float(self.lx[ i ]), float(self.ly[ i ])))
+
+
 def Init_Aliens():
     global alien_firing_sound
     alien_firing_sound = sound.Persisting_Sound("clicker")
@@ -0,0 +1,307 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+# Benchmarks for the simulation and drawing hot paths, run on
+# made-up networks of various sizes: a square lattice of nodes
+# three grid squares apart, every fourth one a steam maker, piped
+# to their neighbours and to the City. Large lattices get a map
+# big enough to hold them.
+#
+# python code/benchmark.py --sizes 10,100,1000 --output bench.json
+# python code/benchmark.py --baseline bench.json
+#
+# Each benchmark is run --repeat times on the same networks (the
+# random seed is fixed) and the best and median times are kept.
+# With --baseline, the results are compared with an earlier
+# --output file, and the exit status is 1 if anything became more
+# than --tolerance times slower.
+#
+
+from argparse import ArgumentParser
+import json , math , os , platform , random , sys , time , timeit
+import pygame
+
+import headless , gametime , draw_obj , mail , storms
+from primitives import *
+from map_items import Node, Well_Node
+from alien_invasion import Alien_Season
+from quakes import Quake_Season
+from network import Network
+from ui import User_Interface
+
+
+SIZES = [ 10, 100, 1000, 5000 ]
+SPACING = 3
+MARGIN = 4      # grid squares around the lattice
+
+
+def Lattice(n, seed=1):
+    # A network with (about) n nodes in a square lattice.
+    random.seed(seed)
+    net = Network(False)
+    side = int(math.ceil(math.sqrt(n)))
+    lattice = dict()
+    for i in xrange(n):
+        (x, y) = (i % side, i / side)
+        pos = (1 + ( x * SPACING ), 1 + ( y * SPACING ))
+        if ( i % 4 == 0 ):
+            node = Well_Node(pos)
+        else:
+            node = Node(pos)
+        net.Add_Finished_Node(node)
+        if ( net.ground_grid.get(pos) == node ):
+            lattice[ (x, y) ] = node
+
+    for ((x, y), node) in sorted(lattice.items()):
+        for other in [ lattice.get((x + 1, y)), lattice.get((x, y + 1)) ]:
+            if ( other != None ):
+                net.Add_Pipe(node, other)
+
+    nearest = min(lattice.values(),
+                key=lambda node: distance(node.pos, net.hub.pos))
+    net.Add_Pipe(net.hub, nearest)
+    Finish_Pipes(net)
+    return net
+
+def Lattice_Map_Size(n):
+    # The usual map, or a bigger one if the lattice wouldn't fit,
+    # so that quakes, storms and aliens reach all of it.
+    side = int(math.ceil(math.sqrt(n)))
+    extent = 1 + (( side - 1 ) * SPACING ) + MARGIN
+    (w, h) = GRID_SIZE
+    return (max(w, extent), max(h, extent))
+
+def Finish_Pipes(net):
+    for pipe in net.pipe_list:
+        pipe.health = pipe.max_health
+        pipe.complete = True
+
+def Settle(net, ticks=20):
+    # Get some steam flowing.
+    for i in xrange(ticks):
+        net.Steam_Think()
+
+
+# Each benchmark is a function of the network that returns the
+# thing to be timed, having done any set-up that isn't. A fresh
+# network is made for benchmarks that damage it.
+
+def Bench_Steam_Think(net):
+    return net.Steam_Think
+
+def Bench_Work_Pulse(net):
+    # One point of damage for a tenth of the pipes.
+    for pipe in net.pipe_list[ ::10 ]:
+        pipe.health -= 1
+        net.Queue_Work(pipe)
+    return lambda: net.Work_Pulse(len(net.pipe_list))
+
+def Bench_Add_Pipe(net):
+    # Diagonal pipes across the lattice squares, which cross
+    # nothing.
+    nodes = dict([ (node.pos, node) for node in net.node_list ])
+    pairs = []
+    for ((x, y), node) in sorted(nodes.items())[ ::3 ]:
+        other = nodes.get((x + SPACING, y + SPACING))
+        if ( other != None ):
+            pairs.append((node, other))
+    pairs = pairs[ :50 ]
+
+    def Run():
+        for (n1, n2) in pairs:
+            net.Add_Pipe(n1, n2)
+    return Run
+
+def Bench_Dig_Metal(net):
+    return net.dig_metal
+
+def Bench_Quake_Damage(net):
+    random.seed(2)
+    q = Quake_Season(net, 2.0) # 2.0: no new wells
+    q._Quake_Season__Generate_Quake()
+    return q._Quake_Season__Apply_Damage
+
+def Bench_Storm_Think(net):
+    random.seed(3)
+    s = [ storms.Storm(net, 1.0) for i in xrange(10) ]
+    def Run():
+        for storm in s:
+            storm.Think(gametime.TICK_LENGTH)
+    return Run
+
+def Bench_Alien_Targets(net):
+    a = Alien_Season(net, 1.0)
+    return lambda: a._Alien_Season__Compute_Targets(5)
+
+def Bench_Alien_Swarm(net):
+    # One alien for every ten nodes, over ten frames.
+    random.seed(4)
+    a = Alien_Season(net, 1.0)
+    while ( len(a.alien_list) < max(2, len(net.node_list) / 10) ):
+        a.Per_Period()
+    def Run():
+        for i in xrange(10):
+            a.Per_Frame(gametime.TICK_LENGTH)
+    return Run
+
+def Map_Surface(net, size=600):
+    # Grid squares are shrunk until the whole lattice is visible.
+    extent = max([ max(node.pos) for node in net.node_list ]) + 2
+    Set_Grid_Size(max(2, min(size / extent, size / Get_Map_Size()[ 0 ])))
+    draw_obj.Flush_Draw_Obj_Cache()
+    return pygame.Surface((size, size)).convert()
+
+def Bench_Draw_Game_Full(net):
+    output = Map_Surface(net)
+    ui = User_Interface(net, (output.get_width() + 200, output.get_height()))
+    season = Quake_Season(net, 1.0)
+    def Run():
+        net.dirty = True
+        ui.Draw_Game(output, season)
+    return Run
+
+def Bench_Draw_Game_Frame(net):
+    # A normal frame: dots moving along the pipes.
+    output = Map_Surface(net)
+    ui = User_Interface(net, (output.get_width() + 200, output.get_height()))
+    season = Quake_Season(net, 1.0)
+    ui.Draw_Game(output, season)
+    def Run():
+        ui.Frame_Advance(gametime.TICK_LENGTH)
+        draw_obj.Next_Frame()
+        ui.Draw_Game(output, season)
+    return Run
+
+# (name, function, makes changes to the network)
+BENCHMARKS = [
+    ("Steam_Think", Bench_Steam_Think, False),
+    ("Work_Pulse", Bench_Work_Pulse, True),
+    ("Add_Pipe", Bench_Add_Pipe, True),
+    ("dig_metal", Bench_Dig_Metal, False),
+    ("Quake_Damage", Bench_Quake_Damage, True),
+    ("Storm_Think", Bench_Storm_Think, True),
+    ("Alien_Targets", Bench_Alien_Targets, False),
+    ("Alien_Swarm", Bench_Alien_Swarm, True),
+    ("Draw_Game_Full", Bench_Draw_Game_Full, False),
+    ("Draw_Game_Frame", Bench_Draw_Game_Frame, False),
+]
+
+
+def Time(bench, make_net, shared, repeat):
+    times = []
+    for i in xrange(repeat):
+        if ( shared == None ):
+            net = make_net()
+        else:
+            net = shared
+        run = bench(net)
+        start = timeit.default_timer()
+        run()
+        times.append(timeit.default_timer() - start)
+    times.sort()
+    return (times[ 0 ], times[ len(times) / 2 ])
+
+def Run_All(sizes, names, repeat, log=None):
+    results = []
+    map_size = Get_Map_Size()
+    try:
+        for n in sizes:
+            Set_Map_Size(Lattice_Map_Size(n))
+            results.extend(Run_Size(n, names, repeat, log))
+    finally:
+        Set_Map_Size(map_size)
+    return results
+
+def Run_Size(n, names, repeat, log):
+    def Make_Net():
+        net = Lattice(n)
+        Settle(net)
+        return net
+    shared = Make_Net()
+
+    results = []
+    for (name, bench, changes) in BENCHMARKS:
+        if (( names != None ) and ( name not in names )):
+            continue
+        if ( changes ):
+            (best, median) = Time(bench, Make_Net, None, repeat)
+        else:
+            (best, median) = Time(bench, None, shared, repeat)
+        results.append(dict(name=name, nodes=n, best=best,
+                    median=median, repeat=repeat))
+        if ( log != None ):
+            log("%-16s %5u nodes  best %9.3f ms  median %9.3f ms" % (
+                    name, n, best * 1000.0, median * 1000.0))
+    return results
+
+def Compare(results, baseline, tolerance):
+    # Returns the results that are more than tolerance times
+    # slower than the baseline, as (result, old best) pairs.
+    old = dict([ ((r[ 'name' ], r[ 'nodes' ]), r[ 'best' ])
+                for r in baseline[ 'results' ] ])
+    slower = []
+    for r in results:
+        before = old.get((r[ 'name' ], r[ 'nodes' ]))
+        if (( before != None ) and ( r[ 'best' ] > before * tolerance )):
+            slower.append((r, before))
+    return slower
+
+
+def parse_args(argv):
+    p = ArgumentParser(description="Benchmarks for the game's hot paths")
+    p.add_argument("--sizes", default=",".join(map(str, SIZES)),
+        help="network sizes, in nodes")
+    p.add_argument("--only", action="append", default=None, metavar="NAME",
+        choices=[ name for (name, bench, changes) in BENCHMARKS ],
+        help="run just this benchmark (may be repeated)")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--output", help="write the results to this JSON file")
+    p.add_argument("--baseline",
+        help="compare with the results in this JSON file")
+    p.add_argument("--tolerance", type=float, default=1.25,
+        help="how much slower than the baseline is a regression")
+    return p.parse_args(argv)
+
+def Main(data_dir, argv):
+    args = parse_args(argv)
+    sizes = [ int(s) for s in args.sizes.split(',') ]
+
+    # As for a headless game, but drawing the mail and storms.
+    headless.Initialise(data_dir)
+    pygame.font.init()
+    mail.Set_Headless(False)
+    mail.Initialise()
+    storms.Init_Storms()
+    def Log(text):
+        print text
+        sys.stdout.flush()
+
+    results = Run_All(sizes, args.only, args.repeat, Log)
+
+    if ( args.output != None ):
+        f = file(args.output, "wb")
+        json.dump(dict(when=time.asctime(), platform=platform.platform(),
+                python=platform.python_version(),
+                pygame=pygame.version.ver, results=results), f, indent=1)
+        f.close()
+
+    if ( args.baseline != None ):
+        f = file(args.baseline, "rb")
+        baseline = json.load(f)
+        f.close()
+        slower = Compare(results, baseline, args.tolerance)
+        for (r, before) in slower:
+            print "SLOWER: %s, %u nodes: %1.3f ms, was %1.3f ms" % (
+                    r[ 'name' ], r[ 'nodes' ], r[ 'best' ] * 1000.0,
+                    before * 1000.0)
+        if ( len(slower) != 0 ):
+            return 1
+        print "No regressions against", args.baseline
+    return 0
+
+
+if ( __name__ == "__main__" ):
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.exit(Main(os.path.join(code_dir, '..', 'data'), sys.argv[ 1: ]))
+
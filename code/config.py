@@ -7,6 +7,7 @@ import pickle, startup, os, extra, primitives
 
 
 CFG_VERSION = "1.4"
+AUTOSAVE_INTERVAL = 30 # game days
 
 class Config:
     def __init__(self):
@@ -17,6 +18,7 @@ class Config:
         self.mute = True
         self.font_scale = fs
         self.seen_before = False
+        self.autosave_interval = AUTOSAVE_INTERVAL
 
 cfg = Config()
 
@@ -41,7 +43,10 @@ def Initialise(delete_file):
         cfg2 = pickle.load(f)
         f.close()
         if cfg2.version == CFG_VERSION:
-            # Configuration is valid, we can use it.
+            # Configuration is valid, we can use it. Settings added
+            # since it was written get their defaults.
+            for (name, value) in Config().__dict__.items():
+                cfg2.__dict__.setdefault(name, value)
             cfg = cfg2
     except Exception, x:
         pass
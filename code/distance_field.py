@@ -0,0 +1,95 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+
+# Distance fields. A Distance_Field knows, for every grid square
+# of the map, how far it is to the nearest of a set of seed squares,
+# so that "is this too close to a rock?" is a lookup rather than a
+# scan through every rock. Distances are straight-line (Euclidean)
+# and exact, but only up to a limit, which is all that such
+# questions need: then adding a seed only touches the squares within
+# the limit of it, and seeds can be added as they are placed.
+#
+# Squared distances are kept, as whole numbers, so that comparisons
+# with them are exact. With NumPy, the seeds are stamped into an
+# array in one vectorized pass. NumPy is optional: without it, the
+# same is done square by square.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Distance_Field:
+    def __init__(self, (w, h), limit, seeds=[]):
+        self.size = (w, h)
+        self.limit = limit
+        self.far = limit * limit   # squared distances stop here
+        self.seeds = []
+
+        # The squares nearer than the limit to a seed at (0,0).
+        r = int(limit)
+        self.disk = [ (dx, dy, ( dx * dx ) + ( dy * dy ))
+                for dx in xrange(-r, r + 1) for dy in xrange(-r, r + 1)
+                if ((( dx * dx ) + ( dy * dy )) < self.far ) ]
+
+        if ( numpy != None ):
+            self.d2 = numpy.empty((w, h), numpy.int32)
+            self.d2.fill(self.far)
+            (self.disk_x, self.disk_y, self.disk_d2) = [
+                    numpy.array(column, numpy.int32)
+                    for column in zip(*self.disk) ]
+        else:
+            self.d2 = [ [ self.far ] * h for x in xrange(w) ]
+
+        self.Add(seeds)
+
+    def Add(self, seeds):
+        # Add seed squares, given as (x,y) pairs.
+        seeds = list(seeds)
+        if ( len(seeds) == 0 ):
+            return
+        self.seeds.extend(seeds)
+        (w, h) = self.size
+
+        if ( numpy != None ):
+            s = numpy.array(seeds, numpy.int32)
+            x = ( s[ :, 0:1 ] + self.disk_x ).ravel()
+            y = ( s[ :, 1:2 ] + self.disk_y ).ravel()
+            d2 = numpy.tile(self.disk_d2, len(seeds))
+            inside = ( x >= 0 ) & ( x < w ) & ( y >= 0 ) & ( y < h )
+            numpy.minimum.at(self.d2, (x[ inside ], y[ inside ]),
+                        d2[ inside ])
+            return
+
+        for (sx, sy) in seeds:
+            for (dx, dy, d2) in self.disk:
+                x = sx + dx
+                y = sy + dy
+                if (( 0 <= x < w ) and ( 0 <= y < h )
+                and ( d2 < self.d2[ x ][ y ] )):
+                    self.d2[ x ][ y ] = d2
+
+    def Squared(self, (x, y)):
+        # Squared distance from (x,y) to the nearest seed, or the
+        # square of the limit if that is as far or further.
+        (w, h) = self.size
+        if (( 0 <= x < w ) and ( 0 <= y < h )):
+            if ( numpy != None ):
+                return int(self.d2[ x, y ])
+            return self.d2[ x ][ y ]
+
+        # Off the map: the seeds are checked one by one.
+        d2 = self.far
+        for (sx, sy) in self.seeds:
+            d2 = min(d2, (( x - sx ) ** 2 ) + (( y - sy ) ** 2 ))
+        return d2
+
+    def Within(self, pos, d):
+        # Is there a seed nearer to pos than d (which is no more
+        # than the limit)?
+        assert d <= self.limit
+        return ( self.Squared(pos) < ( d * d ))
+
@@ -17,7 +17,13 @@
 import pygame , math
 from pygame.locals import *
 
-import resource
+try:
+    import numpy
+    from pygame import surfarray
+except ImportError:
+    numpy = None
+
+import resource , sprite_cache
 from primitives import *
 
 
@@ -31,7 +37,14 @@ class Draw_Obj:
         Make_Cache_Item(self.key)
 
     def Draw(self, output, gpos, (sx, sy)):
-        cache[ self.key ].Draw(output, gpos, (sx, sy))
+        Get_Cache_Item(self.key).Draw(output, gpos, (sx, sy))
+
+    def Get_Rect(self, gpos):
+        return Get_Cache_Item(self.key).Get_Rect(gpos)
+
+    def Get_State(self):
+        # Changes whenever the image drawn changes.
+        return (self.key, Get_Cache_Item(self.key).Get_Colour())
 
 def Flush_Draw_Obj_Cache():
     global cache
@@ -41,6 +54,13 @@ def Next_Frame():
     global frame
     frame += 1
 
+def Get_Cache_Item(key):
+    # The cache may have been flushed since the Draw_Obj was made
+    # (or it may have come from a saved game).
+    if ( not cache.has_key(key) ):
+        Make_Cache_Item(key)
+    return cache[ key ]
+
 def Make_Cache_Item(key):
     if ( cache.has_key(key) ):
         return  # Done already.
@@ -48,6 +68,15 @@ def Make_Cache_Item(key):
     class Real_Draw_Obj:
         def __init__(self, key):
             (img_name, grid_size) = key
+            self.colours = [ 0, 0, 50, 100, 150, 200, 250, 250, 150 ]
+
+            disk_key = sprite_cache.Make_Key(img_name, grid_size)
+            loaded = sprite_cache.Load(disk_key)
+            if ( loaded != None ):
+                (self.frames, (self.offset_x, self.offset_y,
+                        self.animated)) = loaded
+                self.size = self.frames[ 0 ].get_size()
+                return
 
             img = resource.Load_Image(img_name)
             (w, h) = img.get_rect().bottomright
@@ -60,28 +89,74 @@ def Make_Cache_Item(key):
             r.center = (0,0)
             self.offset_x = r.left
             self.offset_y = r.top
-            self.frames = []
-            for c in [ 0, 0, 50, 100, 150, 200, 250, 250, 150 ]:
-                self.frames.append(self.__Colour_Substitute(c, img))
+            self.size = r.size
+            (self.frames, self.animated) = Colour_Frames(img, self.colours)
+            sprite_cache.Save(disk_key, self.frames,
+                    (self.offset_x, self.offset_y, self.animated))
 
-        def Draw(self, output, gpos, (sx, sy)):
+        def Get_Frame(self):
             global frame
 
+            if ( not self.animated ):
+                return 0
+            return ( frame / 2 ) % len(self.frames)
+
+        def Get_Colour(self):
+            if ( not self.animated ):
+                return None
+            return self.colours[ self.Get_Frame() ]
+
+        def Draw(self, output, gpos, (sx, sy)):
             (x,y) = Grid_To_Scr(gpos)
             x += self.offset_x - sx
             y += self.offset_y - sy
-            output.blit(self.frames[ ( frame / 2 ) % len(self.frames) ], (x,y))
-
-        def __Colour_Substitute(self, sub, image):
-            out = image.copy()
-            (w,h) = image.get_rect().bottomright
+            output.blit(self.frames[ self.Get_Frame() ], (x,y))
 
-            for y in xrange(h):
-                for x in xrange(w):
-                    (r,g,b,a) = out.get_at((x,y))
-                    if (( r > 200 ) and ( g < 30 ) and ( b < 30 )): # threshold
-                        out.set_at((x,y), (sub, 0, 0, a))
-            return out
+        def Get_Rect(self, gpos):
+            (x,y) = Grid_To_Scr(gpos)
+            return Rect((x + self.offset_x, y + self.offset_y), self.size)
 
     cache[ key ] = Real_Draw_Obj(key)
 
+# Animation frames: the bright red parts of the image are replaced
+# by each of the given shades of red in turn. Returns the frames, and
+# whether there were any red parts at all.
+
+def Colour_Frames(image, colours):
+    if ( numpy == None ):
+        return Colour_Frames_Per_Pixel(image, colours)
+
+    # One mask, then one masked assignment per distinct colour.
+    rgb = surfarray.pixels3d(image)
+    mask = (( rgb[ :, :, 0 ] > 200 ) & ( rgb[ :, :, 1 ] < 30 )
+                & ( rgb[ :, :, 2 ] < 30 )) # threshold
+    del rgb # unlocks the image
+    if ( not mask.any() ):
+        return ([ image ] * len(colours), False)
+
+    made = dict()
+    for sub in colours:
+        if ( not made.has_key(sub) ):
+            out = image.copy()
+            rgb = surfarray.pixels3d(out)
+            rgb[ mask ] = (sub, 0, 0)
+            del rgb
+            made[ sub ] = out
+    return ([ made[ sub ] for sub in colours ], True)
+
+def Colour_Frames_Per_Pixel(image, colours):
+    # Without NumPy.
+    animated = False
+    frames = []
+    (w,h) = image.get_rect().bottomright
+    for sub in colours:
+        out = image.copy()
+        for y in xrange(h):
+            for x in xrange(w):
+                (r,g,b,a) = out.get_at((x,y))
+                if (( r > 200 ) and ( g < 30 ) and ( b < 30 )): # threshold
+                    out.set_at((x,y), (sub, 0, 0, a))
+                    animated = True
+        frames.append(out)
+    return (frames, animated)
+
@@ -45,6 +45,21 @@ def Intersect_Grid_Square(gpos, (a,b)):
 
     return False
 
+# The grid squares within margin squares of the line from (x1,y1)
+# to (x2,y2). The line is marked every half square (or less), and
+# rounding (round or int) turns each mark into a grid square.
+def Line_Cells((x1,y1), (x2,y2), margin, rounding=round):
+    steps = int(max(abs(x2 - x1), abs(y2 - y1)) * 2.0) + 1
+    dx = float(x2 - x1) / steps
+    dy = float(y2 - y1) / steps
+    marked = set([ (int(rounding(x1 + ( dx * i ))),
+                    int(rounding(y1 + ( dy * i ))))
+                for i in xrange(steps + 1) ])
+    near = range(-margin, margin + 1)
+    # (Widened across, then down.)
+    row = set([ (x + d, y) for (x, y) in marked for d in near ])
+    return set([ (x, y + d) for (x, y) in row for d in near ])
+
 def Tile_Texture(output, name, rect):
     cr = output.get_clip()
     output.set_clip(rect)
@@ -79,11 +94,11 @@ def Make_Quake_SF_Points(off):
     # Quake fault lines must stay well away from the centre:
     # that's enforced here.
     crosses_centre = True
-    (x,y) = GRID_CENTRE
+    (x,y) = Get_Map_Centre()
     d = 7
     check = [ (x - d, y - d), (x + d, y + d),
             (x - d, y + d), (x + d, y - d) ]
-    (w,h) = GRID_SIZE
+    (w,h) = Get_Map_Size()
 
     while ( crosses_centre ):
         if ( random.randint(0,1) == 0 ):
@@ -91,7 +106,7 @@ def Make_Quake_SF_Points(off):
             finish = (random.randint(0,w - 1), h + off)
         else:
             start = (-off, random.randint(0,h - 1))
-            finish = (h + off, random.randint(0,h - 1))
+            finish = (w + off, random.randint(0,h - 1))
 
         crosses_centre = ( 
                 intersect.Intersect((start, finish),
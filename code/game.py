@@ -11,7 +11,7 @@ from pygame.locals import *
 
 import bresenham , intersect , extra , stats , mail , gametime
 import menu , startup , save_menu , save_game , config , resource
-import review , sound , tutor
+import review , sound , tutor , profiler , journal
 from primitives import *
 from quiet_season import Quiet_Season
 from alien_invasion import Alien_Season
@@ -22,12 +22,190 @@ from steam_model import Steam_Model
 from network import Network
 from ui import User_Interface
 from mail import New_Mail
+from autosave import Autosave
 
 
 
+FRAME_RATE = 35
+
 class Game_Data:
     pass
 
+# The simulation half of the game. These steps are shared by
+# Main_Loop and by headless runs (see headless.py), which have
+# no screen, sound or fonts.
+
+def New_Game(challenge):
+    g = Game_Data()
+    g.version = startup.Get_Game_Version()
+    g.sysinfo = extra.Get_System_Info()
+
+    # Steam network initialisation
+    Set_Map_Size(Get_New_Map_Size())
+    g.net = Network(( challenge == MENU_TUTORIAL ))
+
+    DIFFICULTY.Set(MENU_INTERMEDIATE)
+
+    # Establish equilibrium with initial network.
+    g.net.Solve_Equilibrium()
+
+    assert g.net.hub.Get_Pressure() >= PRESSURE_GOOD
+
+    if ( challenge != None ):
+        DIFFICULTY.Set(challenge)
+
+    # Game variables
+    g.season = SEASON_START
+    g.season_ends = 0
+    g.season_effect = 0
+    g.season_fx = Quiet_Season(g.net)
+    g.work_units_used = 0 
+    g.challenge = challenge
+    g.difficulty_level = 1.0
+    g.work_timer = 0.1
+    g.game_ends_at = None
+    g.game_running = True
+    g.game_time = gametime.Game_Time()
+    gametime.Set_Now(g.game_time.time())
+    g.historian = []
+    g.historian_time = 0
+    g.win = False
+    g.warning_given = False
+    g.wu_integral = 0
+    return g
+
+def Pressure_Effects(g, cur_time):
+    # You'll lose the game if the City stays in the danger
+    # zone for longer than a timeout.
+    pressure = g.net.hub.Get_Pressure()
+    if ( pressure < PRESSURE_DANGER ):
+        if ( g.game_ends_at == None ):
+            sound.FX("steamcrit")
+            g.warning_given = True
+
+            New_Mail("Danger! The City needs more steam!", (255,0,0))
+            g.game_ends_at = cur_time + DIFFICULTY.GRACE_TIME
+            New_Mail("Game will end on Day %u unless supplies are increased." % (
+                int(g.game_ends_at) ), (255,0,0))
+
+    elif ( pressure < PRESSURE_WARNING ):
+        g.game_ends_at = None
+
+    else:
+        if ( g.warning_given ):
+            sound.FX("steamres")
+            g.warning_given = False
+
+        g.game_ends_at = None
+
+def Periodic_Effects(g, cur_time):
+    if ( g.work_timer <= cur_time ):
+        # Fixed periodic effects, ten times a day
+        g.work_timer += 0.1
+        if ( g.work_timer < cur_time ):
+            g.work_timer = cur_time # far behind: don't catch up
+        g.wu_integral += ( g.net.hub.Get_Avail_Work_Units()
+                    - g.work_units_used )
+        t = profiler.Begin()
+        g.work_units_used = g.net.Work_Pulse(g.net.hub.Get_Avail_Work_Units())
+        profiler.End("Work_Pulse", t)
+
+        t = profiler.Begin()
+        g.net.Steam_Think()
+        profiler.End("Steam_Think", t)
+        t = profiler.Begin()
+        g.net.dig_metal()
+        profiler.End("dig_metal", t)
+        g.net.Expire_Popups()
+        tutor.Examine_Game(g)
+
+    if ( g.season_effect <= cur_time ):
+        # Seasonal periodic effects
+        g.season_effect = cur_time + g.season_fx.Get_Period()
+        t = profiler.Begin()
+        g.season_fx.Per_Period()
+        profiler.End("Per_Period", t)
+    
+    if ((( not tutor.Permit_Season_Change() )
+    and ( g.season == SEASON_QUIET ))
+    or ( g.challenge == MENU_PEACEFUL )):
+        g.season_ends = cur_time + 2
+
+    if ( g.season_ends <= cur_time ):
+        # Season change
+        if ( g.season == SEASON_START ):
+            g.season = SEASON_QUIET
+            g.season_fx = Quiet_Season(g.net)
+        elif (( g.season == SEASON_QUIET )
+        or ( g.season == SEASON_STORM )):
+            g.season = SEASON_ALIEN
+            g.season_fx = Alien_Season(g.net, g.difficulty_level)
+            sound.FX("aliensappr")
+        elif ( g.season == SEASON_ALIEN ):
+            g.season = SEASON_QUAKE
+            g.season_fx = Quake_Season(g.net, g.difficulty_level)
+            if ( not tutor.Active() ): # hack...
+                sound.FX("quakewarn")
+        elif ( g.season == SEASON_QUAKE ):
+            g.season = SEASON_STORM
+            g.season_fx = Storm_Season(g.net, g.difficulty_level)
+            g.difficulty_level *= 1.2 # 20% harder..
+            sound.FX("stormwarn")
+        else:
+            assert False
+        g.season_ends = cur_time + LENGTH_OF_SEASON
+        g.season_effect = cur_time + ( g.season_fx.Get_Period() / 2 )
+
+        if ( g.challenge != MENU_PEACEFUL ):
+            New_Mail("The " + g.season_fx.name + 
+                            " season has started.", (200,200,200))
+
+def Check_Game_End(g, cur_time):
+    # Returns True if the game has just ended.
+    if (( g.game_ends_at != None )
+    and ( g.game_ends_at <= cur_time )
+    and ( g.game_running )):
+        # Game over - you lose
+        g.game_running = False
+        New_Mail("The City ran out of steam.", (255,0,0))
+        New_Mail("Game Over!", (255,255,0))
+        sound.FX("krankor")
+        return True
+    
+    elif (( g.net.hub.tech_level >= DIFFICULTY.CITY_MAX_TECH_LEVEL )
+    and ( g.game_running )):
+        # Game over - you win!
+        g.game_running = False
+        g.win = True
+        New_Mail("The City is now fully upgraded!", (255,255,255))
+        New_Mail("You have won the game!", (255,255,255))
+        sound.FX("applause")
+        return True
+
+    return False
+
+def Record_History(g, cur_time):
+    if (( g.historian_time <= cur_time )
+    and ( g.game_running )):
+        g.historian.append(review.Analyse_Network(g))
+        g.historian_time = cur_time + 4
+
+def Tick(g):
+    # Advance the game by one fixed step (gametime.TICK_LENGTH).
+    # Returns True if the game has just ended.
+    g.game_time.Advance(gametime.TICK_LENGTH)
+    cur_time = g.game_time.time()
+    mail.Set_Day(g.game_time.Get_Day())
+
+    Pressure_Effects(g, cur_time)
+    t = profiler.Begin()
+    g.season_fx.Per_Frame(gametime.TICK_LENGTH)
+    profiler.End("Per_Frame", t)
+    Periodic_Effects(g, cur_time)
+    just_ended = Check_Game_End(g, cur_time)
+    Record_History(g, cur_time)
+    return just_ended
+
 def Main_Loop(screen, clock, (width, height), 
             restore_pos, challenge):
     # Initialisation of screen things.
@@ -39,10 +217,12 @@ def Main_Loop(screen, clock, (width, height),
 
     draw_obj.Flush_Draw_Obj_Cache() # in case of resize
     
-    # Grid setup
+    # Grid setup: at the normal zoom, GRID_SIZE squares fit on
+    # the screen, or the whole map if it is smaller.
     (w,h) = GRID_SIZE
     assert w == h
-    Set_Grid_Size(height / h)
+    Set_Grid_Size(height / min(h, max(Get_New_Map_Size())))
+    Set_View_Origin((0,0))
 
     # Windows..
     game_screen_rect = Rect(0, 0, menu_margin, height)
@@ -102,31 +282,13 @@ def Main_Loop(screen, clock, (width, height),
 
     stats_surf.fill((0,0,0))
 
-    FRAME_RATE = 35
-
     alarm_sound = sound.Persisting_Sound("emergency")
 
-    teaching = ( challenge == MENU_TUTORIAL )
-
     # Game data holder
-    g = Game_Data()
-    g.version = startup.Get_Game_Version()
-    g.sysinfo = extra.Get_System_Info()
-
-    # Steam network initialisation
-    g.net = Network(teaching)
-
-    DIFFICULTY.Set(MENU_INTERMEDIATE)
-
-    # Establish equilibrium with initial network.
-    for i in xrange(300):
-        g.net.Steam_Think()
-        if ( g.net.hub.Get_Pressure() >= PRESSURE_GOOD ):
-            if ( DEBUG ):
-                print i,'steps required for equilibrium'
-            break
-
-    assert g.net.hub.Get_Pressure() >= PRESSURE_GOOD
+    if ( restore_pos == None ):
+        g = New_Game(challenge)
+    else:
+        g = New_Game(None)
 
     # UI setup
     ui = User_Interface(g.net, (width,height))
@@ -162,29 +324,9 @@ def Main_Loop(screen, clock, (width, height),
     rt_then = time.time()
     fps_count = 0
     fps_time = rt_then
-    autosave_timer = 0
+    ticker = gametime.Fixed_Step()
+    refresh_all = True
 
-    if ( restore_pos == None ):
-        DIFFICULTY.Set(challenge)
-    
-    
-    # Game variables
-    g.season = SEASON_START
-    g.season_ends = 0
-    g.season_effect = 0
-    g.season_fx = Quiet_Season(g.net)
-    g.work_units_used = 0 
-    g.challenge = challenge
-    g.difficulty_level = 1.0
-    g.work_timer = 0.1
-    g.game_ends_at = None
-    g.game_running = True
-    g.game_time = gametime.Game_Time()
-    g.historian = []
-    g.historian_time = 0
-    g.win = False
-    g.warning_given = False
-    g.wu_integral = 0
     mail.Set_Day(g.game_time.Get_Day())
 
     def Summary(g):
@@ -204,16 +346,27 @@ def Main_Loop(screen, clock, (width, height),
     # Almost ready to start... but are we starting
     # from a savegame?
     def Restore(g, cmd):
-        (g2, result) = save_game.Load(g, cmd)
+        if ( cmd == save_game.JOURNAL_SLOT ):
+            (g2, result) = journal.Load(g, Tick)
+        else:
+            (g2, result) = save_game.Load(g, cmd)
         if ( result == None ):
             g = g2
+            Set_Map_Size(g.net.map_size)
             ui.net = g.net
+            ui.camera.Centre_On(g.net.hub.pos)
+            g.net.dirty = True # redraw the map
             mail.Initialise()
             mail.Set_Day(g.game_time.Get_Day())
             assert g.challenge != None
             DIFFICULTY.Set(g.challenge)
+            gametime.Set_Now(g.game_time.time())
+            if ( cmd != save_game.JOURNAL_SLOT ):
+                # (A journal is replayed right up to where it ended.)
+                g.net.Solve_Equilibrium()
             New_Mail("Game restored. It is the " + 
                 g.season_fx.name + " season.")
+            journal.Start(g)
         else:
             New_Mail(result)
         return g
@@ -229,6 +382,9 @@ def Main_Loop(screen, clock, (width, height),
         tutor.On(( menu_margin * 40 ) / 100)
 
     cur_time = g.game_time.time()
+    autosave = Autosave(config.cfg.autosave_interval, cur_time)
+    if ( restore_pos == None ):
+        journal.Start(g)
 
     # Main loop
     while ( loop_running ):
@@ -241,6 +397,7 @@ def Main_Loop(screen, clock, (width, height),
         # Insert delay...
         # Hmm, I'm not sure if I know what this does.
         clock.tick(FRAME_RATE)
+        frame_start = profiler.Begin()
 
         rt_now = time.time()
         rt_frame_length = rt_now - rt_then
@@ -252,15 +409,31 @@ def Main_Loop(screen, clock, (width, height),
             fps_time = rt_now 
             fps_count = 0
 
+        # The simulation runs in fixed steps, as many as the real
+        # time since the last frame is worth.
+        just_ended = False
         if ( not menu_inhibit ):
             if ( not tutor.Frozen () ):
-                g.game_time.Advance(rt_frame_length)
+                t = profiler.Begin()
+                for i in xrange(ticker.Ticks(rt_frame_length)):
+                    just_ended = Tick(g)
+                    journal.Tick(g)
+                    if ( just_ended ):
+                        break
+                profiler.End("Ticks", t)
             draw_obj.Next_Frame() # Flashing lights on the various items
 
         cur_time = g.game_time.time()
         mail.Set_Day(g.game_time.Get_Day())
             
-        ui.Draw_Game(game_screen_surf, g.season_fx)
+        t = profiler.Begin()
+        game_rects = ui.Draw_Game(game_screen_surf, g.season_fx)
+        profiler.End("Draw_Game", t)
+        if ( profiler.overlay ):
+            area = profiler.Draw(game_screen_surf)
+            ui.Update_Area(area) # so that it is erased next frame
+            if ( game_rects != None ):
+                game_rects.append(area.move(game_screen_surf.get_abs_offset()))
 
         #if ( flash ):
         #ui.Draw_Selection(picture_surf)
@@ -273,12 +446,14 @@ def Main_Loop(screen, clock, (width, height),
             until_next = [ ((128,128,128), 12, "(%d days until next season)" %
                         (( g.season_ends - cur_time ) + 1 )) ]
 
+        t = profiler.Begin()
         ui.Draw_Stats(stats_surf, [
               ((128,0,128), 18, "Day %u" % g.game_time.Get_Day()),
               ((128,128,0), 18, g.season_fx.name + " season") ] +
               until_next + 
                 g.season_fx.Get_Extra_Info())
         ui.Draw_Controls(controls_surf)
+        profiler.End("Draw_Stats", t)
 
 
         if ( menu_inhibit ):
@@ -289,19 +464,7 @@ def Main_Loop(screen, clock, (width, height),
         supply = g.net.hub.Get_Steam_Supply()
         demand = g.net.hub.Get_Steam_Demand()
         if ( g.net.hub.Get_Pressure() < PRESSURE_DANGER ):
-            # You'll lose the game if you stay in this zone
-            # for longer than a timeout. Also, an
-            # alarm will sound.
-
-            if ( g.game_ends_at == None ):
-                sound.FX("steamcrit")
-                g.warning_given = True
-
-                New_Mail("Danger! The City needs more steam!", (255,0,0))
-                g.game_ends_at = cur_time + DIFFICULTY.GRACE_TIME
-                New_Mail("Game will end on Day %u unless supplies are increased." % (
-                    int(g.game_ends_at) ), (255,0,0))
-
+            # An alarm sounds while the City is in danger.
             if ( flash ): 
                 demand_colour = (255, 0, 0)
                 if ( not menu_inhibit ):
@@ -312,7 +475,6 @@ def Main_Loop(screen, clock, (width, height),
 
         elif ( g.net.hub.Get_Pressure() < PRESSURE_WARNING ):
 
-            g.game_ends_at = None
             if ( flash ): 
                 demand_colour = (255, 100, 0)
                 if ( not menu_inhibit ):
@@ -322,16 +484,11 @@ def Main_Loop(screen, clock, (width, height),
                 stats_back = (50, 25, 0)
         else:
 
-            if ( g.warning_given ):
-                sound.FX("steamres")
-                g.warning_given = False
-
             if ( g.net.hub.Get_Pressure() < PRESSURE_OK ):
                 demand_colour = (128, 128, 0)
             else:
                 demand_colour = (0, 128, 0)
 
-            g.game_ends_at = None
             alarm_sound.Set(0.0)
 
         avw = g.net.hub.Get_Avail_Work_Units()
@@ -353,84 +510,21 @@ def Main_Loop(screen, clock, (width, height),
         if ( g.challenge == MENU_TUTORIAL ):
             tutor.Draw(screen, g)
 
-        pygame.display.flip()
+        # Only the parts of the map that changed are sent to the
+        # display, unless something covers it or it was all redrawn.
+        t = profiler.Begin()
+        if (( game_rects == None ) or ( menu_inhibit ) or ( refresh_all )
+        or ( g.challenge == MENU_TUTORIAL )):
+            pygame.display.flip()
+            refresh_all = False
+        else:
+            pygame.display.update(game_rects + 
+                    [ stats_rect, global_stats_rect, controls_rect ])
+        profiler.End("display", t)
 
         if ( not menu_inhibit ):
-            g.season_fx.Per_Frame(rt_frame_length)
             ui.Frame_Advance(rt_frame_length)
 
-        # Timing effects
-        if ( g.work_timer <= cur_time ):
-            # Fixed periodic effects
-            g.work_timer = cur_time + 0.1
-            g.wu_integral += wu_unused
-            g.work_units_used = g.net.Work_Pulse(g.net.hub.Get_Avail_Work_Units())
-
-            g.net.Steam_Think()
-            g.net.dig_metal()
-            g.net.Expire_Popups()
-            tutor.Examine_Game(g)
-
-        if ( g.season_effect <= cur_time ):
-            # Seasonal periodic effects
-            g.season_effect = cur_time + g.season_fx.Get_Period()
-            g.season_fx.Per_Period()
-        
-        if ((( not tutor.Permit_Season_Change() )
-        and ( g.season == SEASON_QUIET ))
-        or ( g.challenge == MENU_PEACEFUL )):
-            g.season_ends = cur_time + 2
-
-        if ( g.season_ends <= cur_time ):
-            # Season change
-            if ( g.season == SEASON_START ):
-                g.season = SEASON_QUIET
-                g.season_fx = Quiet_Season(g.net)
-            elif (( g.season == SEASON_QUIET )
-            or ( g.season == SEASON_STORM )):
-                g.season = SEASON_ALIEN
-                g.season_fx = Alien_Season(g.net, g.difficulty_level)
-                sound.FX("aliensappr")
-            elif ( g.season == SEASON_ALIEN ):
-                g.season = SEASON_QUAKE
-                g.season_fx = Quake_Season(g.net, g.difficulty_level)
-                if ( not tutor.Active() ): # hack...
-                    sound.FX("quakewarn")
-            elif ( g.season == SEASON_QUAKE ):
-                g.season = SEASON_STORM
-                g.season_fx = Storm_Season(g.net, g.difficulty_level)
-                g.difficulty_level *= 1.2 # 20% harder..
-                sound.FX("stormwarn")
-            else:
-                assert False
-            g.season_ends = cur_time + LENGTH_OF_SEASON
-            g.season_effect = cur_time + ( g.season_fx.Get_Period() / 2 )
-
-            if ( g.challenge != MENU_PEACEFUL ):
-                New_Mail("The " + g.season_fx.name + 
-                                " season has started.", (200,200,200))
-
-        just_ended = False
-        if (( g.game_ends_at != None )
-        and ( g.game_ends_at <= cur_time )
-        and ( g.game_running )):
-            # Game over - you lose
-            g.game_running = False
-            New_Mail("The City ran out of steam.", (255,0,0))
-            New_Mail("Game Over!", (255,255,0))
-            sound.FX("krankor")
-            just_ended = True
-        
-        elif (( g.net.hub.tech_level >= DIFFICULTY.CITY_MAX_TECH_LEVEL )
-        and ( g.game_running )):
-            # Game over - you win!
-            g.game_running = False
-            g.win = True
-            New_Mail("The City is now fully upgraded!", (255,255,255))
-            New_Mail("You have won the game!", (255,255,255))
-            sound.FX("applause")
-            just_ended = True
-
         if ( just_ended ):
             current_menu = in_game_menu = menu.Menu([
                 (None, None, []),
@@ -439,6 +533,7 @@ def Main_Loop(screen, clock, (width, height),
             in_game_menu.Select(None)
 
         # Events
+        t = profiler.Begin()
         e = pygame.event.poll()
         while ( e.type != NOEVENT ):
             if e.type == QUIT:
@@ -448,6 +543,16 @@ def Main_Loop(screen, clock, (width, height),
             elif (( e.type == MOUSEBUTTONDOWN )
             or ( e.type == MOUSEMOTION )):
                 if (( e.type == MOUSEBUTTONDOWN ) 
+                and ( e.button in [ 4, 5 ] )):
+                    # mouse wheel: zoom
+                    if (( not menu_inhibit )
+                    and ( game_screen_rect.collidepoint(e.pos) )):
+                        if ( e.button == 4 ):
+                            ui.Zoom(1, e.pos)
+                        else:
+                            ui.Zoom(-1, e.pos)
+
+                elif (( e.type == MOUSEBUTTONDOWN ) 
                 and ( e.button != 1 )):
                     if ( not menu_inhibit ):
                         ui.Right_Mouse_Down()
@@ -472,7 +577,7 @@ def Main_Loop(screen, clock, (width, height),
                 if ( not menu_inhibit ):
                     from map_items import Pipe
                     if e.key == 32 and isinstance(ui.selection, Pipe):
-                        ui.selection.toggle_valve()
+                        journal.Do(g.net, 'valve', ui.selection)
                     else:
                         ui.Key_Press(e.key)
 
@@ -492,6 +597,7 @@ def Main_Loop(screen, clock, (width, height),
                         g.game_ends_at = cur_time
 
             e = pygame.event.poll()
+        profiler.End("events", t)
 
         # Any commands from the menu?
         if ( menu_inhibit ):
@@ -554,24 +660,26 @@ def Main_Loop(screen, clock, (width, height),
                 if ( cmd != None ):
                     # Back to game.
                     Special_Refresh()
+                    refresh_all = True
                     current_menu = in_game_menu
                     ui.Reset()
 
-        if (( autosave_timer <= cur_time )
-        and ( g.game_running )
-        and ( DEBUG )
-        and ( not menu_inhibit )):
-            # Autosave is slow, so it's really a debugging feature.
-            save_game.Save(g, 11, "Autosave")
-            autosave_timer = cur_time + 60
+        if ( not menu_inhibit ):
+            t = profiler.Begin()
+            error = autosave.Tick(g, cur_time)
+            profiler.End("Autosave", t)
+            if ( error != None ):
+                New_Mail(error)
+            error = journal.Error()
+            if ( error != None ):
+                New_Mail(error)
+
+        profiler.End("frame", frame_start)
 
-        if (( g.historian_time <= cur_time )
-        and ( g.game_running )
-        and ( not menu_inhibit )):
-            g.historian.append(review.Analyse_Network(g))
-            g.historian_time = cur_time + 4
 
     tutor.Off()
+    autosave.Wait()
+    journal.Stop()
 
     # About to exit. Blackout.
     screen.fill((0,0,0)) 
@@ -2,8 +2,24 @@
 # 20,000 Light Years Into Space
 # This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
 # 
+#
+# Game time is measured in days. The simulation moves in fixed
+# steps of TICK_LENGTH days, whatever the frame rate: Main_Loop
+# asks a Fixed_Step how many ticks the real time since the last
+# frame is worth, and headless games just run tick after tick.
 
+TICK_LENGTH = 1.0 / 35      # days per tick (one tick per frame at 35 fps)
+MAX_TICKS_PER_FRAME = 5     # catch-up cap: slower machines run slower
 
+__now = 0.0
+
+def Now():
+    # The time of the game in progress, for items that need it.
+    return __now
+
+def Set_Now(t):
+    global __now
+    __now = t
 
 
 class Game_Time:
@@ -12,6 +28,7 @@ class Game_Time:
 
     def Advance(self,step):
         self.__day += step
+        Set_Now(self.__day)
 
     def time(self):
         return self.__day
@@ -20,3 +37,22 @@ class Game_Time:
         return int(self.__day)
 
 
+class Fixed_Step:
+    def __init__(self, tick_length=TICK_LENGTH, 
+                max_ticks=MAX_TICKS_PER_FRAME):
+        self.tick_length = tick_length
+        self.max_ticks = max_ticks
+        self.accumulator = 0.0
+
+    def Ticks(self, real_time):
+        # Number of ticks to run for this much real time (one day
+        # per second). Time beyond the catch-up cap is dropped.
+        self.accumulator += real_time
+        n = int(self.accumulator / self.tick_length)
+        if ( n > self.max_ticks ):
+            n = self.max_ticks
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= n * self.tick_length
+        return n
+
@@ -0,0 +1,124 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+
+# A spatial index for map items. The map is split into grid squares
+# and each item is filed under every square it covers, so finding
+# what lies along a pipe route (or near a point) only looks at the
+# items in the squares concerned, not at every item on the map.
+#
+# The squares are also grouped into chunks of CHUNK_SIZE by CHUNK_SIZE,
+# so that finding everything in an area of the map (such as the part
+# that is on the screen) costs a few lookups per chunk, however big
+# the map is and however many empty squares there are.
+
+CHUNK_SIZE = 16
+
+def Chunk((x,y)):
+    return (x / CHUNK_SIZE, y / CHUNK_SIZE)
+
+class Grid_Index:
+    def __init__(self):
+        self.cells = dict()         # grid square -> list of items
+        self.item_cells = dict()    # item -> grid squares covered
+        self.chunks = dict()        # chunk -> set of items
+        self.order = dict()         # item -> when it was added
+        self.serial = 0
+        self.changes = 0            # counts every Add and Remove
+
+    def Add(self, item, cells):
+        assert not self.item_cells.has_key(item)
+        cells = list(set(cells))
+        self.item_cells[ item ] = cells
+        self.serial += 1
+        self.changes += 1
+        self.order[ item ] = self.serial
+        for gpos in cells:
+            if ( self.cells.has_key(gpos) ):
+                self.cells[ gpos ].append(item)
+            else:
+                self.cells[ gpos ] = [ item ]
+        for c in set([ Chunk(gpos) for gpos in cells ]):
+            if ( self.chunks.has_key(c) ):
+                self.chunks[ c ].add(item)
+            else:
+                self.chunks[ c ] = set([ item ])
+
+    def Remove(self, item):
+        if ( not self.item_cells.has_key(item) ):
+            return False
+        cells = self.item_cells.pop(item)
+        del self.order[ item ]
+        self.changes += 1
+        for gpos in cells:
+            l = self.cells[ gpos ]
+            l.remove(item)
+            if ( len(l) == 0 ):
+                del self.cells[ gpos ]
+        for c in set([ Chunk(gpos) for gpos in cells ]):
+            s = self.chunks[ c ]
+            s.discard(item)
+            if ( len(s) == 0 ):
+                del self.chunks[ c ]
+        return True
+
+    def Contains(self, item):
+        return self.item_cells.has_key(item)
+
+    def Get(self, gpos, kind=None):
+        # Items covering one grid square, optionally only those of
+        # the given class.
+        l = self.cells.get(gpos, [])
+        if ( kind == None ):
+            return list(l)
+        return [ item for item in l if isinstance(item, kind) ]
+
+    def Find(self, cells, kind=None):
+        # Items covering any of the given grid squares.
+        out = set([])
+        for gpos in cells:
+            l = self.cells.get(gpos)
+            if ( l != None ):
+                out.update(l)
+        if ( kind != None ):
+            out = set([ item for item in out if isinstance(item, kind) ])
+        return out
+
+    def Find_In_Area(self, rect, kind=None):
+        # Items covering (or close to: it's done by chunk) the grid
+        # squares in a Rect.
+        (x1, y1) = Chunk(rect.topleft)
+        (x2, y2) = Chunk((rect.right - 1, rect.bottom - 1))
+        out = set([])
+        for cx in xrange(x1, x2 + 1):
+            for cy in xrange(y1, y2 + 1):
+                s = self.chunks.get((cx, cy))
+                if ( s != None ):
+                    out.update(s)
+        if ( kind != None ):
+            out = set([ item for item in out if isinstance(item, kind) ])
+        return out
+
+    def Occupied_Cells(self):
+        return self.cells.keys()
+
+    def __len__(self):
+        return len(self.item_cells)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('changes', 0)
+        if ( not self.__dict__.has_key('chunks') ):
+            # Saved before there were chunks.
+            self.chunks = dict()
+            for (item, cells) in self.item_cells.iteritems():
+                for c in set([ Chunk(gpos) for gpos in cells ]):
+                    self.chunks.setdefault(c, set([])).add(item)
+        if ( not self.__dict__.has_key('order') ):
+            self.order = dict()
+            self.serial = 0
+            for item in self.item_cells.keys():
+                self.serial += 1
+                self.order[ item ] = self.serial
+
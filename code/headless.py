@@ -0,0 +1,82 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+# Headless games. The network, the seasons and the statistics
+# run exactly as in Main_Loop, but with no window, sound or fonts,
+# and one tick after another as fast as the CPU allows. Used for
+# balance and regression runs: see "--headless" in main.py.
+#
+
+import os , random , pygame
+
+import game , mail , resource , storms , alien_invasion , quakes , tutor
+import journal , save_game
+from primitives import *
+
+
+def Initialise(data_dir):
+    # Map items still load their images, so a dummy display
+    # is needed for that.
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    resource.DATA_DIR = data_dir
+    resource.No_Sound()
+    pygame.display.init()
+    if ( pygame.display.get_surface() == None ):
+        pygame.display.set_mode((1, 1), 0, 32)
+
+    mail.Set_Headless(True)
+    mail.Initialise()
+    tutor.Off()
+    storms.Init_Storms(False)
+    alien_invasion.Init_Aliens()
+    quakes.Init_Quakes()
+
+def Run(challenge, ticks, seed=None, policy=None):
+    # Play one game for up to "ticks" ticks of gametime.TICK_LENGTH.
+    # If given, policy(g) is called after every tick to act as the
+    # player. Returns the game data.
+    if ( seed != None ):
+        random.seed(seed)
+
+    g = game.New_Game(challenge)
+    mail.Set_Day(g.game_time.Get_Day())
+
+    for i in xrange(ticks):
+        game.Tick(g)
+        if ( not g.game_running ):
+            break
+
+        if ( policy != None ):
+            policy(g)
+
+    return g
+
+def Replay(name):
+    # Replay a journal from its first snapshot ("--replay").
+    # Returns the game and the differences found, as journal.Play.
+    f = file(name, "rb")
+    f.read(save_game.HEADER_SIZE)
+    records = journal.Read_Records(f)
+    f.close()
+    (g, problems) = journal.Play(records, game.Tick, True)
+    mail.Set_Day(g.game_time.Get_Day())
+    return (g, problems)
+
+def Summary(g):
+    if ( g.game_running ):
+        result = "running"
+    elif ( g.win ):
+        result = "won"
+    else:
+        result = "lost"
+
+    hub = g.net.hub
+    return ("Day %u: game %s, %s season, supply %1.1f U, demand %1.1f U, "
+            "pressure %1.2f, %u nodes, %u pipes, city tech level %u" % (
+            g.game_time.Get_Day(), result, g.season_fx.name,
+            hub.Get_Steam_Supply(), hub.Get_Steam_Demand(),
+            hub.Get_Pressure(), len(g.net.node_list),
+            len(g.net.pipe_list), hub.tech_level))
+
@@ -0,0 +1,402 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+# The journal ("--journal"): a log of the game as it is played.
+# Every so often a snapshot of the whole game is written (see
+# save_format.py), and between snapshots, every player command and
+# every bit of season damage is appended as it happens. A game is
+# restored from the last snapshot by running the ticks after it
+# again and carrying out the same commands at the same ticks; the
+# simulation only draws on the "random" module, whose state is kept
+# with each snapshot, so it does just what it did before. (Nothing
+# else may draw on it between ticks: the UI has its own.) The damage
+# done by the seasons is in the journal to check that it did.
+#
+# So the journal is always up to date, at the cost of a few bytes
+# per command, and it doubles as a replay for debugging: replayed
+# from the first snapshot ("--replay FILE"), each later snapshot is
+# compared with the game as replayed.
+#
+# The file begins with a label, like a saved game, so that it can be
+# listed in the Restore menu (save_game.JOURNAL_SLOT). Then:
+#
+#   MAGIC, then the format version (2 bytes)
+#   records of: tag (4 bytes), length (4 bytes), data
+#
+# A SNAP record holds the tick, the random state and the snapshot;
+# the others hold a pickled tuple that begins with the tick. Ticks
+# are counted from the start of the journal. Records are written by
+# a worker thread, in order, so the main loop only waits for the
+# snapshot to be taken. If writing fails, the journal stops, and the
+# error is mailed to the player (see Error).
+#
+
+import cPickle , os , Queue , random , struct , threading , time
+from cStringIO import StringIO
+
+# save_game and save_format are imported when needed, as they
+# import the Network, which imports this module.
+import config , gametime
+from map_items import *
+from primitives import *
+
+
+MAGIC = "LYJRNL"
+FORMAT_VERSION = 1
+
+SNAPSHOT_INTERVAL = 10  # game days
+TIME_INTERVAL = 1       # game days: the journal is never further behind
+
+# Player commands, and the Network methods that carry them out.
+COMMANDS = {
+    'node' : "Build_Node",
+    'well_node' : "Build_Well_Node",
+    'pipe' : "Add_Pipe",
+    'destroy' : "Destroy",
+    'upgrade' : "Buy_Upgrade",
+    'free_upgrade' : "Upgrade",     # the control menu's Upgrade button
+    'valve' : "Toggle_Valve",
+}
+
+__enabled = False
+__current = None    # the Journal being written, or the Replay in progress
+
+
+def Enable(on):
+    global __enabled
+    __enabled = on
+
+def Is_Enabled():
+    return __enabled
+
+
+# Hooks for the rest of the game.
+
+def Do(net, command, *args):
+    # Carry out a player command, and journal it.
+    if ( __current != None ):
+        __current.Command(command, [ Ref(a) for a in args ])
+    return getattr(net, COMMANDS[ command ])(*args)
+
+def Event(item, dmg_level, by):
+    # Damage done by a season (see Network.Damage).
+    if ( __current != None ):
+        __current.Event(Ref(item), dmg_level, by)
+
+def Start(g):
+    # Begin a new journal for the game g, if journalling is on.
+    global __current
+    import save_game
+    Stop()
+    if ( __enabled ):
+        __current = Journal(g, save_game.Make_Save_Name(
+                    save_game.JOURNAL_SLOT))
+
+def Tick(g):
+    # Called after each tick of the game.
+    if ( __current != None ):
+        __current.Tick(g)
+
+def Flush():
+    # Wait until everything so far is written.
+    if ( __current != None ):
+        __current.queue.join()
+
+def Error():
+    # Returns an error message if writing the journal went wrong
+    # (just once), otherwise None. Called once per frame.
+    if ( __current != None ):
+        return __current.Take_Error()
+    return None
+
+def Stop():
+    global __current
+    if ( __current != None ):
+        __current.Close()
+    __current = None
+
+
+# Map items are journalled by position, as they will be different
+# objects when replayed.
+
+def Ref(thing):
+    if ( isinstance(thing, Pipe) ):
+        return ('pipe', thing.n1.pos, thing.n2.pos)
+    elif ( isinstance(thing, Item) ):
+        return ('item', thing.pos)
+    else:
+        return ('at', thing)
+
+def Deref(net, ref):
+    if ( ref[ 0 ] == 'pipe' ):
+        (kind, pos1, pos2) = ref
+        for pipe in net.ground_grid[ pos1 ].pipes:
+            if (( pipe.n1.pos == pos1 ) and ( pipe.n2.pos == pos2 )):
+                return pipe
+        raise IOError("Journal refers to a pipe that isn't there")
+    elif ( ref[ 0 ] == 'item' ):
+        return net.ground_grid[ ref[ 1 ] ]
+    else:
+        return ref[ 1 ]
+
+def Fingerprint(g):
+    # What a replay should get right.
+    net = g.net
+    return ([ (n.pos, n.health, n.tech_level, n.steam.charge)
+                for n in net.node_list ]
+            + [ (p.n1.pos, p.n2.pos, p.health, p.valve_open)
+                for p in net.pipe_list ]
+            + [ w.pos for w in net.well_list ]
+            + [ r.pos for r in net.rock_list ]
+            + [ g.game_time.time(), g.season, net.hub.metal_quantity ]
+            + g.season_fx.Fingerprint())
+
+
+class Journal:
+    def __init__(self, g, name):
+        self.ticks = 0
+        self.next_snapshot = self.next_time = 0
+        self.queue = Queue.Queue()
+        self.failed = False     # nothing more is written if so
+        self.error = None
+        self.worker = threading.Thread(target=self.__Write,
+                    args=(name, "Journal - Day %u - %s" % (
+                        g.game_time.Get_Day(), time.asctime())))
+        self.worker.daemon = True
+        self.worker.start()
+        self.Tick(g, False)
+
+    def Tick(self, g, counted=True):
+        if ( counted ):
+            self.ticks += 1
+        if ( self.failed ):
+            return
+        if ( self.next_snapshot <= self.ticks ):
+            import save_format
+            # The live game forgets what a loaded one wouldn't know.
+            g.net.Forget_Connections()
+            self.queue.put(("SNAP", (self.ticks, random.getstate(),
+                        save_format.Snapshot(g))))
+            self.next_snapshot = self.ticks + Days_To_Ticks(
+                        SNAPSHOT_INTERVAL)
+            self.next_time = self.ticks
+        if ( self.next_time <= self.ticks ):
+            self.queue.put(("TIME", (self.ticks,)))
+            self.next_time = self.ticks + Days_To_Ticks(TIME_INTERVAL)
+
+    def Command(self, command, refs):
+        if ( not self.failed ):
+            self.queue.put(("CMND", (self.ticks, command, refs)))
+
+    def Event(self, ref, dmg_level, by):
+        if ( not self.failed ):
+            self.queue.put(("EVNT", (self.ticks, ref, dmg_level, by)))
+
+    def Take_Error(self):
+        error = self.error
+        self.error = None
+        return error
+
+    def Close(self):
+        # The journal ends where the game did.
+        self.queue.put(("TIME", (self.ticks,)))
+        self.queue.put(None)
+        self.worker.join()
+
+    def __Write(self, name, label):
+        # The first snapshot is written under another name, so that
+        # the old journal is kept until there is a new one. If
+        # anything goes wrong, the rest of the queue is only taken,
+        # so that Flush doesn't wait for it.
+        import save_game
+        temp_name = name + ".tmp"
+        f = None
+        try:
+            f = file(temp_name, "wb")
+            f.write(label[ :save_game.HEADER_SIZE ].ljust(
+                        save_game.HEADER_SIZE))
+            f.write(MAGIC)
+            f.write(struct.pack("<H", FORMAT_VERSION))
+        except Exception, x:
+            self.__Fail(x)
+
+        while True:
+            record = self.queue.get()
+            if ( record == None ):
+                self.queue.task_done()
+                break
+            if ( not self.failed ):
+                try:
+                    self.__Write_Record(f, record)
+                    if ( temp_name != None ):
+                        f.close()
+                        if (( os.name == "nt" ) and ( os.path.exists(name) )):
+                            os.remove(name)
+                        os.rename(temp_name, name)
+                        f = file(name, "ab")
+                        temp_name = None
+                except Exception, x:
+                    self.__Fail(x)
+            self.queue.task_done()
+
+        if ( f != None ):
+            try:
+                f.close()
+            except Exception, x:
+                self.__Fail(x)
+
+    def __Write_Record(self, f, (tag, data)):
+        import save_format
+        if ( tag == "SNAP" ):
+            (ticks, state, snapshot) = data
+            s = StringIO()
+            cPickle.dump((ticks, state), s, cPickle.HIGHEST_PROTOCOL)
+            save_format.Write_Blocks(s, snapshot)
+            data = s.getvalue()
+        else:
+            data = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+        f.write(struct.pack("<4sI", tag, len(data)))
+        f.write(data)
+        f.flush()
+
+    def __Fail(self, x):
+        self.failed = True
+        self.error = "Error writing journal: " + repr(x) + str(x)
+
+def Days_To_Ticks(days):
+    return int(round(days / gametime.TICK_LENGTH))
+
+
+# Replays
+
+class Replay:
+    def __init__(self, ticks):
+        self.ticks = ticks
+        self.events = []
+
+    def Command(self, command, refs):
+        pass
+
+    def Event(self, ref, dmg_level, by):
+        self.events.append((self.ticks, ref, dmg_level, by))
+
+def Read_Records(f):
+    # The records of a journal, after the label. A record cut
+    # short (by a crash) ends the list.
+    if ( f.read(len(MAGIC)) != MAGIC ):
+        raise IOError("Not a journal")
+    (version,) = struct.unpack("<H", f.read(2))
+    if ( version > FORMAT_VERSION ):
+        raise IOError("Journal written by a newer version of the game")
+
+    records = []
+    while True:
+        head = f.read(8)
+        if ( len(head) < 8 ):
+            break
+        (tag, size) = struct.unpack("<4sI", head)
+        data = f.read(size)
+        if ( len(data) < size ):
+            break
+        records.append((tag, data))
+    return records
+
+def Read_Snapshot(data):
+    import save_format
+    s = StringIO(data)
+    (ticks, state) = cPickle.load(s)
+    return (ticks, state, save_format.Read(s))
+
+def Play(records, tick, from_start=False):
+    # Replay from the last snapshot, or the first one. tick is
+    # game.Tick. Returns the game at the end of the journal and a
+    # list of the ways that the replay differed from the journal.
+    global __current
+    snapshots = [ i for (i, (tag, data)) in enumerate(records)
+                if ( tag == "SNAP" ) ]
+    if ( len(snapshots) == 0 ):
+        raise IOError("Journal has no snapshot")
+    if ( from_start ):
+        first = snapshots[ 0 ]
+    else:
+        first = snapshots[ -1 ]
+
+    (ticks, state, g) = Read_Snapshot(records[ first ][ 1 ])
+    random.setstate(state)
+    DIFFICULTY.Set(g.challenge)
+    gametime.Set_Now(g.game_time.time())
+
+    problems = []
+    expected = []
+    replay = Replay(ticks)
+
+    def Run_To(t):
+        while ( replay.ticks < t ):
+            tick(g)
+            replay.ticks += 1
+
+    # The game is replayed on its own map, which is only kept if
+    # the game is (see game.Main_Loop).
+    previous = __current
+    __current = replay
+    mute = config.cfg.mute
+    config.cfg.mute = True
+    map_size = Get_Map_Size()
+    Set_Map_Size(g.net.map_size)
+    try:
+        for (tag, data) in records[ first + 1: ]:
+            if ( tag == "SNAP" ):
+                (ticks, state, g2) = Read_Snapshot(data)
+                Run_To(ticks)
+                if ( Fingerprint(g) != Fingerprint(g2) ):
+                    problems.append("Game differs from the snapshot "
+                            "at tick %u" % ticks)
+                g.net.Forget_Connections() # as the live game did
+                continue
+
+            record = cPickle.loads(data)
+            Run_To(record[ 0 ])
+            if ( tag == "CMND" ):
+                (ticks, command, refs) = record
+                Do(g.net, command, *[ Deref(g.net, r) for r in refs ])
+            elif ( tag == "EVNT" ):
+                expected.append(record)
+
+        if ( len(expected) != 0 ):
+            # Events are journalled with the tick they happened in,
+            # which has to be run to see them.
+            Run_To(expected[ -1 ][ 0 ] + 1)
+    finally:
+        __current = previous
+        config.cfg.mute = mute
+        Set_Map_Size(map_size)
+
+    if ( replay.events != expected ):
+        problems.append("%u season events were journalled, "
+                "and %u happened in the replay" % (
+                len(expected), len(replay.events)))
+    return (g, problems)
+
+def Load(g, tick):
+    # Restore the game from the journal, as save_game.Load.
+    import save_game
+    Flush()
+    name = save_game.Make_Save_Name(save_game.JOURNAL_SLOT)
+    try:
+        f = file(name, "rb")
+        f.read(save_game.HEADER_SIZE)
+        records = Read_Records(f)
+        f.close()
+        (g2, problems) = Play(records, tick)
+    except Exception, x:
+        y = ("Error restoring journal: " + repr(x) + str(x))
+        print y
+        return (None, y)
+
+    for p in problems:
+        print "Journal:", p
+    if ( g2.version != g.version ):
+        return (None, "Restore error: wrong version")
+    return (g2, None)
+
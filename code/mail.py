@@ -12,6 +12,7 @@ import stats
 __messages = []
 __day = 0
 __change = False
+__headless = False
 
 MSG_MAX = 5
 MSG_MARGIN = 5
@@ -41,8 +42,9 @@ def Draw_Mail(output):
     if __messages and __messages[0][0] < time.time():
         __messages.pop(0)
 
-    # Show current messages
+    # Show current messages. Returns the area covered, if any.
     y = output.get_rect().height - MSG_MARGIN
+    area = None
 
     for (tm, surf) in reversed(__messages):
         y -= surf.get_rect().height
@@ -50,7 +52,18 @@ def Draw_Mail(output):
         r = surf.get_rect()
         r.topleft = (MSG_MARGIN, y)
         output.blit(surf, r.topleft)
+        if ( area == None ):
+            area = r
+        else:
+            area = area.union(r)
 
+    return area
+
+
+def Set_Headless(on=True):
+    # With no screen, messages are kept as plain text.
+    global __headless
+    __headless = on
 
 def Set_Day(day):
     global __day
@@ -78,7 +91,10 @@ def pretty_text_render(text, colour, background=(0, 0, 0), fsize=20, blur=1.5):
 def New_Mail(text, colour=(255,255,255)):
     global __messages, __day, __change
     text = ( "Day %u: " % __day ) + text
-    s = pretty_text_render(text, colour)
+    if ( __headless ):
+        s = text
+    else:
+        s = pretty_text_render(text, colour)
     __messages.append((time.time() + MSG_EXPIRY_TIME, s))
 
     if len(__messages) > MSG_MAX:
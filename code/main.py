@@ -8,7 +8,8 @@ import pygame , random , sys , math , time , webbrowser , urllib , os
 from pygame.locals import *
 
 import game , stats , storms , extra , save_menu , resource , menu
-import config , startup , sound , alien_invasion , quakes
+import config , startup , sound , alien_invasion , quakes , steam_solver
+import headless , sprite_cache , profiler , journal
 from primitives import *
 
 DEB_ICON = '/usr/share/pixmaps/lightyears.xpm'
@@ -25,9 +26,34 @@ def parse_args():
         help="safe mode", action="store_true")
     p.add_argument("--no-sound",
         help="disable sound", action="store_true")
+    p.add_argument("--array-steam",
+        help="use the NumPy array-backed steam solver", action="store_true")
     for t in ('beginner', 'intermediate', 'expert', 'peaceful'):
         p.add_argument("--play-%s" % t,
             help="start %s game" % t, action="store_true")
+    p.add_argument("--headless",
+        help="run a game with no window or sound, then exit",
+        action="store_true")
+    p.add_argument("--ticks", type=int, default=35 * 60 * 10,
+        help="ticks to run a headless game for (35 per game day)")
+    p.add_argument("--seed", type=int,
+        help="random seed for a headless game")
+    p.add_argument("--profile", nargs="?", const="profile.csv", metavar="FILE",
+        help="time the main loop, show the timings over the map and "
+        "write them to FILE (.csv or .json) on exit")
+    p.add_argument("--autosave", type=int, metavar="DAYS",
+        help="autosave every DAYS game days, or never if 0 (default: %u);"
+        " this is remembered" % config.AUTOSAVE_INTERVAL)
+    p.add_argument("--journal",
+        help="keep a journal of the game, which can be restored "
+        "(it is the last entry in the Restore menu) or replayed",
+        action="store_true")
+    p.add_argument("--replay", metavar="FILE",
+        help="replay a journal from the start with no window or sound, "
+        "check that it plays the same, then exit")
+    p.add_argument("--map-size", metavar="SIZE",
+        help="size of the map for new games, in grid squares: "
+        "either N or WxH (default: %ux%u)" % GRID_SIZE)
 
     x_res_li = [r[0] for r in RESOLUTIONS]
     x_res = ', '.join(map(str, x_res_li))
@@ -35,6 +61,23 @@ def parse_args():
         help="resolution (one of: %s)" % x_res)
     args = p.parse_args()
 
+    if args.map_size is not None:
+        try:
+            size = [int(v) for v in args.map_size.lower().split('x')]
+        except ValueError:
+            size = []
+        if len(size) == 1:
+            size *= 2
+        if len(size) != 2 or min(size) < MIN_MAP_SIZE:
+            print "Incorrect map size specified (the smallest is %u)." % (
+                MIN_MAP_SIZE)
+            sys.exit(1)
+        args.map_size = tuple(size)
+
+    if args.autosave is not None and args.autosave < 0:
+        print "Incorrect autosave interval specified."
+        sys.exit(1)
+
     if args.resolution is None:
         return args
 
@@ -60,6 +103,29 @@ def Main(data_dir):
     resource.DATA_DIR = data_dir
 
     config.Initialise(cli_args.safe)
+    sprite_cache.Initialise(cli_args.safe)
+
+    if cli_args.autosave is not None:
+        config.cfg.autosave_interval = cli_args.autosave
+
+    steam_solver.Enable(cli_args.array_steam)
+    journal.Enable(cli_args.journal)
+
+    if cli_args.map_size:
+        Set_New_Map_Size(cli_args.map_size)
+
+    if cli_args.profile:
+        profiler.Enable(True, not cli_args.headless)
+
+    if cli_args.replay:
+        Replay_Journal(data_dir, cli_args)
+        Write_Profile(cli_args)
+        return
+
+    if cli_args.headless:
+        Headless_Game(data_dir, cli_args)
+        Write_Profile(cli_args)
+        return
 
     # Pygame things
     flags = 0
@@ -133,12 +199,46 @@ def Main(data_dir):
         quit = Main_Menu_Loop(n, clock, screen, (width, height), cli_args)
 
     config.Save()
+    Write_Profile(cli_args)
 
     # Bye bye Pygame.
     pygame.mixer.quit()
     pygame.quit()
 
 
+def Write_Profile(cli_args):
+    if cli_args.profile:
+        profiler.Dump(cli_args.profile)
+        print "Timings written to", cli_args.profile
+
+
+def Headless_Game(data_dir, cli_args):
+    challenge = MENU_INTERMEDIATE
+    for t, pick_cmd in (
+            ('beginner', MENU_BEGINNER),
+            ('expert', MENU_EXPERT),
+            ('peaceful', MENU_PEACEFUL)):
+        if getattr(cli_args, 'play_' + t):
+            challenge = pick_cmd
+
+    headless.Initialise(data_dir)
+    start = time.time()
+    g = headless.Run(challenge, cli_args.ticks, cli_args.seed)
+    print headless.Summary(g)
+    print "Ran %u days in %1.2f seconds" % (
+            g.game_time.Get_Day(), time.time() - start)
+
+def Replay_Journal(data_dir, cli_args):
+    headless.Initialise(data_dir)
+    start = time.time()
+    (g, problems) = headless.Replay(cli_args.replay)
+    print headless.Summary(g)
+    for p in problems:
+        print p
+    print "Replayed to day %u in %1.2f seconds, %u problems" % (
+            g.game_time.Get_Day(), time.time() - start, len(problems))
+
+
 def Main_Menu_Loop(name, clock, screen, (width, height), cli_args):
     # Further initialisation
     menu_image = resource.Load_Image("mainmenu.jpg")
@@ -10,12 +10,18 @@ import pygame, math
 from pygame import gfxdraw
 from pygame.locals import *
 
+try:
+    import numpy
+    from pygame import surfarray
+except ImportError:
+    numpy = None
+
 import bresenham , intersect , extra , stats , resource , draw_obj , sound
 from primitives import *
 from random import randint
 import random
 from steam_model import Steam_Model
-import time
+import gametime
 from mail import New_Mail
 
 
@@ -31,9 +37,33 @@ class Item(pygame.sprite.Sprite):
     def _tlp(self):
         return Point(self.pos) * Get_Grid_Size()
 
+    def Grid_Cells(self):
+        # Grid squares covered by this item, for Network.item_grid.
+        return [ self.pos ]
+
     def Draw(self, output):
         self.draw_obj.Draw(output, self.pos, (0,0))
 
+    # For the dirty-rectangle renderer in ui.py: Draw() must only
+    # paint inside Get_Screen_Rect(), and Draw_State() must change
+    # whenever the picture does. Animation belongs in Frame_Advance(),
+    # not Draw(), as items are only drawn when they need to be.
+    #
+    # Draw_Static() paints the parts that can only change when the
+    # Network sets "dirty" (building, damage, repairs, valves); they
+    # go on the static layer, under everything drawn by Draw().
+    def Draw_Static(self, output):
+        pass
+
+    def Get_Screen_Rect(self):
+        return self.draw_obj.Get_Rect(self.pos)
+
+    def Draw_State(self):
+        return self.draw_obj.Get_State()
+
+    def Frame_Advance(self, frame_time):
+        pass
+
     def Draw_Mini(self, output, soffset):
         self.draw_obj.Draw(output, self.pos, soffset)
 
@@ -412,42 +442,87 @@ class Well(Item):
         self.draw_obj = draw_obj.Draw_Obj("well.png", 1)
         self.emits_steam = True
 
+    def Draw_Static(self, output):
+        self.Draw(output)
+
+# Rock pictures, scaled to size, for the current grid size:
+# (width, height) -> (rock, shadow)
+rock_images = dict()
+rock_images_grid_size = None
+
+# Where the reflexes shine on a rock picture: x (0 to 64), y
+ROCK_REFLEXES = [ (10, 30), (32, 40), (25, 15), (30, 50), (22, 25) ]
+
 class Rock(Item):
     """Just a big rock, of random size"""
-    def __init__(self, (x,y), name="Rock"):
+    def __init__(self, (x,y), name="Rock", size=None, reflexes=None):
         Item.__init__(self, name)
         self.pos = (x,y)
-        self.rock_img = resource.Load_Image("rock.png")
-        self.shadow_img = resource.Load_Image("rock_shadow.png")
-
-        self._size = 1 + 5 * random.random()
-        width = int(self._size * Get_Grid_Size())
 
-        ratio = float(self.rock_img.get_height()) / self.rock_img.get_width()
-        height = int(width * ratio)
-        # top-left, center, bottom-right, size in pixels
-        self._sizep = scale_to = Point(width, height)
-        self._brp = self._tlp + self._sizep
-        self._centerp = self._tlp + self._sizep * .5
-        self.rock_img = pygame.transform.smoothscale(self.rock_img, scale_to)
-        self.shadow_img = pygame.transform.smoothscale(self.shadow_img, scale_to)
-        self.shadow_img.set_alpha(50)
+        if ( size == None ):
+            size = 1 + 5 * random.random()
+        self._size = size # width in grid squares
+        img = resource.Load_Image("rock.png")
+        self._ratio = float(img.get_height()) / img.get_width()
 
         self.quantity = self._size * DIFFICULTY.ROCK_QUANTITY
-        self.reflexes = [
-            # x (0 to 64), y, sequence value for each reflex
-            [10, 30, randint(0, 128)],
-            [32, 40, randint(0, 128)],
-            [25, 15, randint(0, 128)],
-            [30, 50, randint(0, 128)],
-            [22, 25, randint(0, 128)],
-        ]
+        if ( reflexes == None ):
+            reflexes = [ randint(0, 128) for xy in ROCK_REFLEXES ]
+        # x, y, sequence value for each reflex
+        self.reflexes = [ [rx, ry, seq]
+                for ((rx, ry), seq) in zip(ROCK_REFLEXES, reflexes) ]
         self.reflex_color = (255, 255, 255)
 
-        # rock entry point (for digging)
-        down = Point(0, self._sizep.y)
-        self.entry_point = self._tlp + self._sizep * .3 + down * .4
-        self.entry_point.round_to_int()
+    # Sizes and positions in pixels depend on the zoom and the
+    # camera, so they are worked out as they are needed.
+
+    def _sizep(self):
+        width = int(self._size * Get_Grid_Size())
+        return Point(width, int(width * self._ratio))
+
+    def _scrp(self):
+        # top-left, on the screen
+        (x, y) = Grid_To_Scr(self.pos)
+        h = Get_Grid_Size() / 2
+        return Point(x - h, y - h)
+
+    def Depth(self):
+        """For drawing rocks from the back to the front: how far down
+        the map the entry point is, in grid squares
+        """
+        return self.pos[ 1 ] + ( self._size * self._ratio * .7 )
+
+    def Entry_Point(self):
+        """Where conveyors meet the rock (for digging), on the screen"""
+        s = self._sizep()
+        p = self._scrp() + Point(s.x * .3, s.y * .7)
+        p.round_to_int()
+        return p
+
+    def _images(self):
+        global rock_images, rock_images_grid_size
+        if ( rock_images_grid_size != Get_Grid_Size() ):
+            rock_images = dict()
+            rock_images_grid_size = Get_Grid_Size()
+
+        scale_to = self._sizep().tup
+        images = rock_images.get(scale_to)
+        if ( images == None ):
+            rock_img = pygame.transform.smoothscale(
+                    resource.Load_Image("rock.png"), scale_to)
+            shadow_img = pygame.transform.smoothscale(
+                    resource.Load_Image("rock_shadow.png"), scale_to)
+            shadow_img.set_alpha(50)
+            images = rock_images[ scale_to ] = (rock_img, shadow_img)
+        return images
+
+    def Grid_Cells(self):
+        # Pipes are tested against a cross spanning one square either
+        # side of the rock. Any pipe touching the cross passes through
+        # a square within two of the rock, so those are covered.
+        (x,y) = self.pos
+        return [ (x + dx, y + dy) for dx in xrange(-2, 3)
+                    for dy in xrange(-2, 3) ]
 
     def dig(self, distance):
         """Dig an amount of metal"""
@@ -465,24 +540,38 @@ class Rock(Item):
             Grid_To_Scr(self.pos), ra , 2 )
         return Grid_To_Scr_Rect(self.pos).inflate(ra,ra)
 
-    def Draw(self, output):
-        """Make the rock shine"""
-        # print the rock
-        p = self._tlp
-        output.blit(self.shadow_img, p)
-        output.blit(self.rock_img, p)
-
+    def Frame_Advance(self, frame_time):
         # purge reflexes based on the amount of metal
         max_reflexes = self.quantity / 200
         if len(self.reflexes) > max_reflexes:
             self.reflexes.pop()
 
         # animate reflexes
+        for reflex in self.reflexes:
+            reflex[2] += 1
+            if reflex[2] > 128:
+                reflex[2] = 0
+
+    def Draw_State(self):
+        # reflexes are invisible from 64 onwards
+        return tuple([ min(seq, 64) for (x, y, seq) in self.reflexes ])
+
+    def Get_Screen_Rect(self):
+        return Rect(self._scrp().tup, self._sizep().tup).inflate(4, 4)
 
-        scale = self._sizep.modulo / 120.0
+    def Draw_Static(self, output):
+        # print the rock
+        p = self._scrp()
+        (rock_img, shadow_img) = self._images()
+        output.blit(shadow_img, p)
+        output.blit(rock_img, p)
+
+    def Draw(self, output):
+        """Make the rock shine"""
+        scale = self._sizep().modulo / 120.0
+        tlp = self._scrp()
         for reflex in self.reflexes:
             # print a reflex
-            reflex[2] += 1
             x, y, seq = reflex
             if seq < 32:
                 alpha = seq * 8
@@ -491,13 +580,10 @@ class Rock(Item):
             else:
                 alpha = 0
 
-            if seq > 128:
-                reflex[2] = 0
-
             if alpha > 255:
                 alpha = 255
 
-            p = self._tlp + Point(x, y) * scale
+            p = tlp + Point(x, y) * scale
             p.round_to_int()
             col = self.reflex_color + (alpha,)
             col2 = self.reflex_color + (int(alpha * .8),)
@@ -656,7 +742,7 @@ class Node(Building):
         self.draw_obj_venting = draw_obj.Draw_Obj("node_venting.png", 1)
         self.draw_obj_incomplete = draw_obj.Draw_Obj("node_u.png", 1)
         self.draw_obj = self.draw_obj_incomplete
-        self._hissing_started = 0
+        self._hissing_started = -30
         self.conveyor_offset = 0
         self.metal_yield = 0
         self.max_rock_distance = INITIAL_NODE_EXCAVATION_DISTANCE
@@ -688,31 +774,52 @@ class Node(Building):
             self.complete = False
             self.steam.Capacity_Upgrade()
 
+    def Get_Steam_Source(self):
+        # Current fed into this node's steam model on each tick
+        # (negative for a consumer). None means the node is passive
+        # and Source() isn't called at all.
+        return None
+
+    def Steam_Source(self):
+        # As above, called once per tick: subclasses keep their
+        # accounts here.
+        return self.Get_Steam_Source()
+
     def Steam_Think(self):
+        src = self.Steam_Source()
+        if ( src != None ):
+            self.steam.Source(src)
+
+        pl = []
         nl = []
         for p in self.Exits():
             if p.valve_open and not p.Is_Broken():
                 if ( p.n1 == self ):
                     if ( not p.n2.Is_Broken() ):
+                        pl.append(p)
                         nl.append((p.n2.steam, p.resistance))
                 else:
                     if ( not p.n1.Is_Broken() ):
+                        pl.append(p)
                         nl.append((p.n1.steam, p.resistance))
 
         nd = self.steam.Think(nl)
-        for (p, current) in zip(self.Exits(), nd):
+        for (p, current) in zip(pl, nd):
             # current > 0 means outgoing flow
             if ( current > 0.0 ):
                 p.Flowing_From(self, current)
 
+        self.Steam_Update_Draw_Obj()
+
+    def Steam_Update_Draw_Obj(self):
         if ( self.Is_Broken() ):
             self.draw_obj = self.draw_obj_incomplete
         else:
             if self.steam.venting:
                 self.draw_obj = self.draw_obj_venting
-                # start hissing every 30 seconds
-                now = time.time()
-                if now - self._hissing_started > 30:
+                # start hissing every 30 days
+                now = gametime.Now()
+                if not ( 0 <= now - self._hissing_started < 30 ):
                     self._hissing_started = now
                     sound.FX("hissing_leak")
             else:
@@ -749,15 +856,30 @@ class Node(Building):
 
         color = highlight + (100,)
         width, height = self.draw_ellipse(output, p, 1, color, 2)
-        return Grid_To_Scr_Rect(self.pos).inflate(width, height)
+        return Ellipse_Rect(p, (width, height))
+
+    def Frame_Advance(self, frame_time):
+        self.conveyor_offset += .01
+        self.conveyor_offset %= 1
 
+    def Draw_State(self):
+        if ( self.metal_yield == 0 ):
+            conveyors = None
+        else:
+            conveyors = self.conveyor_offset
+        return (Item.Draw_State(self), len(self.rocks_nearby), conveyors)
+
+    def Get_Screen_Rect(self):
+        r = Item.Get_Screen_Rect(self)
+        np = Grid_To_Scr(self.pos)
+        for rock, dist in self.rocks_nearby:
+            r.union_ip(Rect(np, (1, 1)).union(
+                    Rect(rock.Entry_Point().tup, (1, 1))).inflate(8, 8))
+        return r
 
     def Draw(self, output):
         """Draw node and conveyors to the closest rocks
         """
-        self.conveyor_offset += .01
-        self.conveyor_offset %= 1
-
         for rock, dist in self.rocks_nearby:
             np = Grid_To_Scr(self.pos)
             colour = (100,) * 3
@@ -766,7 +888,7 @@ class Node(Building):
 
             # Animate moving dots, in two ways
             np = Point(np)
-            rp = rock.entry_point
+            rp = rock.Entry_Point()
             dist = np - rp
 
             if dist.modulo < 1: # No conveyors when the node is *in* the rock
@@ -876,11 +998,13 @@ class City_Node(Node):
             return (self.city_upgrade_start - self.city_upgrade, (255,255,50), 
                  self.city_upgrade_start, (64,64,64))
 
-    def Steam_Think(self):
+    def Get_Steam_Source(self):
+        return - self.Get_Steam_Demand()
+
+    def Steam_Source(self):
         x = self.Get_Steam_Demand()
         self.total_steam += x
-        self.steam.Source(- x)
-        Node.Steam_Think(self)
+        return - x
 
     def Draw(self, output):
         Node.Draw(self, output)
@@ -896,7 +1020,7 @@ class City_Node(Node):
         p = Point(Grid_To_Scr(self.pos))
         color = highlight + (100,)
         width, height = self.draw_ellipse(output, p, 2, color, 2)
-        return Grid_To_Scr_Rect(self.pos).inflate(width, height)
+        return Ellipse_Rect(p, (width, height))
 
     def Get_Tech_Level(self):
         return Building.Get_Tech_Level(self) + (" of %d" % DIFFICULTY.CITY_MAX_TECH_LEVEL )
@@ -916,14 +1040,20 @@ class Well_Node(Node):
         self.production = 0
 
 
-    def Steam_Think(self):
+    def Get_Steam_Source(self):
         if ( not self.Needs_Work() ):
-            self.production = (DIFFICULTY.BASIC_STEAM_PRODUCTION + (self.tech_level * 
+            return (DIFFICULTY.BASIC_STEAM_PRODUCTION + (self.tech_level * 
                     DIFFICULTY.STEAM_PRODUCTION_PER_LEVEL))
-            self.steam.Source(self.production)
+        else:
+            return None
+
+    def Steam_Source(self):
+        src = self.Get_Steam_Source()
+        if ( src != None ):
+            self.production = src
         else:
             self.production = 0
-        Node.Steam_Think(self)
+        return src
 
     def Get_Information(self):
         return Node.Get_Information(self) + [
@@ -953,8 +1083,6 @@ class Pipe(Building):
         self.current_n1_to_n2 = 0.0
 
         self.dot_drawing_offset = 0
-        self.dot_positions = []
-        sound.FX("pipe_construction")
 
     def Begin_Upgrade(self):
         if ( self.tech_level >= PIPE_MAX_TECH_LEVEL ):
@@ -972,6 +1100,9 @@ class Pipe(Building):
             self.complete = False
             self.resistance *= PIPE_UPGRADE_RESISTANCE_FACTOR
 
+    def Grid_Cells(self):
+        return extra.More_Accurate_Line(self.n1.pos, self.n2.pos)
+
     def Exits(self):
         return [self.n1, self.n2]
 
@@ -996,6 +1127,10 @@ class Pipe(Building):
         x1 -= x ; x2 -= x
         y1 -= y ; y2 -= y
 
+        r = Rect(min(x1, x2), min(y1, y2), abs(x1 - x2), abs(y1 - y2))
+        if ( not r.inflate(4, 4).colliderect(output.get_rect()) ):
+            return # not in the picture
+
         if ( self.Needs_Work() ):
             c = (255,0,0)
         else:
@@ -1018,16 +1153,24 @@ class Pipe(Building):
                 output.blit(info_surf, r2.topleft)
 
 
-    def Draw(self,output):
+    def Draw_State(self):
+        return (self.Needs_Work(), self.current_n1_to_n2 == 0.0,
+                self.dot_drawing_offset)
+
+    def Get_Screen_Rect(self):
+        (x1,y1) = Grid_To_Scr(self.n1.pos)
+        (x2,y2) = Grid_To_Scr(self.n2.pos)
+        return Rect(min(x1, x2), min(y1, y2),
+                abs(x1 - x2) + 1, abs(y1 - y2) + 1).inflate(8, 8)
+
+    def Draw_Static(self, output):
         (x1,y1) = Grid_To_Scr(self.n1.pos)
         (x2,y2) = Grid_To_Scr(self.n2.pos)
         if ( self.Needs_Work() ):
             # Plain red line
             pygame.draw.line(output, (255,0,0), (x1,y1), (x2,y2), 3)
-            self.dot_drawing_offset = 0
             return
 
-
         # Dark green backing line:
         if self.valve_open:
             colour = (32,128,20)
@@ -1036,38 +1179,21 @@ class Pipe(Building):
 
         pygame.draw.line(output, colour, (x1,y1), (x2,y2), 3)
 
-        if ( self.current_n1_to_n2 == 0.0 ):
-            return
-            
-        r = Rect(0,0,1,1)
-        for pos in self.dot_positions:
-            r.center = pos
-            output.fill(colour, r)
+    def Draw(self,output):
+        Draw_Pipes(output, [ self ])
 
+    def Dots(self):
         # Thanks to Acidd_UK for the following suggestion.
-        dots = int(( self.length * 0.3 ) + 1.0)
-        positions = dots * self.SFACTOR
-
-        pos_a = (x1, y1 + 1)
-        pos_b = (x2, y2 + 1)
-        interp = self.dot_drawing_offset
-        colour = (80, 255, 80) # bright green dots
-
-        self.dot_positions = [ 
-            extra.Partial_Vector(pos_a, pos_b, (interp, positions))
-            for interp in range(self.dot_drawing_offset, positions, 
-                    self.SFACTOR) ]
-
-        for pos in self.dot_positions:
-            r.center = pos
-            output.fill(colour, r)
+        return int(( self.length * 0.3 ) + 1.0)
     
     # Tune these to alter the speed of the dots.
     SFACTOR = 512
     FUTZFACTOR = 4.0 * 35.0
 
     def Frame_Advance(self, frame_time):
-        if self.valve_open:
+        if ( self.Needs_Work() ):
+            self.dot_drawing_offset = 0
+        elif self.valve_open:
             self.dot_drawing_offset += int(self.FUTZFACTOR * 
                     frame_time * self.current_n1_to_n2)
 
@@ -1078,7 +1204,7 @@ class Pipe(Building):
             self.dot_drawing_offset = self.dot_drawing_offset % self.SFACTOR
 
     def Make_Ready_For_Save(self):
-        self.dot_positions = []
+        pass
 
     def __Draw_Original(self, output):
         (x1,y1) = Grid_To_Scr(self.n1.pos)
@@ -1109,3 +1235,51 @@ class Pipe(Building):
         """Open/close steam valve"""
         self.valve_open = not self.valve_open
         sound.FX("valve_squeak")
+
+
+def Draw_Pipes(output, pipes):
+    # Draws the moving dots of all the given pipes in one go. Each
+    # pipe has Dots() dots, spread evenly from n1 to n2 and moved
+    # along by dot_drawing_offset (in 1/SFACTOR of the spacing).
+    pipes = [ p for p in pipes
+                if (( not p.Needs_Work() ) and ( p.current_n1_to_n2 != 0.0 )) ]
+    if ( len(pipes) == 0 ):
+        return
+
+    colour = (80, 255, 80) # bright green dots
+    sfactor = Pipe.SFACTOR
+
+    if (( numpy == None ) or ( output.get_bitsize() not in (8, 16, 32) )):
+        r = Rect(0,0,1,1)
+        for p in pipes:
+            pos_a = Grid_To_Scr(p.n1.pos)
+            pos_b = Grid_To_Scr(p.n2.pos)
+            pos_a = (pos_a[ 0 ], pos_a[ 1 ] + 1)
+            pos_b = (pos_b[ 0 ], pos_b[ 1 ] + 1)
+            positions = p.Dots() * sfactor
+            for interp in xrange(p.dot_drawing_offset, positions, sfactor):
+                r.center = extra.Partial_Vector(pos_a, pos_b,
+                            (interp, positions))
+                output.fill(colour, r)
+        return
+
+    ends = numpy.array([ Grid_To_Scr(p.n1.pos) + Grid_To_Scr(p.n2.pos)
+                for p in pipes ])
+    dots = numpy.array([ p.Dots() for p in pipes ])
+    offset = numpy.array([ p.dot_drawing_offset for p in pipes ])
+
+    # one entry per dot
+    which = numpy.repeat(numpy.arange(len(pipes)), dots)
+    first = numpy.cumsum(dots) - dots
+    interp = ( offset[ which ] +
+            ( numpy.arange(len(which)) - first[ which ] ) * sfactor )
+    positions = dots[ which ] * sfactor
+    (x1, y1, x2, y2) = ends[ which ].T
+    x = x1 + ((( x2 - x1 ) * interp ) // positions )
+    y = y1 + 1 + ((( y2 - y1 ) * interp ) // positions )
+
+    (w, h) = output.get_size()
+    inside = ( x >= 0 ) & ( x < w ) & ( y >= 0 ) & ( y < h )
+    pixels = surfarray.pixels2d(output)
+    pixels[ x[ inside ], y[ inside ] ] = output.map_rgb(colour)
+    del pixels
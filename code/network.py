@@ -6,44 +6,63 @@
 # Sorry, this isn't anything to do with IP: the Network is 
 # the steam transport network.
 
-import math , random , time , sound
+import math , random , sound , heapq , gametime
 
-import extra
+import extra , steam_solver , grid_index , journal
+from distance_field import Distance_Field
+from placement import Placement , PLACE , LATER , NEVER
 from map_items import *
 from primitives import *
 from mail import New_Mail
 
-def is_too_close(pos, li, d):
-    """Check if item position is too close to any element from li
-    """
-    for other in li:
-        if distance(pos, other.pos) < d:
-            return True
-
-    return False
+ROCK_SPACE = 3  # nothing new is placed any nearer to a rock
 
 class Network:
     def __init__(self, teaching):
         self.ground_grid = dict()
-        self.pipe_grid = dict()
+        self.item_grid = grid_index.Grid_Index()
         self.well_list = []
         self.node_list = []
         self.pipe_list = []
         self.rock_list = []
 
-        # UI updates required?
+        # UI updates required? Set whenever something drawn on the
+        # static map layer changes (see Item.Draw_Static).
         self.dirty = False
+
+        # Bumped whenever nodes or pipes are added or removed.
+        self.edit_count = 0
+
+        # Spatial index of pipes, rocks, wells and nodes; see
+        # grid_index.py. Get_Pipe cycles through overlapping pipes.
+        self.pipe_pick = 0
+
+        # Connection map and work queue: see Work_Pulse.
+        self.hub = None
+        self.connection_value = 1
+        self.__Invalidate_Connections()
     
         # Popup health meters may appear
         self.popups = set([])
 
+        # Ten wells and ten rocks on a map of the usual size, and
+        # more on a bigger one, in proportion to its area.
+        self.map_size = Get_Map_Size()
+        (mw,mh) = self.map_size
+        (gw,gh) = GRID_SIZE
+        per_map = max(10, ( 10 * mw * mh ) / ( gw * gh ))
+
+        # How far each square is from a rock: see Rock_Field.
+        self.rock_field = Distance_Field(self.map_size, ROCK_SPACE)
+        self.well_placement = None
+
         # Wells are created. All wells must be at least a certain
         # distance from the city.
-        for i in xrange(10):
+        for i in xrange(per_map):
             self.Make_Well(teaching)
 
         # Get centre: 
-        (x,y) = GRID_CENTRE
+        (x,y) = Get_Map_Centre()
 
         # An additional bootstrap well, plus node, is created close to the city.
         wgpos = (x + 5, y + random.randint(-3,3))
@@ -66,27 +85,37 @@ class Network:
         # Final setup
         self.hub = cn # hub := city node
 
-        self.connection_value = 1
         self.Work_Pulse(0) # used to make connection map
 
-        # Add some rocks
-        while len(self.rock_list) < 10:
-            pos = (x + random.randint(-20, 20), y + random.randint(-20, 20))
+        # Add some rocks, in the middle four-fifths of the map
+        (sx,sy) = (( mw * 2 ) / 5, ( mh * 2 ) / 5)
+        wells = Distance_Field(self.map_size, 4,
+                    [ w.pos for w in self.well_list ])
+        placement = Placement(Rect(x - sx, y - sy, ( sx * 2 ) + 1,
+                    ( sy * 2 ) + 1))
+
+        def Rock_Test(pos):
             # keep distance from wells
-            if is_too_close(pos, self.well_list, 4):
-                continue
+            if wells.Within(pos, 4):
+                return NEVER
             # keep distance from the City
-            if distance(pos, GRID_CENTRE) < 9:
-                continue
+            if distance(pos, (x,y)) < 9:
+                return NEVER
             # keep distance from other rocks
-            if is_too_close(pos, self.rock_list, 3):
-                continue
+            if self.rock_field.Within(pos, ROCK_SPACE):
+                return NEVER
+            return PLACE
 
-            self.rock_list.append(Rock(pos))
+        while len(self.rock_list) < per_map:
+            pos = placement.Pick(Rock_Test)
+            rock = Rock(pos)
+            self.rock_list.append(rock)
+            self.rock_field.Add([ pos ])
+            self.item_grid.Add(rock, rock.Grid_Cells())
 
         # sort rock_list by "y" value, to be able to draw them in sequence
         # without incorrect overlapping
-        self.rock_list.sort(key=lambda r: r.entry_point[1])
+        self.rock_list.sort(key=lambda r: r.Depth())
 
         for node in self.node_list:
             node.locate_nearby_rocks(self.rock_list)
@@ -106,19 +135,14 @@ class Network:
                 New_Mail("Item is destroyed.")
             return False
 
-        if ( self.pipe_grid.has_key(gpos) ):
-            # There might be a pipe in the way. Then again,
-            # it may have been destroyed already.
-            for pipe in self.pipe_grid[ gpos ]:
-                if ( pipe.Is_Destroyed() ):
-                    continue
-
-                if ( extra.Intersect_Grid_Square(gpos, 
-                            (pipe.n1.pos, pipe.n2.pos)) ):
-                    if ( not inhibit_effects ):
-                        New_Mail("Can't build there - pipe in the way!")
-                        sound.FX("error")
-                    return False
+        # There might be a pipe in the way.
+        for pipe in self.item_grid.Get(gpos, Pipe):
+            if ( extra.Intersect_Grid_Square(gpos, 
+                        (pipe.n1.pos, pipe.n2.pos)) ):
+                if ( not inhibit_effects ):
+                    New_Mail("Can't build there - pipe in the way!")
+                    sound.FX("error")
+                return False
 
         if (( self.ground_grid.has_key(gpos) )
         and ( isinstance(self.ground_grid[ gpos ], Building) )):
@@ -129,6 +153,7 @@ class Network:
 
         if ( isinstance(item, Node) ):
             self.node_list.append(item)
+            self.edit_count += 1
             if ( self.ground_grid.has_key( gpos )):
                 item.Save(self.ground_grid[ gpos ])
             self.ground_grid[ gpos ] = item
@@ -139,34 +164,109 @@ class Network:
         else:
             assert False # unknown type!
 
+        self.item_grid.Add(item, item.Grid_Cells())
+        self.dirty = True
         return True
 
     def Is_Connected(self, node):
         assert isinstance(node, Building)
+        self.__Update_Connections()
         return ( node.connection_value == self.connection_value )
 
-    def Work_Pulse(self, work_points):
-        # Connection map is built up. Process is
-        # recursive: a wavefront spreads out across the net.
-        #
-        # At the same time, find the first node that needs work doing,
-        # and do work at it.
-        used = 0
-        now = set([ self.hub ])
+    # The connection map. Every item reachable from the hub is
+    # stamped with the current connection_value and given its
+    # distance from the hub (counting nodes and pipes), and the
+    # connected items that need work wait in a priority queue,
+    # nearest first. Adding a pipe only spreads the map from that
+    # pipe; removing anything invalidates it, and it is rebuilt with
+    # a wavefront from the hub when next needed. Valves don't matter
+    # here: work crews can cross a closed valve.
+
+    def Forget_Connections(self):
+        # As if just loaded: the map is rebuilt when next needed.
+        self.__Invalidate_Connections()
+
+    def __Invalidate_Connections(self):
+        self.connections_valid = False
+        self.connection_depth = dict()
+        self.work_queue = []
+        self.work_queued = dict()
+        self.work_serial = 0
+
+    def __Update_Connections(self):
+        if ( self.connections_valid or ( self.hub == None )):
+            return
+        self.__Invalidate_Connections()
+        self.connections_valid = True
         self.connection_value += 1
+        self.__Spread([ (0, self.hub) ])
+
+    def __Spread(self, start):
+        # Wavefront from the given (depth, item) pairs, stamping
+        # items that weren't connected or are now closer to the hub.
         cv = self.connection_value
+        depth = self.connection_depth
+        now = start
         while ( len(now) != 0 ):
-            next = set([])
-            for node in now:
-                if ( node.connection_value < cv ):
-                    if (( work_points > 0 ) and node.Needs_Work() ):
-                        node.Do_Work()
-                        self.Popup(node)
-                        work_points -= 1
-                        used += 1
-                    node.connection_value = cv
-                    next |= set(node.Exits())
+            next = []
+            for (d, item) in now:
+                if (( item.connection_value == cv )
+                and ( depth[ item ] <= d )):
+                    continue
+                item.connection_value = cv
+                depth[ item ] = d
+                self.Queue_Work(item)
+                next.extend([ (d + 1, exit) for exit in item.Exits() ])
             now = next
+
+    def __Connect_Pipe(self, pipe):
+        if ( not self.connections_valid ):
+            return
+        cv = self.connection_value
+        start = [ (self.connection_depth[ node ] + 1, pipe)
+                    for node in pipe.Exits()
+                    if ( node.connection_value == cv ) ]
+        if ( len(start) != 0 ):
+            self.__Spread([ min(start) ])
+
+    def Queue_Work(self, item):
+        # Called when a connected item may need work doing.
+        if ( not isinstance(item, Building) ):
+            return # wells and rocks can't be repaired
+        if ( not ( self.connections_valid
+                and ( item.connection_value == self.connection_value )
+                and item.Needs_Work() )):
+            return
+        d = self.connection_depth[ item ]
+        if ( self.work_queued.get(item) == d ):
+            return # already waiting
+        self.work_queued[ item ] = d
+        self.work_serial += 1
+        heapq.heappush(self.work_queue, (d, self.work_serial, item))
+
+    def Work_Pulse(self, work_points):
+        # Do one unit of work at each of the first work_points
+        # connected items that need it, nearest to the hub first.
+        self.__Update_Connections()
+        used = 0
+        done = []
+        cv = self.connection_value
+        while (( work_points > 0 ) and ( len(self.work_queue) != 0 )):
+            (d, serial, item) = heapq.heappop(self.work_queue)
+            if ( self.work_queued.get(item) != d ):
+                continue # stale entry
+            del self.work_queued[ item ]
+            if (( item.connection_value == cv ) and item.Needs_Work() ):
+                item.Do_Work()
+                if ( not item.Needs_Work() ):
+                    self.dirty = True # finished
+                self.Popup(item)
+                work_points -= 1
+                used += 1
+                done.append(item)
+
+        for item in done:
+            self.Queue_Work(item)
         return used
 
     def dig_metal(self):
@@ -205,10 +305,10 @@ class Network:
     def Popup(self, node):
         if ( node != None ):
             self.popups |= set([node])
-            node.popup_disappears_at = time.time() + 4.0
+            node.popup_disappears_at = gametime.Now() + 4.0
 
     def Expire_Popups(self):
-        t = time.time()
+        t = gametime.Now()
         remove = set([])
         for node in self.popups:
             if ( node.popup_disappears_at <= t ):
@@ -216,9 +316,26 @@ class Network:
         self.popups -= remove
 
     def Steam_Think(self):
+        if ( steam_solver.Is_Enabled() ):
+            steam_solver.Think(self)
+            return
+
         for n in self.node_list:
             n.Steam_Think()
 
+    def Solve_Equilibrium(self):
+        # Jump straight to the steady state of the steam network
+        # (used when a game starts or is restored). Without NumPy
+        # the model is run until it settles instead. One ordinary
+        # tick follows, to set venting flags and pipe currents.
+        if ( steam_solver.Available() ):
+            steam_solver.Equilibrium(self)
+        else:
+            for i in xrange(300):
+                self.Steam_Think()
+
+        self.Steam_Think()
+
 
     def Add_Pipe(self, n1, n2):
 
@@ -228,35 +345,38 @@ class Network:
             return False
 
         # What's in the pipe's path? 
+        # Only the items filed under the squares along the path
+        # need to be looked at.
         path = extra.More_Accurate_Line(n1.pos, n2.pos)
+        nearby = self.item_grid.Find(path)
        
-        other_pipes = set([])
         other_items = set([])
         for gpos in path:
-            if ( self.pipe_grid.has_key(gpos) ):
-                other_pipes |= set(self.pipe_grid[ gpos ])
-            elif ( self.ground_grid.has_key(gpos) ):
-                other_items |= set([self.ground_grid[ gpos ]])
+            if ( self.ground_grid.has_key(gpos) ):
+                other_items.add(self.ground_grid[ gpos ])
         other_items -= set([n1,n2])
         if ( len(other_items) != 0 ):
             sound.FX("error")
             New_Mail("Pipe collides with other items.")
             return False
 
-        for p in other_pipes:
-            if ( not p.Is_Destroyed () ):
-                if ((( p.n1 == n1 ) and ( p.n2 == n2 ))
-                or (( p.n1 == n2 ) and ( p.n2 == n1 ))):
-                    sound.FX("error")
-                    New_Mail("There is already a pipe there.")
-                    return False
-                if ( intersect.Intersect((p.n1.pos,p.n2.pos),
-                            (n1.pos,n2.pos)) != None ):
-                    sound.FX("error")
-                    New_Mail("That crosses an existing pipe.")
-                    return False
+        for p in nearby:
+            if ( not isinstance(p, Pipe) ):
+                continue
+            if ((( p.n1 == n1 ) and ( p.n2 == n2 ))
+            or (( p.n1 == n2 ) and ( p.n2 == n1 ))):
+                sound.FX("error")
+                New_Mail("There is already a pipe there.")
+                return False
+            if ( intersect.Intersect((p.n1.pos,p.n2.pos),
+                        (n1.pos,n2.pos)) != None ):
+                sound.FX("error")
+                New_Mail("That crosses an existing pipe.")
+                return False
 
-        for r in self.rock_list:
+        for r in nearby:
+            if ( not isinstance(r, Rock) ):
+                continue
             # Check for collisions with rocks by modeling each rock with
             # a big X (urgh!) Better collisions could be performed by using
             # the Sprite class
@@ -276,37 +396,74 @@ class Network:
 
         sound.FX("bamboo1")
         pipe = Pipe(n1, n2)
+        sound.FX("pipe_construction")
         self.pipe_list.append(pipe)
-
-        for gpos in path:
-            if ( not self.pipe_grid.has_key(gpos) ):
-                self.pipe_grid[ gpos ] = [pipe]
-            else:
-                self.pipe_grid[ gpos ].append(pipe)
+        self.edit_count += 1
+        self.__Connect_Pipe(pipe)
+        self.item_grid.Add(pipe, path)
+        self.dirty = True
         return True
 
     def Get_Pipe(self, gpos):
-        if ( not self.pipe_grid.has_key(gpos) ):
-            return None
-        l = self.pipe_grid[ gpos ]
-
-        # Remove destroyed pipes
-        l2 = [ pipe for pipe in l if not pipe.Is_Destroyed() ]
-
-        # Did it change? Save it again if it did,
-        # to save future recomputation.
-        if ( len(l2) != len(l) ):
-            self.pipe_grid[ gpos ] = l = l2
+        l = self.item_grid.Get(gpos, Pipe)
 
         if ( len(l) == 0 ):
             return None
         elif ( len(l) == 1 ):
             return l[ 0 ]
         else:
-            # Juggle list
-            out = l.pop(0)
-            l.append(out)
-            return out
+            # Juggle: repeated picks cycle through the pipes here
+            self.pipe_pick += 1
+            return l[ self.pipe_pick % len(l) ]
+
+    def Damage(self, item, dmg_level, by):
+        # Damage an item on behalf of a season; destroy it if that
+        # finishes it off. Returns True if it was destroyed.
+        journal.Event(item, dmg_level, by)
+        if ( isinstance(item, Building) and not item.Needs_Work() ):
+            self.dirty = True # now it needs repairs
+        if ( item.Take_Damage(dmg_level) ):
+            self.Destroy(item, by)
+            return True
+        self.Queue_Work(item)
+        return False
+
+    def Upgrade(self, item):
+        item.Begin_Upgrade()
+        self.Queue_Work(item)
+        self.dirty = True
+
+    def Toggle_Valve(self, pipe):
+        pipe.toggle_valve()
+        self.dirty = True
+
+    # The player's building commands (see journal.Do). Each one
+    # pays for itself, and returns the new node (or True) if it
+    # was built.
+
+    def Build_Node(self, gpos):
+        if ( not self.use_metal('node') ):
+            return None
+        n = Node(gpos, rocks=self.rock_list)
+        n.Sound_Effect()
+        if ( self.Add_Grid_Item(n) ):
+            return n
+        return None
+
+    def Build_Well_Node(self, gpos):
+        if ( not self.use_metal('well') ):
+            return None
+        n = Well_Node(gpos)
+        if ( self.Add_Grid_Item(n) ):
+            n.Sound_Effect()
+            return n
+        return None
+
+    def Buy_Upgrade(self, item):
+        if ( not self.use_metal('up_node') ):
+            return False
+        self.Upgrade(item)
+        return True
 
     def Pipe_Possible(self, (x1,y1), (x2,y2)):
         # no restrictions
@@ -343,6 +500,9 @@ class Network:
 
         node.Prepare_To_Die()
         self.__List_Destroy(self.node_list, node)
+        self.edit_count += 1
+        self.__Invalidate_Connections()
+        self.item_grid.Remove(node)
         rnode = node.Restore()
 
         if ( rnode == None ):
@@ -356,48 +516,72 @@ class Network:
         self.__List_Destroy(self.pipe_list, pipe)
         self.__List_Destroy(pipe.n1.pipes, pipe)
         self.__List_Destroy(pipe.n2.pipes, pipe)
-
-
-        #path = bresenham.Line(pipe.n1.pos, pipe.n2.pos)
-        #for gpos in path:
-        #    if ( self.pipe_grid.has_key(gpos) ):
-        #        l = self.pipe_grid[ gpos ]
-        #        self.__List_Destroy(l, pipe)
-        #        if ( len(l) == 0 ):
-        #            del self.pipe_grid[ gpos ]
-
+        self.edit_count += 1
+        self.__Invalidate_Connections()
+        self.item_grid.Remove(pipe)
    
     def __List_Destroy(self, lst, itm):
-        l = len(lst)
-        for i in reversed(xrange(l)):
-            if ( lst[ i ] == itm ):
-                assert itm == lst.pop(i)
+        while ( itm in lst ):
+            lst.remove(itm)
 
     def Make_Well(self, teaching=False, inhibit_effects=False):
+        # Raises Map_Full if there is nowhere left for a well.
         self.dirty = True
-        (cx, cy) = GRID_CENTRE
-        (mx, my) = GRID_SIZE
-
-        while True:
-            x = random.randint(0, mx - 1)
-            y = random.randint(0, my - 1)
-            if ( teaching ):
-                if ( x < cx ):
-                    x += cx
-            # occupied
-            if self.ground_grid.has_key((x,y)):
-                continue
+        (cx, cy) = Get_Map_Centre()
+
+        def Well_Test((x, y)):
             # too close
             if math.hypot(x - cx, y - cy) < 10:
-                continue
+                return NEVER
             # too close to a rock
-            if is_too_close((x, y), self.rock_list, 3):
-                continue
-
-            w = Well((x,y))
-            self.Add_Grid_Item(w, inhibit_effects or teaching)
-            return
-
+            if self.Rock_Field().Within((x, y), ROCK_SPACE):
+                return NEVER
+            # occupied
+            if self.ground_grid.has_key((x,y)):
+                return LATER
+            # in the tutorial, wells are on the right
+            if ( teaching and ( x < cx )):
+                return LATER
+            return PLACE
+
+        if ( self.well_placement == None ):
+            (mx, my) = self.map_size
+            self.well_placement = Placement(Rect(0, 0, mx, my))
+        w = Well(self.well_placement.Pick(Well_Test))
+        self.Add_Grid_Item(w, inhibit_effects or teaching)
+
+    def Rock_Field(self):
+        # Distance to the nearest rock, for squares up to ROCK_SPACE
+        # away. The rocks don't move, so this is made once.
+        if ( self.rock_field == None ):
+            self.rock_field = Distance_Field(self.map_size, ROCK_SPACE,
+                        [ rock.pos for rock in self.rock_list ])
+        return self.rock_field
+
+    def __getstate__(self):
+        # The connection map, work queue and rock field are left out
+        # of saved games: they are rebuilt when first needed.
+        state = self.__dict__.copy()
+        for name in [ 'connection_depth', 'work_queue', 'work_queued',
+                    'rock_field' ]:
+            del state[ name ]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('edit_count', 0)
+        self.__dict__.setdefault('pipe_pick', 0)
+        self.__dict__.setdefault('map_size', GRID_SIZE)
+        self.__dict__.setdefault('well_placement', None)
+        self.rock_field = None
+        if ( not self.__dict__.has_key('item_grid') ):
+            # Saved before the spatial index existed.
+            del self.pipe_grid
+            self.item_grid = grid_index.Grid_Index()
+            for item in ( self.rock_list + self.well_list
+                        + self.node_list + self.pipe_list ):
+                self.item_grid.Add(item, item.Grid_Cells())
+        self.__Invalidate_Connections()
 
     def Make_Ready_For_Save(self):
         for p in self.pipe_list:
@@ -6,19 +6,35 @@
 # A generator for particle animations of various types (pick an appropriate
 # factory class for your application)
 # Particle animations are precomputed and put onto colour-keyed surfaces.
+#
+# All frames of an effect are drawn on one tall "atlas" surface and
+# handed out as subsurfaces of it. If NumPy is available, every
+# particle is moved at once (see Trajectories) and drawn straight
+# into the atlas pixels; otherwise particles are moved one by one
+# with Next(). The atlas is kept in the sprite cache, so an effect
+# is only made once.
 # 
 
 import pygame , random , math
 
-import resource
+try:
+    import numpy
+    from pygame import surfarray
+except ImportError:
+    numpy = None
+
+import resource , sprite_cache
 from primitives import *
 
+NUM_FRAMES = 80
+
 
 MAX_STEAM_SIZE = 20
 MAX_STORM_SIZE = 70
 
 # A puff of steam coming out of a vent or steam maker.
 class Steam_Particle:
+    IMAGES = []     # images that the particles are made from
     def __init__(self):
         m = MAX_STEAM_SIZE / 2
         m1 = m - 1
@@ -44,6 +60,34 @@ class Steam_Particle:
         alpha = max(0, self.alpha)
         return ((self.x, self.y), (b, b, b, alpha))
 
+    def Trajectories(self, rng, n, steps):
+        # As Next(), for n particles over the given number of steps.
+        # Returns x and y, each [ step, particle ], and the colours,
+        # [ step, particle, RGBA ].
+        m = MAX_STEAM_SIZE / 2
+        x = rng.randint(m - 1, m + 2, n).astype(float)
+        y = numpy.zeros(n) + MAX_STEAM_SIZE
+        bright = rng.randint(200, 256, n)
+        dx = ( rng.random_sample(n) * 2.0 ) - 1.0
+        dy = - ( rng.random_sample(n) + 1.0 )
+
+        xs = numpy.empty((steps, n))
+        ys = numpy.empty((steps, n))
+        for k in xrange(steps):
+            x += dx
+            y += dy
+            dx *= 0.95
+            dy *= 0.95
+            dx += 0.02
+            xs[ k ] = x
+            ys[ k ] = y
+
+        colours = numpy.empty((steps, n, 4), numpy.uint8)
+        colours[ :, :, 0:3 ] = numpy.maximum(bright, 40)[ :, None ]
+        alpha = 255 - ( 15 * numpy.arange(1, steps + 1) )
+        colours[ :, :, 3 ] = numpy.maximum(0, alpha)[ :, None ]
+        return (xs, ys, colours)
+
     def Max_Size(self):
         return MAX_STEAM_SIZE
     
@@ -55,13 +99,14 @@ class Steam_Particle:
 
 # Swirling particles in a scary sand storm!
 class Storm_Particle:
+    IMAGES = [ "stormsample.png" ]
     def __init__(self):
         self.radius = 4.0 + ( random.random() * 1.8 ) # eye of storm radius = 4.
         self.angle = random.random() * TWO_PI
         self.dr = abs(random.Random().normalvariate(0.0,0.15)) + 0.01
 
         # Colour comes from an authentic set of alien storm colours.
-        stormsample = resource.Load_Image("stormsample.png")
+        stormsample = resource.Load_Image(self.IMAGES[ 0 ])
         x = random.randint(0, stormsample.get_rect().width - 1)
         y = random.randint(0, stormsample.get_rect().height - 1)
         self.c = stormsample.get_at((x,y)) 
@@ -72,6 +117,29 @@ class Storm_Particle:
         self.angle += 0.2 # angular velocity
         self.radius += self.dr
         return ((x,y), self.c)
+
+    def Trajectories(self, rng, n, steps):
+        # As in Steam_Particle.
+        radius = 4.0 + ( rng.random_sample(n) * 1.8 )
+        angle = rng.random_sample(n) * TWO_PI
+        dr = abs(rng.normal(0.0, 0.15, n)) + 0.01
+
+        k = numpy.arange(steps)[ :, None ]
+        radius = radius + ( k * dr )
+        angle = angle + ( k * 0.2 )
+        xs = ( MAX_STORM_SIZE / 2 ) + ( radius * numpy.cos(angle) )
+        ys = ( MAX_STORM_SIZE / 2 ) + ( radius * numpy.sin(angle) )
+
+        stormsample = resource.Load_Image(self.IMAGES[ 0 ])
+        (w, h) = stormsample.get_size()
+        sx = rng.randint(0, w, n)
+        sy = rng.randint(0, h, n)
+        c = numpy.empty((n, 4), numpy.uint8)
+        c[ :, 0:3 ] = surfarray.array3d(stormsample)[ sx, sy ]
+        c[ :, 3 ] = surfarray.array_alpha(stormsample)[ sx, sy ]
+        colours = numpy.empty((steps, n, 4), numpy.uint8)
+        colours[ : ] = c
+        return (xs, ys, colours)
         
     def Max_Size(self):
         return MAX_STORM_SIZE 
@@ -85,17 +153,92 @@ class Storm_Particle:
 
 
 def Make_Particle_Effect(particle_class):
-    # Generate base frames.
-    NUM_FRAMES = 80
+    # Returns a list of NUM_FRAMES frames (surfaces).
+    key = Make_Key(particle_class)
+    loaded = sprite_cache.Load(key)
+    if ( loaded != None ):
+        ([ atlas ], size) = loaded
+    else:
+        p = particle_class()
+        size = p.Max_Size()
+        atlas = pygame.Surface((size, size * NUM_FRAMES),
+                    flags=pygame.SRCALPHA)
+        atlas.fill((0, 0, 0, 0))
+        if ( numpy != None ):
+            Draw_Atlas(p, atlas)
+        else:
+            Draw_Frames(particle_class, Slice(atlas, size))
+        sprite_cache.Save(key, [ atlas ], size)
 
-    p = particle_class()
+    return Slice(atlas, size)
 
-    particle_effect = [] # a list of MAX_FRAMES frames (surfaces)
-    for i in xrange(NUM_FRAMES):
-        s = pygame.Surface((p.Max_Size(), p.Max_Size()), flags=pygame.SRCALPHA)
-        s.fill((0, 0, 0, 0))
-        particle_effect.append(s)
+def Make_Key(particle_class):
+    return (sprite_cache.CACHE_VERSION, 'particles', particle_class.__name__,
+                NUM_FRAMES, [ sprite_cache.Mtime(name)
+                    for name in particle_class.IMAGES ])
 
+def Slice(atlas, size):
+    return [ atlas.subsurface(Rect(0, i * size, size, size))
+                for i in xrange(NUM_FRAMES) ]
+
+def Draw_Atlas(p, atlas):
+    # Each particle starts at a random frame and is drawn on the
+    # frames after it, wrapping around, until it leaves the frame.
+    # Particles drawn later cover earlier ones, as in Draw_Frames:
+    # where squares overlap, only the last one drawn is written.
+    rng = numpy.random.RandomState(random.getrandbits(32))
+    n = p.Num_Particles()
+    sz = p.Particle_Size()
+    size = p.Max_Size()
+
+    (xs, ys, colours) = p.Trajectories(rng, n, NUM_FRAMES)
+    first = rng.randint(0, NUM_FRAMES, n)
+    frame = ( first + numpy.arange(NUM_FRAMES)[ :, None ] ) % NUM_FRAMES
+
+    # drawn, then stopped if it was out of the frame
+    outside = (( xs < 0 ) | ( xs >= size ) | ( ys < 0 ) | ( ys >= size ))
+    drawn = numpy.ones(outside.shape, bool)
+    drawn[ 1: ] = numpy.cumsum(outside, axis=0)[ :-1 ] == 0
+
+    # particle by particle, in drawing order
+    drawn = drawn.T
+    x = xs.T[ drawn ].astype(int)
+    y = ys.T[ drawn ].astype(int)
+    top = frame.T[ drawn ] * size
+    c = colours.transpose(1, 0, 2)[ drawn ]
+
+    # A square drawn twice at the same place on a frame counts
+    # once, as the later draw; then no two draws write a pixel on
+    # the same pass below.
+    order = numpy.lexsort((top, y, x)) # stable
+    same = (( x[ order[ 1: ] ] == x[ order[ :-1 ] ] )
+            & ( y[ order[ 1: ] ] == y[ order[ :-1 ] ] )
+            & ( top[ order[ 1: ] ] == top[ order[ :-1 ] ] ))
+    keep = numpy.sort(order[ numpy.append(~same, True) ])
+    (x, y, top) = (x[ keep ], y[ keep ], top[ keep ])
+
+    # For each pixel, the last draw to cover it.
+    (w, h) = atlas.get_size()
+    owner = numpy.zeros(w * h, int) - 1
+    for ox in xrange(sz):
+        for oy in xrange(sz):
+            px = x + ox
+            py = y + oy
+            ok = ( px >= 0 ) & ( px < size ) & ( py >= 0 ) & ( py < size )
+            pixel = ( px[ ok ] * h ) + top[ ok ] + py[ ok ]
+            owner[ pixel ] = numpy.maximum(owner[ pixel ], keep[ ok ])
+
+    pixel = numpy.flatnonzero(owner >= 0)
+    (px, py) = (pixel / h, pixel % h)
+    rgb = surfarray.pixels3d(atlas)
+    alpha = surfarray.pixels_alpha(atlas)
+    rgb[ px, py ] = c[ owner[ pixel ], 0:3 ]
+    alpha[ px, py ] = c[ owner[ pixel ], 3 ]
+    del rgb, alpha
+
+def Draw_Frames(particle_class, particle_effect):
+    # Without NumPy.
+    p = particle_class()
     sz = p.Particle_Size()
 
     for i in xrange(p.Num_Particles()):
@@ -116,6 +259,4 @@ def Make_Particle_Effect(particle_class):
                 break
             j = ( j + 1 ) % NUM_FRAMES
 
-    return particle_effect
-
 
@@ -0,0 +1,76 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+
+# Random placement of wells and rocks. A Placement deals out the
+# grid squares of an area of the map in random order, without
+# repeats, like cards from a shuffled deck. Each square dealt is
+# put to a test, which may take it, refuse it for good (too near
+# something that won't move) or refuse it for now (something is
+# built on it). Squares refused for now go back in the deck.
+#
+# So every square is refused for good at most once, and placing
+# an item takes a few squares on average, however crowded the map
+# is. When the deck runs out, there is no room: Map_Full is raised.
+#
+# The deck is shuffled as it is dealt (Fisher-Yates), and only the
+# squares that have been moved are stored, so a big map costs
+# nothing until squares are dealt from it. The Placement is kept in
+# saved games so that a restored game deals the same squares.
+
+import random
+
+
+PLACE = 0   # test results
+LATER = 1
+NEVER = 2
+
+class Map_Full(Exception):
+    pass
+
+class Placement:
+    def __init__(self, area):
+        # area is a Rect of grid squares.
+        (self.left, self.top, self.width) = (area.left, area.top, area.width)
+        self.size = area.width * area.height
+        self.dealt = 0      # squares [0, dealt) are out of the deck
+        self.moved = dict() # deck position -> square number
+
+    def __Swap(self, i, j):
+        (a, b) = (self.moved.get(i, i), self.moved.get(j, j))
+        self.moved[ i ] = b
+        self.moved[ j ] = a
+
+    def __Square(self, i):
+        n = self.moved.get(i, i)
+        return (self.left + ( n % self.width ), self.top + ( n / self.width ))
+
+    def Pick(self, test):
+        # Deal squares until test(square) returns PLACE, and
+        # return that square. It will not be dealt again.
+        later = []
+        found = None
+        while ( self.dealt < self.size ):
+            self.__Swap(self.dealt, random.randint(self.dealt, self.size - 1))
+            gpos = self.__Square(self.dealt)
+            self.dealt += 1
+            result = test(gpos)
+            if ( result == PLACE ):
+                found = gpos
+                break
+            elif ( result == LATER ):
+                later.append(self.dealt - 1)
+
+        # Squares refused for now go back in the deck.
+        for i in reversed(later):
+            self.dealt -= 1
+            self.__Swap(i, self.dealt)
+
+        if ( found == None ):
+            raise Map_Full("No room left on the map")
+        return found
+
+    def Remaining(self):
+        return self.size - self.dealt
+
@@ -88,9 +88,11 @@ PRESSURE_WARNING = 6.0
 PRESSURE_OK = 8.0
 PRESSURE_GOOD = 10.0
 
-# the grid:
+# the grid: the usual map size (see Set_Map_Size), which is
+# also how much of any map fits on the screen at the normal zoom.
 GRID_CENTRE = (25,25)
 GRID_SIZE = (50,50)
+MIN_MAP_SIZE = 30 # room for the City, and wells and rocks around it
 
 # misc:
 CITY_BOX_SIZE = 10
@@ -109,9 +111,19 @@ CGISCRIPT = "http://www.jwhitham.org/cgi-bin/LYU.cgi?"
 # things that are set by the difficulty mode:
 class Difficulty:
     def __init__(self):
+        self.overrides = dict()
         self.Set(MENU_INTERMEDIATE)
     
+    def Set_Overrides(self, overrides):
+        # Values that replace those of every level, e.g.
+        # { 'GRACE_TIME' : 15 }. Used for tuning: see simulate.py.
+        for name in overrides.keys():
+            assert hasattr(self, name), name
+        self.overrides = dict(overrides)
+        self.Set(self.level)
+
     def Set(self, level):
+        self.level = level
         if ( level in [ MENU_BEGINNER , MENU_TUTORIAL ] ):
             self.DAMAGE_FACTOR = 1.0
             self.CITY_UPGRADE_WORK_PER_LEVEL = 2
@@ -143,15 +155,18 @@ class Difficulty:
             print 'Invalid level',level
             assert False
 
+        for (name, value) in self.overrides.items():
+            setattr(self, name, value)
+
 
 DIFFICULTY = Difficulty()
 
 def Scr_To_Grid((x,y)):
-    return (x / __grid_size, y / __grid_size)
+    return (( x + __view_x ) / __grid_size, ( y + __view_y ) / __grid_size)
 
 def Grid_To_Scr((x,y)):
-    return (( x * __grid_size ) + __h_grid_size,
-            ( y * __grid_size ) + __h_grid_size )
+    return (( x * __grid_size ) + __h_grid_size - __view_x,
+            ( y * __grid_size ) + __h_grid_size - __view_y )
 
 def Grid_To_Scr_Rect((x,y)):
     (cx,cy) = Grid_To_Scr((x,y))
@@ -168,7 +183,44 @@ def Set_Grid_Size(sz):
 def Get_Grid_Size():
     return __grid_size
 
+def Set_View_Origin((x,y)):
+    # The camera: the point of the map, in pixels, that is drawn at
+    # the top left of the screen. See ui.Camera.
+    global __view_x, __view_y
+    __view_x = x
+    __view_y = y
+
+def Get_View_Origin():
+    return (__view_x, __view_y)
+
+def Set_Map_Size((w,h)):
+    global __map_size
+    __map_size = (w,h)
+
+def Get_Map_Size():
+    return __map_size
+
+def Set_New_Map_Size((w,h)):
+    # The map size for new games ("--map-size"). A restored game
+    # keeps its own, so this is kept apart from the current one.
+    global __new_map_size
+    __new_map_size = (w,h)
+
+def Get_New_Map_Size():
+    return __new_map_size
+
+def Get_Map_Centre():
+    (w,h) = __map_size
+    return (w / 2, h / 2)
+
+def In_Map((x,y)):
+    (w,h) = __map_size
+    return (( 0 <= x < w ) and ( 0 <= y < h ))
+
 Set_Grid_Size(10)
+Set_View_Origin((0,0))
+Set_Map_Size(GRID_SIZE)
+Set_New_Map_Size(GRID_SIZE)
 
 class Point(object):
 
@@ -319,8 +371,12 @@ class GVector(Point):
 
     @property
     def in_pixels(self):
-        """Equivalent vector measured in pixes"""
-        return PVector(Grid_To_Scr(self.tup))
+        """Equivalent vector measured in pixes (the camera position
+        is not taken into account)
+        """
+        gs = Get_Grid_Size()
+        (x, y) = self.tup
+        return PVector(( x * gs ) + ( gs / 2 ), ( y * gs ) + ( gs / 2 ))
 
 
 def distance(a, b):
@@ -356,6 +412,12 @@ def draw_ellipse(surface, p, width, color, line_width, center=True, filled=False
     return int(w), height
 
 
+def Ellipse_Rect(c, (w, h)):
+    """Bounding box of an ellipse drawn by draw_ellipse, given its
+    centre and the (width, height) that draw_ellipse returned
+    """
+    return Rect(c.x - w - 1, c.y - h - 1, ( w + 1 ) * 2, ( h + 1 ) * 2)
+
 def draw_border(s, r):
     """Draw borders around a surface, used for debugging
 
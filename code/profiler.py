@@ -0,0 +1,122 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+
+# Named timers for the hot paths of the main loop. Each timer keeps
+# its most recent samples, so the percentiles are for the last few
+# seconds of play. Timing is off unless "--profile" is given; then
+# the figures are shown over the map and written out on exit.
+#
+#   t = profiler.Begin()
+#   ui.Draw_Game(...)
+#   profiler.End("Draw_Game", t)
+#
+# Begin() returns None while timing is off, and End() does nothing
+# with it, so the timers cost next to nothing in normal play.
+
+import collections , csv , json , timeit
+
+from primitives import *
+
+
+WINDOW = 350    # samples kept per timer: ten seconds of frames
+PERCENTILES = [ 50, 95, 99 ]
+
+__enabled = False
+__order = []
+__samples = dict()  # name -> recent times, in seconds
+__calls = dict()    # name -> calls since Reset
+
+overlay = False
+
+
+def Enable(on=True, show_overlay=True):
+    global __enabled, overlay
+    __enabled = on
+    overlay = on and show_overlay
+
+def Is_Enabled():
+    return __enabled
+
+def Reset():
+    global __order, __samples, __calls
+    __order = []
+    __samples = dict()
+    __calls = dict()
+
+def Begin():
+    if ( not __enabled ):
+        return None
+    return timeit.default_timer()
+
+def End(name, start):
+    if ( start == None ):
+        return
+    Record(name, timeit.default_timer() - start)
+
+def Record(name, seconds):
+    if ( not __samples.has_key(name) ):
+        __order.append(name)
+        __samples[ name ] = collections.deque(maxlen=WINDOW)
+        __calls[ name ] = 0
+    __samples[ name ].append(seconds)
+    __calls[ name ] += 1
+
+def Percentile(values, p):
+    # values must be sorted.
+    if ( len(values) == 0 ):
+        return 0.0
+    return values[ int(round(( len(values) - 1 ) * p / 100.0)) ]
+
+def Summary():
+    # One dict per timer, in the order they were first used.
+    # Times are in milliseconds, over the recent samples.
+    out = []
+    for name in __order:
+        values = sorted(__samples[ name ])
+        row = collections.OrderedDict()
+        row[ 'name' ] = name
+        row[ 'calls' ] = __calls[ name ]
+        row[ 'mean' ] = 1000.0 * sum(values) / len(values)
+        for p in PERCENTILES:
+            row[ 'p%u' % p ] = 1000.0 * Percentile(values, p)
+        row[ 'max' ] = 1000.0 * values[ -1 ]
+        out.append(row)
+    return out
+
+def Dump(fname):
+    # JSON if the file name ends in .json, otherwise CSV.
+    rows = Summary()
+    f = file(fname, "wb")
+    if ( fname.endswith('.json') ):
+        json.dump(rows, f, indent=1)
+    elif ( len(rows) != 0 ):
+        w = csv.writer(f)
+        w.writerow(rows[ 0 ].keys())
+        for row in rows:
+            w.writerow([ ( '%1.3f' % v if isinstance(v, float) else v )
+                        for v in row.values() ])
+    f.close()
+
+def Draw(output):
+    # The overlay. Returns the area drawn on.
+    import stats
+
+    font = stats.Get_Font(12)
+    lines = [ "%-14s %6s %6s %6s" % ("ms", "p50", "p95", "max") ]
+    for row in Summary():
+        lines.append("%-14s %6.2f %6.2f %6.2f" % (row[ 'name' ][ :14 ],
+                    row[ 'p50' ], row[ 'p95' ], row[ 'max' ]))
+
+    surfs = [ font.render(l, True, (255, 255, 0)) for l in lines ]
+    width = max([ s.get_width() for s in surfs ]) + 8
+    height = sum([ s.get_height() for s in surfs ]) + 8
+    r = Rect(4, 4, width, height).clip(output.get_rect())
+    output.fill((0, 0, 0), r)
+    y = r.top + 4
+    for s in surfs:
+        output.blit(s, (r.left + 4, y))
+        y += s.get_height()
+    return r
+
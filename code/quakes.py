@@ -8,10 +8,11 @@
 #
 # Well, not quite...
 
-import math , pygame , random
+import bisect , math , pygame , random
 from pygame.locals import *
 
-import extra , intersect , sound
+import extra , intersect , journal , sound
+from placement import Map_Full
 from quiet_season import Quiet_Season
 from primitives import *
 from map_items import *
@@ -94,37 +95,44 @@ class Quake_Season(Quiet_Season):
 
     def __Apply_Damage(self):
         # Apply damage as appropriate
-        damage_nodes = set([])
+        line = self.fault_lines
+
+        # Any pipes that cross the fault line are destroyed. Only
+        # the pipes filed near each part of the line in the item
+        # grid are tried against it. They are then taken in the order
+        # they were built, so that a replayed quake does the same
+        # damage in the same order.
+        grid = self.net.item_grid
         destroy_pipes = set([])
-
-        for i in xrange(len(self.fault_lines) - 1):
-            gpos1 = self.fault_lines[ i ]
-            gpos2 = self.fault_lines[ i + 1 ]
-            # Any pipes that intersect gpos1 and gpos2 are destroyed.
-            for pipe in self.net.pipe_list:
-                if ( intersect.Intersect((pipe.n1.pos,pipe.n2.pos),
-                        (gpos1, gpos2)) != None ):
-                    destroy_pipes |= set([ pipe ])
-
+        for i in xrange(len(line) - 1):
+            gpos1 = line[ i ]
+            gpos2 = line[ i + 1 ]
+            for pipe in grid.Find(Fault_Cells(gpos1, gpos2), Pipe):
+                if (( pipe not in destroy_pipes )
+                and ( intersect.Intersect((pipe.n1.pos,pipe.n2.pos),
+                        (gpos1, gpos2)) != None )):
+                    destroy_pipes.add(pipe)
+        destroy_pipes = sorted(destroy_pipes, key=grid.order.get)
+
+        damage_nodes = []
         for pipe in destroy_pipes:
-            damage_nodes |= set([ pipe.n1, pipe.n2 ])
+            for node in (pipe.n1, pipe.n2):
+                if ( node not in damage_nodes ):
+                    damage_nodes.append(node)
 
         for pipe in destroy_pipes:
+            # (Network.Damage journals the rest of the damage.)
+            journal.Event(pipe, pipe.health, "quakes")
             self.net.Destroy(pipe, "quakes")
 
+        distance = Fault_Distance(line)
         for node in damage_nodes:
             # Nodes take damage. Calculate how much...
             # What's the distance from the fault line?
-            # Use Manhattan distance to save needless effort.
-            distance = max_dist = 10
-            (nx, ny) = node.pos
-            for (fx, fy) in self.fault_lines:
-                distance = min([abs(fx - nx), abs(fy - ny), distance])
-
-            dmg = (( max_dist - distance ) * self.damage )
+            max_dist = 10
+            dmg = (( max_dist - distance(node.pos, max_dist) ) * self.damage )
             if ( dmg > 0 ):
-                if ( node.Take_Damage(dmg) ):
-                    self.net.Destroy(node, "quakes")
+                self.net.Damage(node, dmg, "quakes")
 
         if ( self.damage < 2.0 ):
             # Some Wells are created.
@@ -134,8 +142,11 @@ class Quake_Season(Quiet_Season):
                 New_Mail("A new steam well has appeared!")
             elif ( num_wells > 1 ):
                 New_Mail("Some new steam wells have appeared!")
-            for i in xrange(num_wells):
-                self.net.Make_Well(False, True)
+            try:
+                for i in xrange(num_wells):
+                    self.net.Make_Well(False, True)
+            except Map_Full:
+                pass # no room for any more
 
     def Draw(self, output, update_area):
         if ( self.QUAKE <= self.state <= self.QUAKE_AFTERMATH ):
@@ -155,6 +166,9 @@ class Quake_Season(Quiet_Season):
     def Is_Shaking(self):
         return ( self.state in [ self.QUAKE, self.QUAKE_DAMAGE ] )
 
+    def Fingerprint(self):
+        return [ self.state, self.unfurling ] + self.fault_lines
+
     def Per_Frame(self, frame_time):
         if ( self.QUAKE <= self.state < self.QUAKE_AFTERMATH ):
             self.unfurling += 1
@@ -163,6 +177,38 @@ class Quake_Season(Quiet_Season):
                 self.fault_lines.pop(0) # the reverse of unfurling!
 
 
+def Fault_Cells(gpos1, gpos2):
+    # The grid squares that a pipe crossing part of the fault line
+    # might be filed under. Pipes are filed under the squares of
+    # extra.More_Accurate_Line, and a point on a pipe is never more
+    # than a square away from one of them. The fault line is marked
+    # every half square (or less) along its length, and every point
+    # on it is within three quarters of a square of a marked square.
+    # So the marked squares and the squares next to them include one
+    # of the squares of any pipe that crosses the fault line.
+    return extra.Line_Cells(gpos1, gpos2, 1)
+
+def Fault_Distance(line):
+    # How far a node is from the fault line, for quake damage.
+    # This is the smallest difference in x or in y between the
+    # node and any point of the line, which splits into a distance
+    # along each axis: a sorted list of the line's x positions and
+    # one of its y positions make the distance field.
+    axes = [ sorted([ p[ i ] for p in line ]) for i in (0, 1) ]
+
+    def Nearest(values, v):
+        i = bisect.bisect_left(values, v)
+        return min([ abs(w - v) for w in values[ max(i - 1, 0):i + 1 ] ])
+
+    def Distance(pos, max_dist):
+        distance = max_dist
+        for (values, v) in zip(axes, pos):
+            if ( len(values) != 0 ):
+                distance = min(distance, Nearest(values, v))
+        return distance
+    return Distance
+
+
 def Init_Quakes():
     global quake_sound
     quake_sound = sound.Persisting_Sound("earthquake")
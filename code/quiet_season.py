@@ -27,4 +27,8 @@ class Quiet_Season:
     def Is_Shaking(self):
         return False
 
+    def Fingerprint(self):
+        # The state of the season, for checking replays (see journal.py).
+        return []
+
 
@@ -0,0 +1,380 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+# The saved game format. Pickling the whole Game_Data made big
+# files, slowly, as every map item was written out attribute by
+# attribute with its class name and all. Here, the wells, rocks,
+# nodes and pipes are written as columns of numbers, one array per
+# attribute, and so is the history kept for the review screen.
+# Everything else (the seasons, the game clock, the odd bits of the
+# Network) is still pickled, but with map items written as their
+# positions in the Network's lists.
+#
+# After the label written by save_game, a file holds:
+#
+#   MAGIC, then the format version (2 bytes)
+#   blocks of: tag (4 bytes), length (4 bytes), zlib data
+#
+# Blocks with tags that aren't known are skipped, so new ones can
+# be added without changing the version. Change the version when a
+# block's columns change. Files without MAGIC are old saves, which
+# are just a pickled Game_Data.
+#
+# Saving is in two parts. Snapshot copies the game, and must be done
+# between ticks; Write_Blocks makes the blocks from the copy,
+# compresses them and writes them, and may be done on another thread
+# (see autosave.py).
+#
+
+import array , cPickle , pickle , struct , sys , zlib
+from cStringIO import StringIO
+from operator import attrgetter , itemgetter
+
+import review , grid_index
+from network import Network
+from map_items import *
+
+
+MAGIC = "LYSAVE"
+FORMAT_VERSION = 1
+
+BIG_ENDIAN = ( sys.byteorder == "big" )
+
+# Columns of each block: (attribute, array typecode). The
+# typecodes are those of the array module: 'B' is a byte, 'i' a
+# 32 bit int and 'd' a double.
+
+WELL_COLUMNS = [ ("x", 'i'), ("y", 'i') ]
+
+ROCK_COLUMNS = [ ("x", 'i'), ("y", 'i'), ("size", 'd'), ("quantity", 'd'),
+        ("reflexes", 'B') ]
+
+# One row for each reflex of each rock, in order.
+REFLEX_COLUMNS = [ ("seq", 'i') ]
+
+NODE_COLUMNS = [ ("kind", 'B'), ("x", 'i'), ("y", 'i'), ("flags", 'B'),
+        ("picture", 'B'), ("health", 'i'), ("max_health", 'i'),
+        ("tech_level", 'i'), ("connection_value", 'i'),
+        ("popup_disappears_at", 'd'), ("hissing_started", 'd'),
+        ("charge", 'd'), ("voltage", 'd'), ("capacity", 'd'),
+        ("conveyor_offset", 'd'), ("metal_yield", 'd'),
+        ("max_rock_distance", 'i'), ("production", 'd'),
+        ("on_well", 'i') ]
+
+PIPE_COLUMNS = [ ("n1", 'i'), ("n2", 'i'), ("flags", 'B'),
+        ("health", 'i'), ("max_health", 'i'), ("tech_level", 'i'),
+        ("connection_value", 'i'), ("popup_disappears_at", 'd'),
+        ("resistance", 'd'), ("current_n1_to_n2", 'd'),
+        ("dot_drawing_offset", 'd') ]
+
+HISTORY_COLUMNS = [ ("day", 'i'), ("supply", 'd'), ("demand", 'd'),
+        ("num_nodes", 'i'), ("num_pipes", 'i'), ("tech_level", 'i'),
+        ("work_units_used", 'i'), ("work_units_avail", 'i'),
+        ("city_pressure", 'd'), ("metal_avail", 'd'),
+        ("metal_production", 'd') ]
+
+NODE_KINDS = [ Node, Well_Node, City_Node ]
+
+# The City's own attributes, which are pickled.
+CITY_FIELDS = [ "avail_work_units", "city_upgrade", "city_upgrade_start",
+        "total_steam", "metal_quantity", "metal_production" ]
+
+# Flags for nodes and pipes
+COMPLETE = 1
+WAS_ONCE_COMPLETE = 2
+DESTROYED = 4
+TUTOR_SPECIAL = 8
+VENTING = 16        # nodes
+VALVE_OPEN = 16     # pipes
+
+# The Network's lists and indexes are made again from the blocks.
+NETWORK_REBUILT = [ "well_list", "rock_list", "node_list", "pipe_list",
+        "ground_grid", "item_grid" ]
+
+LIST_NAMES = { 'W' : "well_list", 'R' : "rock_list",
+        'N' : "node_list", 'P' : "pipe_list" }
+
+
+def Pack_Columns(columns, rows):
+    out = [ struct.pack("<I", len(rows)) ]
+    for (i, (name, code)) in enumerate(columns):
+        a = array.array(code, [ row[ i ] for row in rows ])
+        if ( BIG_ENDIAN ):
+            a.byteswap()
+        out.append(a.tostring())
+    return "".join(out)
+
+def Unpack_Columns(columns, data):
+    (n,) = struct.unpack_from("<I", data)
+    at = 4
+    arrays = []
+    for (name, code) in columns:
+        a = array.array(code)
+        size = a.itemsize * n
+        a.fromstring(data[ at:at + size ])
+        if ( BIG_ENDIAN ):
+            a.byteswap()
+        arrays.append(a)
+        at += size
+    if ( at != len(data) ):
+        raise IOError("Save file block is the wrong size")
+    return zip(*arrays)
+
+# Snapshot is done between ticks, so it only copies: each map item
+# is read into a tuple with one of these, and the columns are made
+# from the tuples later (see Blocks). They read the items' __dict__,
+# which is a few times quicker than getting each attribute.
+Dict = attrgetter("__dict__")
+Node_Copy = itemgetter("pos", "complete", "was_once_complete",
+        "destroyed", "tutor_special", "draw_obj", "draw_obj_incomplete",
+        "draw_obj_venting", "draw_obj_finished", "health", "max_health",
+        "tech_level", "connection_value", "popup_disappears_at",
+        "_hissing_started", "conveyor_offset", "metal_yield",
+        "max_rock_distance")
+Steam_Copy = itemgetter("venting", "charge", "voltage", "capacity")
+Pipe_Copy = itemgetter("n1", "n2", "complete", "was_once_complete",
+        "destroyed", "tutor_special", "valve_open", "health", "max_health",
+        "tech_level", "connection_value", "popup_disappears_at",
+        "resistance", "current_n1_to_n2", "dot_drawing_offset")
+History_Copy = itemgetter(*[ name for (name, code) in HISTORY_COLUMNS ])
+
+def Building_Flags(complete, was_once_complete, destroyed, tutor_special):
+    return (( complete * COMPLETE )
+            | ( was_once_complete * WAS_ONCE_COMPLETE )
+            | ( destroyed * DESTROYED )
+            | ( tutor_special * TUTOR_SPECIAL ))
+
+def Set_Building_Flags(item, flags):
+    item.complete = bool(flags & COMPLETE)
+    item.was_once_complete = bool(flags & WAS_ONCE_COMPLETE)
+    item.destroyed = bool(flags & DESTROYED)
+    item.tutor_special = bool(flags & TUTOR_SPECIAL)
+
+# For making a Network without running its __init__
+class Empty:
+    pass
+
+def Pictures(node):
+    return [ node.draw_obj_incomplete, node.draw_obj_venting,
+            node.draw_obj_finished ]
+
+
+def Write(f, g):
+    Write_Blocks(f, Snapshot(g))
+
+def Snapshot(g):
+    # A copy of the game, for Blocks. Map items are copied as tuples
+    # of their attributes, which don't change once taken. The rest
+    # is pickled; the pickle is the copy, and a small one, as map
+    # items, the Network and the history are written as references
+    # to their own blocks.
+    net = g.net
+    index = dict()
+    for (tag, name) in LIST_NAMES.items():
+        items = getattr(net, name)
+        index.update(zip(map(id, items),
+                    [ (tag, i) for i in xrange(len(items)) ]))
+    index[ id(net) ] = ('net',)
+    index[ id(g.historian) ] = ('history',)
+
+    wells = [ item.pos for item in net.well_list ]
+    rocks = [ (rock.pos, rock._size, rock.quantity, tuple(rock.reflexes))
+                for rock in net.rock_list ]
+    nodes = [ (node.__class__, Node_Copy(d), Steam_Copy(node.steam.__dict__),
+                tuple(d[ "other_item_stack" ]), d.get("production", 0))
+                for (node, d) in zip(net.node_list, map(Dict, net.node_list)) ]
+    pipes = map(Pipe_Copy, map(Dict, net.pipe_list))
+    history = map(History_Copy, map(Dict, g.historian))
+
+    cities = [ (i, dict([ (name, getattr(node, name))
+                        for name in CITY_FIELDS ]))
+                for (i, node) in enumerate(net.node_list)
+                if ( isinstance(node, City_Node) ) ]
+
+    net_state = net.__getstate__()
+    for name in NETWORK_REBUILT:
+        del net_state[ name ]
+
+    def Persistent_Id(obj):
+        return index.get(id(obj))
+
+    s = StringIO()
+    p = cPickle.Pickler(s, cPickle.HIGHEST_PROTOCOL)
+    p.persistent_id = Persistent_Id
+    p.dump((net_state, cities, g))
+
+    return (index, wells, rocks, nodes, pipes, history, s.getvalue())
+
+def Blocks(snapshot):
+    # The (tag, data) blocks of a Snapshot. This doesn't touch the
+    # game, so it may be done on another thread.
+    (index, wells, rocks, nodes, pipes, history, game) = snapshot
+
+    rock_rows = []
+    reflexes = []
+    for ((x, y), size, quantity, rock_reflexes) in rocks:
+        rock_rows.append((x, y, size, quantity, len(rock_reflexes)))
+        reflexes.extend([ (seq,) for (rx, ry, seq) in rock_reflexes ])
+
+    node_rows = []
+    for (kind, row, steam, stack, production) in nodes:
+        on_well = -1
+        if ( len(stack) != 0 ):
+            [ well ] = stack
+            (tag, on_well) = index[ id(well) ]
+            assert tag == 'W'
+        (x, y) = row[ 0 ]
+        picture = list(row[ 6:9 ]).index(row[ 5 ])
+        node_rows.append((NODE_KINDS.index(kind), x, y,
+                Building_Flags(*row[ 1:5 ]) | ( steam[ 0 ] * VENTING ), picture)
+                + row[ 9:15 ] + steam[ 1: ] + row[ 15: ]
+                + (production, on_well))
+
+    pipe_rows = [ (index[ id(row[ 0 ]) ][ 1 ], index[ id(row[ 1 ]) ][ 1 ],
+                Building_Flags(*row[ 2:6 ]) | ( row[ 6 ] * VALVE_OPEN ))
+                + row[ 7: ] for row in pipes ]
+
+    return [ ("WELL", Pack_Columns(WELL_COLUMNS, wells)),
+            ("ROCK", Pack_Columns(ROCK_COLUMNS, rock_rows)),
+            ("RFLX", Pack_Columns(REFLEX_COLUMNS, reflexes)),
+            ("NODE", Pack_Columns(NODE_COLUMNS, node_rows)),
+            ("PIPE", Pack_Columns(PIPE_COLUMNS, pipe_rows)),
+            ("HIST", Pack_Columns(HISTORY_COLUMNS, history)),
+            ("GAME", game) ]
+
+def Write_Blocks(f, snapshot):
+    f.write(MAGIC)
+    f.write(struct.pack("<H", FORMAT_VERSION))
+    for (tag, data) in Blocks(snapshot):
+        data = zlib.compress(data)
+        f.write(struct.pack("<4sI", tag, len(data)))
+        f.write(data)
+
+
+def Read(f):
+    start = f.tell()
+    if ( f.read(len(MAGIC)) != MAGIC ):
+        # An old save: the whole Game_Data, pickled.
+        f.seek(start)
+        return pickle.load(f)
+
+    (version,) = struct.unpack("<H", f.read(2))
+    if ( version > FORMAT_VERSION ):
+        raise IOError("Saved by a newer version of the game")
+
+    blocks = dict()
+    while True:
+        head = f.read(8)
+        if ( len(head) == 0 ):
+            break
+        (tag, size) = struct.unpack("<4sI", head)
+        data = f.read(size)
+        if ( len(data) != size ):
+            raise IOError("Save file is truncated")
+        blocks[ tag ] = zlib.decompress(data)
+
+    well_list = [ Well((x, y))
+                for (x, y) in Unpack_Columns(WELL_COLUMNS, blocks[ "WELL" ]) ]
+
+    rock_list = []
+    seqs = [ seq for (seq,) in Unpack_Columns(REFLEX_COLUMNS,
+                blocks[ "RFLX" ]) ]
+    for (x, y, size, quantity, reflexes) in Unpack_Columns(
+                ROCK_COLUMNS, blocks[ "ROCK" ]):
+        rock = Rock((x, y), size=size, reflexes=seqs[ :reflexes ])
+        del seqs[ :reflexes ]
+        rock.quantity = quantity
+        rock_list.append(rock)
+
+    node_list = []
+    for (kind, x, y, flags, picture, health, max_health, tech_level,
+                connection_value, popup_disappears_at, hissing_started,
+                charge, voltage, capacity, conveyor_offset, metal_yield,
+                max_rock_distance, production, on_well) in Unpack_Columns(
+                NODE_COLUMNS, blocks[ "NODE" ]):
+        node = NODE_KINDS[ kind ]((x, y))
+        Set_Building_Flags(node, flags)
+        node.draw_obj = Pictures(node)[ picture ]
+        node.health = health
+        node.max_health = max_health
+        node.tech_level = tech_level
+        node.connection_value = connection_value
+        node.popup_disappears_at = popup_disappears_at
+        node._hissing_started = hissing_started
+        node.steam.charge = charge
+        node.steam.voltage = voltage
+        node.steam.capacity = capacity
+        node.steam.venting = bool(flags & VENTING)
+        node.conveyor_offset = conveyor_offset
+        node.metal_yield = metal_yield
+        node.max_rock_distance = max_rock_distance
+        if ( isinstance(node, Well_Node) ):
+            node.production = production
+        if ( on_well >= 0 ):
+            node.other_item_stack.append(well_list[ on_well ])
+        node.locate_nearby_rocks(rock_list)
+        node_list.append(node)
+
+    pipe_list = []
+    for (n1, n2, flags, health, max_health, tech_level, connection_value,
+                popup_disappears_at, resistance, current_n1_to_n2,
+                dot_drawing_offset) in Unpack_Columns(
+                PIPE_COLUMNS, blocks[ "PIPE" ]):
+        pipe = Pipe(node_list[ n1 ], node_list[ n2 ])
+        Set_Building_Flags(pipe, flags)
+        pipe.valve_open = bool(flags & VALVE_OPEN)
+        pipe.health = health
+        pipe.max_health = max_health
+        pipe.tech_level = tech_level
+        pipe.connection_value = connection_value
+        pipe.popup_disappears_at = popup_disappears_at
+        pipe.resistance = resistance
+        pipe.current_n1_to_n2 = current_n1_to_n2
+        pipe.dot_drawing_offset = int(dot_drawing_offset)
+        pipe_list.append(pipe)
+
+    historian = []
+    for row in Unpack_Columns(HISTORY_COLUMNS, blocks[ "HIST" ]):
+        hr = review.Historical_Record()
+        for ((name, code), value) in zip(HISTORY_COLUMNS, row):
+            setattr(hr, name, value)
+        historian.append(hr)
+
+    # Wells are on the ground, unless a node is on top.
+    ground_grid = dict()
+    for item in well_list + node_list:
+        ground_grid[ item.pos ] = item
+
+    item_grid = grid_index.Grid_Index()
+    for item in rock_list + well_list + node_list + pipe_list:
+        item_grid.Add(item, item.Grid_Cells())
+
+    # The Network is filled in once the rest has been unpickled,
+    # as that refers to it.
+    net = Empty()
+    net.__class__ = Network
+    lists = dict(well_list=well_list, rock_list=rock_list,
+                node_list=node_list, pipe_list=pipe_list)
+
+    def Persistent_Load(pid):
+        if ( pid == ('net',) ):
+            return net
+        elif ( pid == ('history',) ):
+            return historian
+        (tag, i) = pid
+        return lists[ LIST_NAMES[ tag ] ][ i ]
+
+    u = cPickle.Unpickler(StringIO(blocks[ "GAME" ]))
+    u.persistent_load = Persistent_Load
+    (net_state, cities, g) = u.load()
+
+    for (i, fields) in cities:
+        node_list[ i ].__dict__.update(fields)
+
+    net_state.update(lists)
+    net_state[ 'ground_grid' ] = ground_grid
+    net_state[ 'item_grid' ] = item_grid
+    net.__setstate__(net_state)
+    return g
+
@@ -3,11 +3,13 @@
 # This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
 # 
 
-import pickle, extra, os
+import extra, os, save_format
 
 
 HEADER_SIZE = 100
 NUM_SLOTS = 10
+AUTOSAVE_SLOT = 11
+JOURNAL_SLOT = 12   # see journal.py
 
 def Make_Save_Name(num):
     name = "save" + str(num) + ".dat"
@@ -22,7 +24,7 @@ def Load(g, num):
     try:
         f = file(name, "rb")
         header = f.read( HEADER_SIZE )
-        g2 = pickle.load(f)
+        g2 = save_format.Read(f)
         f.close()
     except Exception, x:
         y = ("Error restoring file: " + repr(x) + str(x))
@@ -35,6 +37,13 @@ def Load(g, num):
     return (g2, None)
     
 def Save(g, num, label):
+    return Save_Snapshot(save_format.Snapshot(g), num, label)
+
+def Save_Snapshot(snapshot, num, label):
+    # Saves a copy made by save_format.Snapshot. Doesn't touch the
+    # game, so may be called from another thread. The file is written
+    # under another name, then renamed, so that the old save is kept
+    # if anything goes wrong.
     l = len(label)
     if ( l > HEADER_SIZE ):
         label = label[ 0:HEADER_SIZE ]
@@ -42,11 +51,17 @@ def Save(g, num, label):
         label += ( " " * ( HEADER_SIZE - l ))
 
     name = Make_Save_Name(num)
+    temp_name = name + ".tmp"
     try:
-        f = file(name, "wb")
+        f = file(temp_name, "wb")
         f.write(label)
-        pickle.dump(g,f)
+        save_format.Write_Blocks(f, snapshot)
+        f.flush()
+        os.fsync(f.fileno())
         f.close()
+        if (( os.name == "nt" ) and ( os.path.exists(name) )):
+            os.remove(name) # rename won't replace a file on Windows
+        os.rename(temp_name, name)
     except Exception, x:
         return "Error saving file: " + repr(x) + str(x)
     
@@ -24,6 +24,14 @@ class Save_Menu(menu.Menu):
 
             file_list.append((j, label, []))
 
+        label = save_game.Get_Info(save_game.AUTOSAVE_SLOT)
+        if (( label != None ) and ( not saving )):
+            file_list.append((save_game.AUTOSAVE_SLOT, "    " + label, []))
+
+        label = save_game.Get_Info(save_game.JOURNAL_SLOT)
+        if (( label != None ) and ( not saving )):
+            file_list.append((save_game.JOURNAL_SLOT, "    " + label, []))
+
         file_list.append((None, None, []))
         file_list.append((-1, "Cancel", []))
         
@@ -0,0 +1,195 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+# Batch simulator for difficulty tuning. Plays headless games for
+# every combination of the given difficulty settings and seeds,
+# spread over a pool of processes, and writes the statistics that
+# review.Analyse_Network records during each game to one table.
+#
+# python code/simulate.py --set BASIC_STEAM_PRODUCTION=4,6,8 \
+#       --set GRACE_TIME=10,20 --seeds 20 --output sweep.csv
+#
+# Output is CSV, or Parquet if the file name ends in .parquet
+# (that needs pandas).
+#
+
+from argparse import ArgumentParser
+import csv , itertools , multiprocessing , os , random , sys , time
+
+import headless , gametime
+from primitives import *
+
+
+CHALLENGES = {
+    'beginner' : MENU_BEGINNER,
+    'intermediate' : MENU_INTERMEDIATE,
+    'expert' : MENU_EXPERT,
+    'peaceful' : MENU_PEACEFUL,
+}
+
+RECORD_FIELDS = [ 'day', 'supply', 'demand', 'num_nodes', 'num_pipes',
+        'tech_level', 'work_units_used', 'work_units_avail',
+        'city_pressure', 'metal_avail', 'metal_production' ]
+
+
+class Builder:
+    # A simple scripted player with a random streak. Once a day it
+    # either starts a city upgrade, when the City has a quarter more
+    # steam than it needs, or builds a steam maker on one of the
+    # wells nearest to the City and pipes it to the nearest node
+    # that will take the pipe. A steam maker that can't be piped
+    # is taken down again and its metal given back.
+    def __init__(self, seed, period=int(1.0 / gametime.TICK_LENGTH)):
+        self.rng = random.Random(seed)
+        self.period = period
+        self.countdown = period
+
+    def __call__(self, g):
+        self.countdown -= 1
+        if ( self.countdown > 0 ):
+            return
+        self.countdown = self.period
+
+        net = g.net
+        hub = net.hub
+        if (( hub.Get_Pressure() >= PRESSURE_OK )
+        and ( hub.Get_Steam_Supply() >= ( hub.Get_Steam_Demand() * 1.25 ))
+        and ( not hub.Needs_Work() )
+        and ( self.rng.random() < 0.5 )):
+            net.Upgrade(hub)
+        else:
+            self.Build_Well_Node(net)
+
+    def Build_Well_Node(self, net):
+        nodes = [ n for n in net.node_list if net.Is_Connected(n) ]
+        wells = [ w for w in net.well_list
+                    if ( net.ground_grid.get(w.pos) == w ) ]
+        if (( len(wells) == 0 ) or ( len(nodes) == 0 )):
+            return
+
+        def Nearest(pos, items):
+            return sorted(items, key=lambda i: distance(pos, i.pos))
+
+        wells = Nearest(net.hub.pos, wells)[ :3 ]
+        pos = self.rng.choice(wells).pos
+        metal = net.hub.metal_quantity
+        n = net.Build_Well_Node(pos)
+        if ( n != None ):
+            for other in Nearest(pos, nodes)[ :4 ]:
+                if ( net.Add_Pipe(other, n) ):
+                    return
+            net.Destroy(n)
+        net.hub.metal_quantity = metal # nothing was built
+
+
+def Play(job):
+    # Runs in a worker process: one game.
+    (challenge, overrides, seed, ticks) = job
+    DIFFICULTY.Set_Overrides(overrides)
+    g = headless.Run(challenge, ticks, seed, Builder(seed))
+    return (overrides, seed, g.win, g.game_running, g.historian)
+
+def Initialise_Worker(data_dir):
+    headless.Initialise(data_dir)
+
+
+def Parse_Setting(text):
+    # NAME=v1,v2,... -> (NAME, [v1, v2, ...])
+    (name, values) = text.split('=', 1)
+    name = name.strip().upper()
+    if ( not hasattr(DIFFICULTY, name) ):
+        raise ValueError("unknown difficulty setting: " + name)
+    out = []
+    for v in values.split(','):
+        try:
+            out.append(int(v))
+        except ValueError:
+            out.append(float(v))
+    return (name, out)
+
+def Make_Jobs(challenge, settings, seeds, ticks):
+    names = [ name for (name, values) in settings ]
+    jobs = []
+    for values in itertools.product(*[ v for (name, v) in settings ]):
+        overrides = dict(zip(names, values))
+        for seed in seeds:
+            jobs.append((challenge, overrides, seed, ticks))
+    return jobs
+
+def Rows(results, names):
+    for (overrides, seed, win, running, historian) in results:
+        if ( running ):
+            outcome = 'running'
+        elif ( win ):
+            outcome = 'won'
+        else:
+            outcome = 'lost'
+        for hr in historian:
+            yield ([ overrides[ name ] for name in names ] +
+                    [ seed, outcome ] +
+                    [ getattr(hr, field) for field in RECORD_FIELDS ])
+
+def Write_Table(fname, header, rows):
+    if ( fname.endswith('.parquet') ):
+        import pandas
+        pandas.DataFrame(list(rows), columns=header).to_parquet(fname)
+        return
+
+    f = file(fname, 'wb')
+    w = csv.writer(f)
+    w.writerow(header)
+    w.writerows(rows)
+    f.close()
+
+
+def parse_args(argv):
+    p = ArgumentParser(description="Batch simulator for difficulty tuning")
+    p.add_argument("--set", action="append", default=[], metavar="NAME=V1,V2",
+        help="difficulty setting and the values to try")
+    p.add_argument("--seeds", type=int, default=10,
+        help="games per combination of settings")
+    p.add_argument("--first-seed", type=int, default=0)
+    p.add_argument("--challenge", choices=sorted(CHALLENGES.keys()),
+        default="intermediate")
+    p.add_argument("--ticks", type=int, default=35 * 60 * 10,
+        help="maximum length of each game (35 per game day)")
+    p.add_argument("--processes", type=int, default=None,
+        help="worker processes (default: one per CPU)")
+    p.add_argument("--output", default="simulate.csv")
+    return p.parse_args(argv)
+
+def Main(data_dir, argv):
+    args = parse_args(argv)
+    try:
+        settings = [ Parse_Setting(s) for s in args.set ]
+    except ValueError, x:
+        print x
+        return 1
+
+    names = [ name for (name, values) in settings ]
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    jobs = Make_Jobs(CHALLENGES[ args.challenge ], settings, seeds,
+                args.ticks)
+
+    print "Playing %u games" % len(jobs)
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes, Initialise_Worker,
+                (data_dir,))
+    try:
+        results = pool.map(Play, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    header = ( [ name.lower() for name in names ] + [ 'seed', 'outcome' ]
+                + RECORD_FIELDS )
+    Write_Table(args.output, header, Rows(results, names))
+    print "Wrote %s in %1.1f seconds" % (args.output, time.time() - start)
+    return 0
+
+
+if ( __name__ == "__main__" ):
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.exit(Main(os.path.join(code_dir, '..', 'data'), sys.argv[ 1: ]))
+
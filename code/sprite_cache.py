@@ -0,0 +1,154 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+
+# On-disk cache of the scaled, colour-cycled sprite frames made by
+# draw_obj. Each sprite is stored in its own file, named after its
+# key: the image name, its size in grid squares, the size of a grid
+# square in pixels (i.e. the resolution) and the modification time
+# of the image file. Anything else changing means a new version.
+#
+# File layout: MAGIC, the length of the header, the pickled header,
+# then the distinct frames as raw RGBA pixels, one after another.
+# The file is memory-mapped when loaded.
+#
+# The cache is only a shortcut. If it can't be read or written, the
+# frames are simply made again.
+
+import os , mmap , pickle , struct , hashlib , pygame
+
+import extra , resource
+from primitives import *
+
+
+CACHE_VERSION = 1
+MAGIC = "LYSPRITE"
+SUFFIX = ".sprite"
+
+DIRECTORY = None        # None: cache disabled
+
+
+def Initialise(delete_files=False, directory=None):
+    global DIRECTORY
+
+    if ( directory == None ):
+        home = extra.Get_Home()
+        if ( home == None ):
+            directory = "sprites"
+        else:
+            directory = os.path.join(home, ".lightyears.sprites")
+
+    DIRECTORY = directory
+    if ( delete_files ):
+        Clear()
+
+def Clear():
+    if ( DIRECTORY == None ):
+        return
+    try:
+        for name in os.listdir(DIRECTORY):
+            if ( name.endswith(SUFFIX) ):
+                os.remove(os.path.join(DIRECTORY, name))
+    except OSError:
+        pass
+
+def Make_Key(img_name, grid_size):
+    return (CACHE_VERSION, img_name, grid_size, Get_Grid_Size(),
+                Mtime(img_name))
+
+def Mtime(img_name):
+    # When an image was changed, so that a cached copy of anything
+    # made from it is known to be out of date.
+    try:
+        return os.path.getmtime(resource.Path(img_name))
+    except OSError:
+        return None
+
+def File_Name(key):
+    return os.path.join(DIRECTORY, hashlib.md5(repr(key)).hexdigest()
+                + SUFFIX)
+
+def Load(key):
+    # Returns (frames, info) as given to Save, or None.
+    if ( DIRECTORY == None ):
+        return None
+
+    try:
+        f = file(File_Name(key), "rb")
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, mmap.error):
+        return None # missing or empty
+
+    try:
+        pos = len(MAGIC) + 4
+        if ( m[ :len(MAGIC) ] != MAGIC ):
+            return None
+        (header_size, ) = struct.unpack("<I", m[ len(MAGIC):pos ])
+        header = pickle.loads(m[ pos:pos + header_size ])
+        if ( header[ 'key' ] != key ):
+            return None
+        pos += header_size
+
+        size = header[ 'size' ]
+        frame_bytes = size[ 0 ] * size[ 1 ] * 4
+        if ( len(m) != pos + ( frame_bytes * header[ 'count' ] )):
+            return None
+
+        distinct = []
+        for i in xrange(header[ 'count' ]):
+            s = pygame.image.frombuffer(buffer(m, pos, frame_bytes),
+                        size, 'RGBA')
+            distinct.append(s.convert_alpha())
+            del s # it points into the file
+            pos += frame_bytes
+
+        frames = [ distinct[ i ] for i in header[ 'frames' ] ]
+        return (frames, header[ 'info' ])
+
+    except Exception, x:
+        print 'Sprite cache: ignoring %s: %s' % (File_Name(key), x)
+        return None
+    finally:
+        m.close()
+
+def Save(key, frames, info):
+    # frames may share surfaces: each one is only stored once.
+    if ( DIRECTORY == None ):
+        return
+
+    distinct = []
+    index = []
+    for s in frames:
+        for (i, d) in enumerate(distinct):
+            if ( d is s ):
+                break
+        else:
+            i = len(distinct)
+            distinct.append(s)
+        index.append(i)
+
+    header = pickle.dumps(dict(key=key, size=frames[ 0 ].get_size(),
+                count=len(distinct), frames=index, info=info), 2)
+
+    fname = File_Name(key)
+    tmp_name = fname + ".tmp"
+    try:
+        if ( not os.path.isdir(DIRECTORY) ):
+            os.makedirs(DIRECTORY)
+        f = file(tmp_name, "wb")
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for s in distinct:
+            f.write(pygame.image.tostring(s, 'RGBA'))
+        f.close()
+        if ( os.path.exists(fname) ):
+            os.remove(fname)
+        os.rename(tmp_name, fname)
+    except (IOError, OSError):
+        pass
+
@@ -0,0 +1,264 @@
+#
+# 20,000 Light Years Into Space
+# This game is licensed under GPL v2, and copyright (C) Jack Whitham 2006-07.
+#
+
+# Array-backed steam solver. Instead of asking every node to
+# think for itself, the charge, capacity and resistance of the
+# whole network are gathered into NumPy arrays (pipes as an edge
+# list) and the network is advanced in one batched step.
+#
+# The rules are those of Voltage_Model: sources are applied first,
+# current only flows "downhill" by at least NEGLIGIBLE, pipes are
+# ignored if their valve is shut, if they are broken, or if the
+# node at the receiving end is broken, and charge is bounded
+# (venting) afterwards. The one difference is ordering: the
+# per-node path lets each node see the charge moved by the nodes
+# thinking before it, whereas here every node sees the state at
+# the start of the tick. Both settle at the same equilibrium.
+#
+# Equilibrium() finds the steady state of the same model directly,
+# by solving the graph Laplacian built from the pipe resistances.
+#
+# NumPy is optional. If it isn't installed, the game keeps using
+# the per-node path.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from steam_model import Voltage_Model
+
+
+__enabled = False
+__layout = None
+
+
+def Available():
+    return ( numpy != None )
+
+def Enable(on=True):
+    global __enabled
+    if ( on and not Available() ):
+        print 'Array steam solver requires NumPy: using per-node solver.'
+        on = False
+    __enabled = on
+    return __enabled
+
+def Is_Enabled():
+    return __enabled
+
+
+class Layout:
+    # Index structure of a network: which node is at each end of
+    # each pipe. Rebuilt only when nodes or pipes are added
+    # or removed.
+    def __init__(self, net):
+        self.node_list = net.node_list
+        self.pipe_list = net.pipe_list
+        self.edit_count = net.edit_count
+
+        self.nodes = list(net.node_list)
+        self.pipes = list(net.pipe_list)
+        index = dict([ (node, i) for (i, node) in enumerate(self.nodes) ])
+        m = len(self.pipes)
+        self.a = numpy.fromiter((index[ p.n1 ] for p in self.pipes),
+                    numpy.intp, m)
+        self.b = numpy.fromiter((index[ p.n2 ] for p in self.pipes),
+                    numpy.intp, m)
+        self.capacitance = numpy.fromiter((n.steam.capacitance
+                    for n in self.nodes), float, len(self.nodes))
+
+    def Is_Valid(self, net):
+        return (( self.node_list is net.node_list )
+            and ( self.pipe_list is net.pipe_list )
+            and ( self.edit_count == net.edit_count ))
+
+
+def Think(net):
+    global __layout
+    if (( __layout == None ) or not __layout.Is_Valid(net) ):
+        __layout = Layout(net)
+    Step(__layout)
+
+def Step(layout):
+    nodes = layout.nodes
+    pipes = layout.pipes
+    n = len(nodes)
+    m = len(pipes)
+    tc = Voltage_Model.TIME_CONSTANT
+    negligible = Voltage_Model.NEGLIGIBLE
+
+    # Gather.
+    charge = numpy.fromiter((node.steam.charge for node in nodes), float, n)
+    venting = numpy.fromiter((node.steam.venting for node in nodes), bool, n)
+    capacity = numpy.fromiter((node.steam.capacity for node in nodes),
+                float, n)
+    broken = numpy.fromiter((node.Is_Broken() for node in nodes), bool, n)
+    sources = [ node.Steam_Source() for node in nodes ]
+    has_source = numpy.fromiter((s != None for s in sources), bool, n)
+    source = numpy.fromiter((s or 0.0 for s in sources), float, n)
+    open_pipe = numpy.fromiter((( p.valve_open and not p.Is_Broken() )
+                for p in pipes), bool, m)
+    resistance = numpy.fromiter((p.resistance for p in pipes), float, m)
+    a = layout.a
+    b = layout.b
+
+    # Sources, bounded as Voltage_Model.Source() would.
+    charge += source * tc
+    venting = numpy.where(has_source, Vents(charge, capacity, venting),
+                venting)
+    numpy.clip(charge, 0.0, numpy.where(has_source, capacity, numpy.inf),
+                out=charge)
+
+    # Flow along each pipe, in whichever direction is downhill.
+    voltage = charge / layout.capacitance
+    dv = voltage[ a ] - voltage[ b ]
+    a_to_b = open_pipe & ~ broken[ b ] & ( dv >= negligible )
+    b_to_a = open_pipe & ~ broken[ a ] & ( - dv >= negligible )
+    current = numpy.where(a_to_b | b_to_a, numpy.abs(dv) / resistance, 0.0)
+    dq_ab = numpy.where(a_to_b, current * tc, 0.0)
+    dq_ba = numpy.where(b_to_a, current * tc, 0.0)
+    charge += ( numpy.bincount(b, dq_ab, n) + numpy.bincount(a, dq_ba, n)
+             - numpy.bincount(a, dq_ab, n) - numpy.bincount(b, dq_ba, n) )
+
+    # Bound, venting any excess.
+    venting = Vents(charge, capacity, venting)
+    numpy.clip(charge, 0.0, capacity, out=charge)
+
+    # Scatter.
+    for (node, q, v, vent) in zip(nodes, charge.tolist(), voltage.tolist(),
+                venting.tolist()):
+        steam = node.steam
+        steam.charge = q
+        steam.voltage = v
+        steam.venting = vent
+
+    for i in numpy.flatnonzero(a_to_b).tolist():
+        pipes[ i ].current_n1_to_n2 = float(current[ i ])
+    for i in numpy.flatnonzero(b_to_a).tolist():
+        pipes[ i ].current_n1_to_n2 = - float(current[ i ])
+
+    for node in nodes:
+        node.Steam_Update_Draw_Obj()
+
+def Vents(charge, capacity, venting):
+    # The venting flag after Voltage_Model's bounding: an empty
+    # node leaves the flag alone.
+    return numpy.where(charge < 0, venting, charge > capacity)
+
+
+# Equilibrium.
+#
+# At steady state the current leaving each intact node through its
+# pipes equals the current its source feeds in: L v = s, where L is
+# the Laplacian weighted by 1/resistance. Charge is bounded, so some
+# nodes are pinned: full nodes vent whatever they can't pass on,
+# and empty nodes go short. Which nodes are pinned is found by
+# solving, pinning any node that went out of bounds, releasing any
+# pinned node whose flow no longer justifies it, and solving again.
+#
+# A group of nodes that isn't pinned anywhere keeps its total
+# charge; a small leak towards the current charge (LEAK) picks that
+# solution out. Broken nodes don't take part and are left as they
+# are: the normal steam model drains them. Only charge is set here;
+# venting flags and pipe currents come from the next tick.
+
+FREE = 0
+FULL = 1
+EMPTY = 2
+
+LEAK = 1e-6
+TOLERANCE = 1e-9
+MAX_PIN_PASSES = 50
+
+def Equilibrium(net):
+    nodes = list(net.node_list)
+    n = len(nodes)
+    if ( n == 0 ):
+        return
+    index = dict([ (node, i) for (i, node) in enumerate(nodes) ])
+
+    broken = numpy.fromiter((node.Is_Broken() for node in nodes), bool, n)
+    charge = numpy.fromiter((node.steam.charge for node in nodes), float, n)
+    capacity = numpy.fromiter((node.steam.capacity for node in nodes),
+                float, n)
+    capacitance = numpy.fromiter((node.steam.capacitance for node in nodes),
+                float, n)
+    source = numpy.fromiter((( node.Get_Steam_Source() or 0.0 )
+                for node in nodes), float, n)
+    source[ broken ] = 0.0
+
+    pipes = [ p for p in net.pipe_list
+                if ( p.valve_open and not p.Is_Broken()
+                    and not p.n1.Is_Broken() and not p.n2.Is_Broken() ) ]
+    m = len(pipes)
+    a = numpy.fromiter((index[ p.n1 ] for p in pipes), numpy.intp, m)
+    b = numpy.fromiter((index[ p.n2 ] for p in pipes), numpy.intp, m)
+    g = numpy.fromiter((1.0 / p.resistance for p in pipes), float, m)
+
+    def Outflow(v):
+        # L v: net current leaving each node through its pipes.
+        i = g * ( v[ a ] - v[ b ] )
+        return numpy.bincount(a, i, n) - numpy.bincount(b, i, n)
+
+    v0 = charge / capacitance
+    limit = capacity / capacitance
+    state = numpy.zeros(n, numpy.int8)
+    v = v0.copy()
+
+    for i in xrange(MAX_PIN_PASSES):
+        free = ( state == FREE ) & ~ broken
+        v = numpy.where(state == FULL, limit,
+                numpy.where(state == EMPTY, 0.0, v))
+        v[ broken ] = v0[ broken ]
+
+        # Solve (L + LEAK) v = s + LEAK v0 for the free nodes, with
+        # the pinned nodes held at their bounds.
+        fixed = numpy.where(free, 0.0, v)
+        fixed[ broken ] = 0.0
+        rhs = source + ( LEAK * v0 ) - Outflow(fixed)
+        v = numpy.where(free, Conjugate_Gradient(
+                lambda x: ( Outflow(x * free) + ( LEAK * x )) * free,
+                rhs * free, v * free), v)
+
+        # Pin or release nodes.
+        excess = source - Outflow(numpy.where(broken, 0.0, v))
+        new_state = state.copy()
+        new_state[ free & ( v > ( limit + TOLERANCE )) ] = FULL
+        new_state[ free & ( v < - TOLERANCE ) ] = EMPTY
+        new_state[ ( state == FULL ) & ( excess < - TOLERANCE ) ] = FREE
+        new_state[ ( state == EMPTY ) & ( excess > TOLERANCE ) ] = FREE
+        new_state[ broken ] = FREE
+        if ( numpy.array_equal(new_state, state) ):
+            break
+        state = new_state
+
+    v = numpy.clip(v, 0.0, limit)
+    for (i, node) in enumerate(nodes):
+        if ( not broken[ i ] ):
+            node.steam.charge = float(v[ i ] * capacitance[ i ])
+            node.steam.voltage = float(v[ i ])
+
+def Conjugate_Gradient(product, rhs, x, tolerance=1e-10):
+    # Solves product(x) = rhs for a symmetric positive definite
+    # operator, starting from the guess x.
+    r = rhs - product(x)
+    p = r.copy()
+    rr = numpy.dot(r, r)
+    stop = ( tolerance ** 2 ) * max(numpy.dot(rhs, rhs), 1.0)
+    for i in xrange(( 2 * len(x) ) + 10):
+        if ( rr <= stop ):
+            break
+        ap = product(p)
+        pap = numpy.dot(p, ap)
+        if ( pap <= 0.0 ):
+            break
+        alpha = rr / pap
+        x = x + ( alpha * p )
+        r = r - ( alpha * ap )
+        rr2 = numpy.dot(r, r)
+        p = r + (( rr2 / rr ) * p )
+        rr = rr2
+    return x
@@ -14,10 +14,11 @@ from map_items import *
 
 storm_sound = storm_graphics = None
 
-def Init_Storms():
-    # This is rather slow.
+def Init_Storms(graphics=True):
+    # Headless games don't need the graphics.
     global storm_graphics
-    storm_graphics = particle.Make_Particle_Effect(particle.Storm_Particle)
+    if ( graphics ):
+        storm_graphics = particle.Make_Particle_Effect(particle.Storm_Particle)
 
     global storm_sound
     storm_sound = sound.Persisting_Sound("stormdmg", "stormbeeps")
@@ -29,8 +30,8 @@ class Storm_Season(Quiet_Season):
         self.storms = []
         self.storm_difficulty = storm_difficulty
 
-        global storm_graphics
-        assert ( storm_graphics != None )
+        global storm_sound
+        assert ( storm_sound != None )
 
     def Get_Period(self):
         return 20
@@ -55,6 +56,9 @@ class Storm_Season(Quiet_Season):
         for s in self.storms:
             s.Think(frame_time)
 
+    def Fingerprint(self):
+        return [ (s.pos, s.velocity, s.countdown) for s in self.storms ]
+
 
 class Storm:
     def __init__(self, net, difficulty):
@@ -82,6 +86,16 @@ class Storm:
         # How long does this storm live?
         self.countdown = distance / speed
 
+        # The storm goes in a straight line, so the grid squares that
+        # it will sweep over are known now: the items on them are
+        # found in advance, and looked up as the storm arrives.
+        self.cell = None        # grid square at the centre of the storm
+        self.targets = []       # items within the storm, in damage order
+        self.footprint = dict() # grid square -> items there
+        self.changes = None     # net.item_grid.changes when found
+        for key in Swept_Cells(self.pos, dest):
+            self.__Cell_Items(key)
+
 
     def Draw(self, output, update_area):
         global storm_graphics
@@ -93,38 +107,50 @@ class Storm:
         x = int(x)
         y = int(y)
         r.topleft = (x,y)
+        if ( not r.colliderect(output.get_rect()) ):
+            return # off the screen
         #pygame.draw.rect(output, (255,255,255), r, 1)
         output.blit(sfx, r.topleft)
         update_area(r)
 
+    def __Cell_Items(self, key):
+        # The items on a grid square that the storm can damage:
+        # pipes first, then whatever is on the ground.
+        if ( self.changes != self.net.item_grid.changes ):
+            # The network has changed; what was found is out of date.
+            self.footprint = dict()
+            self.changes = self.net.item_grid.changes
+
+        if ( not self.footprint.has_key(key) ):
+            items = self.net.item_grid.Get(key, Pipe)
+            if ( self.net.ground_grid.has_key( key ) ):
+                items.append(self.net.ground_grid[ key ])
+            self.footprint[ key ] = items
+        return self.footprint[ key ]
+
     def Think(self, frame_time):
         # Do damage to things within the storm
         (cx,cy) = self.pos
-        cx = int(cx)
-        cy = int(cy)
+        cell = (int(cx), int(cy))
+
+        if (( cell != self.cell )
+        or ( self.changes != self.net.item_grid.changes )):
+            # Entering a new square (or something was built or
+            # destroyed): which items are within the storm now?
+            self.cell = cell
+            (cx,cy) = cell
+            self.targets = []
+            for x in range(cx - 1, cx + 2):
+                for y in range(cy - 1, cy + 2):
+                    self.targets.extend(self.__Cell_Items((x,y)))
 
         dmg = STORM_DAMAGE * self.difficulty
 
-        for x in range(cx - 1, cx + 2):
-            for y in range(cy - 1, cy + 2):
-                key = (x,y)
-
-                global storm_sound
-
-                if ( self.net.pipe_grid.has_key( key ) ):
-                    for pipe in self.net.pipe_grid[ key ]:
-                        if (( not pipe.Is_Destroyed() )
-                        and ( pipe.Take_Damage(dmg) )):
-                            self.net.Destroy(pipe, "storms")
-                            storm_sound.Set(1.0)
-
-                if ( self.net.ground_grid.has_key( key ) ):
-                    node = self.net.ground_grid[ key ]
-
-                    if (( not node.Is_Destroyed() )
-                    and ( node.Take_Damage(dmg) )):
-                        self.net.Destroy(node, "storms")
-                        storm_sound.Set(1.0)
+        global storm_sound
+        for item in self.targets:
+            if (( not item.Is_Destroyed() )
+            and ( self.net.Damage(item, dmg, "storms") )):
+                storm_sound.Set(1.0)
 
         # Move
         (x,y) = self.pos
@@ -135,11 +161,36 @@ class Storm:
         self.pos = (x + dx, y + dy)
 
         global storm_graphics
-        self.storm_frame = ( self.storm_frame + 1 ) % len(storm_graphics)
+        if ( storm_graphics != None ): # not headless
+            self.storm_frame = ( self.storm_frame + 1 ) % len(storm_graphics)
 
         self.countdown -= frame_time
 
     def Is_Offscreen(self):
         return ( self.countdown < 0 )
 
+    def __getstate__(self):
+        # The items found in advance are left out of saved games:
+        # they are found again as the storm goes.
+        state = self.__dict__.copy()
+        for name in [ 'cell', 'targets', 'footprint', 'changes' ]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cell = None
+        self.targets = []
+        self.footprint = dict()
+        self.changes = None
+
+
+def Swept_Cells(pos1, pos2):
+    # The grid squares within a storm as it goes from one point to
+    # the other. The path is marked every half square (or less), and
+    # the storm covers the squares next to the square at its centre
+    # (which is found with int, as in Think); a margin of one more
+    # square allows for the centre being up to a quarter of a square
+    # from a mark.
+    return extra.Line_Cells(pos1, pos2, 2, int)
 
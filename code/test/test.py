@@ -1,7 +1,78 @@
 from nose.tools import raises
 from nose.tools import assert_almost_equal
+from contextlib import contextmanager
+import math, os, random
 import primitives
 
+def data_dir():
+    """The game's data directory
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', '..', 'data')
+
+@contextmanager
+def temporary_home():
+    """Point HOME, and so the saved games, at a new directory until
+    the block ends
+    """
+    import shutil, tempfile
+    home = os.environ.get('HOME')
+    os.environ['HOME'] = tempfile.mkdtemp()
+    try:
+        yield
+    finally:
+        shutil.rmtree(os.environ['HOME'])
+        if home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = home
+
+def setup_display():
+    """Set up a dummy display, so that map items can load their images
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame, resource
+    pygame.display.init()
+    pygame.font.init()
+    if pygame.display.get_surface() is None:
+        pygame.display.set_mode((800, 600), 0, 32)
+    resource.DATA_DIR = data_dir()
+    resource.No_Sound()
+
+def make_lattice_network(side=6, seed=1):
+    """Network with a lattice of finished nodes and pipes hooked to the
+    city
+    """
+    from network import Network
+    from map_items import Node, Well_Node, Pipe
+    setup_display()
+    random.seed(seed)
+    net = Network(False)
+    lattice = {}
+    for i in xrange(side):
+        for j in xrange(side):
+            if (i + j) % 3 == 0:
+                n = Well_Node((i * 3, j * 3))
+            else:
+                n = Node((i * 3, j * 3))
+            net.Add_Finished_Node(n)
+            lattice[i, j] = n
+
+    def link(n1, n2):
+        p = Pipe(n1, n2)
+        p.health = p.max_health
+        net.pipe_list.append(p)
+        net.item_grid.Add(p, p.Grid_Cells())
+        net.edit_count += 1
+        return p
+
+    for (i, j), n in sorted(lattice.items()):
+        for (di, dj) in ((1, 0), (0, 1)):
+            if (i + di, j + dj) in lattice:
+                link(n, lattice[i + di, j + dj])
+    link(net.hub, lattice[side - 1, side - 1])
+    return net
+
 ## test primitive
 
 def test_point():
@@ -63,8 +134,967 @@ def test_vector_type_check():
     primitives.GVector(1,1) * primitives.GVector(3,3)
 
 
+## test steam solvers
+
+def run_steam(net, ticks, array):
+    import steam_solver
+    steam_solver.Enable(array)
+    try:
+        for i in xrange(ticks):
+            net.Steam_Think()
+    finally:
+        steam_solver.Enable(False)
+
+def test_array_steam_solver_matches_per_node():
+    import steam_solver
+    if not steam_solver.Available():
+        return
+    a = make_lattice_network()
+    b = make_lattice_network()
+    # a broken node and a closed valve exercise the pipe filters
+    for net in (a, b):
+        net.node_list[5].health -= 1
+        net.pipe_list[7].valve_open = False
+
+    run_steam(a, 1500, False)
+    run_steam(b, 1500, True)
+
+    for (na, nb) in zip(a.node_list, b.node_list):
+        assert abs(na.steam.charge - nb.steam.charge) < 1.0, \
+            (na.pos, na.steam.charge, nb.steam.charge)
+        assert na.steam.venting == nb.steam.venting, na.pos
+    for (pa, pb) in zip(a.pipe_list, b.pipe_list):
+        assert abs(pa.current_n1_to_n2 - pb.current_n1_to_n2) < 0.5, \
+            (pa.pos, pa.current_n1_to_n2, pb.current_n1_to_n2)
+    assert_almost_equal(a.hub.Get_Steam_Supply(), b.hub.Get_Steam_Supply(),
+        places=0)
+
+def test_solve_equilibrium_matches_steady_state():
+    import steam_solver
+    if not steam_solver.Available():
+        return
+    a = make_lattice_network()
+    b = make_lattice_network()
+    a.Solve_Equilibrium()
+    run_steam(b, 1500, False)
+    for (na, nb) in zip(a.node_list, b.node_list):
+        assert abs(na.steam.charge - nb.steam.charge) < 1.0, \
+            (na.pos, na.steam.charge, nb.steam.charge)
+
+    # the equilibrium is stable
+    p = a.hub.Get_Pressure()
+    run_steam(a, 50, False)
+    assert abs(a.hub.Get_Pressure() - p) < 0.5
+
+def test_solve_equilibrium_bootstrap():
+    from network import Network
+    setup_display()
+    primitives.DIFFICULTY.Set(primitives.MENU_INTERMEDIATE)
+    for seed in xrange(5):
+        random.seed(seed)
+        net = Network(False)
+        net.Solve_Equilibrium()
+        assert net.hub.Get_Pressure() >= primitives.PRESSURE_GOOD
+
+## test connection map and work queue
+
+def test_connections_follow_edits():
+    from network import Network
+    from map_items import Node
+    setup_display()
+    random.seed(3)
+    net = Network(False)
+    (x, y) = net.hub.pos
+    a = Node((x, y - 4))
+    b = Node((x - 4, y - 4))
+    for n in (a, b):
+        net.Add_Finished_Node(n)
+    assert not net.Is_Connected(a)
+
+    # b joins a before a joins the hub
+    assert net.Add_Pipe(a, b)
+    assert not net.Is_Connected(b)
+    assert net.Add_Pipe(net.hub, a)
+    assert net.Is_Connected(a) and net.Is_Connected(b)
+    assert net.connection_depth[b] == 4
+
+    net.Destroy(net.hub.pipes[-1])
+    assert not net.Is_Connected(a) and not net.Is_Connected(b)
+    assert net.Is_Connected(net.hub)
+
+def test_work_goes_to_nearest_items_first():
+    from network import Network
+    from map_items import Node
+    setup_display()
+    random.seed(3)
+    net = Network(False)
+    (x, y) = net.hub.pos
+    a = Node((x, y - 4))
+    b = Node((x - 4, y - 4))
+    net.Add_Finished_Node(a)
+    net.Add_Finished_Node(b)
+    net.Add_Pipe(net.hub, a)
+    net.Add_Pipe(a, b)
+    for item in [ a, b ] + a.pipes:
+        item.health = item.max_health
+
+    net.Damage(b, 5, "tests")
+    net.Damage(a, 5, "tests")
+    assert net.Work_Pulse(1) == 1
+    assert a.Needs_Work() and b.Needs_Work() # a got one unit
+    while a.Needs_Work():
+        net.Work_Pulse(1)
+    assert b.Needs_Work()
+    assert net.Work_Pulse(5) == 1 # just b left
+
+## test spatial index
+
+def test_item_grid_follows_edits():
+    from network import Network
+    from map_items import Node, Pipe
+    setup_display()
+    random.seed(4)
+    net = Network(False)
+    (x, y) = net.hub.pos
+    a = Node((x, y - 6))
+    net.Add_Finished_Node(a)
+    assert net.Add_Pipe(net.hub, a)
+    pipe = a.pipes[0]
+    assert net.Get_Pipe((x, y - 3)) == pipe
+    assert not net.Add_Grid_Item(Node((x, y - 3)), True) # pipe in the way
+    assert not net.Add_Pipe(a, net.hub) # already there
+
+    net.Destroy(pipe)
+    assert not net.item_grid.Contains(pipe)
+    assert net.Get_Pipe((x, y - 3)) is None
+    assert net.item_grid.Get((x, y - 3), Pipe) == []
+
+def test_item_grid_finds_rocks_along_pipes():
+    import extra, intersect
+    from network import Network
+    from map_items import Rock
+    setup_display()
+    random.seed(5)
+    net = Network(False)
+    for i in xrange(300):
+        p1 = (random.randint(0, 49), random.randint(0, 49))
+        p2 = (random.randint(0, 49), random.randint(0, 49))
+        near = net.item_grid.Find(extra.More_Accurate_Line(p1, p2), Rock)
+        for r in net.rock_list:
+            (rx, ry) = r.pos
+            hit = (intersect.Intersect(((rx - 1, ry - 1), (rx + 1, ry + 1)),
+                        (p1, p2)) or
+                   intersect.Intersect(((rx - 1, ry + 1), (rx + 1, ry - 1)),
+                        (p1, p2)))
+            assert (not hit) or (r in near)
+
+def test_item_grid_finds_items_by_area():
+    from pygame import Rect
+    import grid_index
+    g = grid_index.Grid_Index()
+    g.Add('a', [(1, 1)])
+    g.Add('b', [(40, 2), (41, 2)])
+    g.Add('c', [(-5, -5)])
+    assert g.Find_In_Area(Rect(0, 0, 10, 10)) == set(['a'])
+    assert g.Find_In_Area(Rect(0, 0, 50, 10)) == set(['a', 'b'])
+    assert g.Find_In_Area(Rect(-20, -20, 10, 10)) == set(['c'])
+    g.Remove('b')
+    assert g.Find_In_Area(Rect(0, 0, 50, 10)) == set(['a'])
+    assert sorted(g.chunks.keys()) == sorted([grid_index.Chunk((1, 1)),
+                                        grid_index.Chunk((-5, -5))])
+
+def test_quake_finds_pipes_through_the_grid():
+    import benchmark, intersect, quakes
+    from map_items import Pipe
+    setup_display()
+    net = benchmark.Lattice(100)
+    random.seed(6)
+    for i in xrange(200):
+        line = [ (random.uniform(-2, 40), random.uniform(-2, 40))
+                    for j in xrange(random.randint(2, 5)) ]
+        for k in xrange(len(line) - 1):
+            near = net.item_grid.Find(
+                        quakes.Fault_Cells(line[ k ], line[ k + 1 ]), Pipe)
+            for pipe in net.pipe_list:
+                hit = intersect.Intersect((pipe.n1.pos, pipe.n2.pos),
+                            (line[ k ], line[ k + 1 ]))
+                assert (hit is None) or (pipe in near)
+
+        distance = quakes.Fault_Distance(line)
+        for node in net.node_list[ :20 ]:
+            d = 10
+            for (fx, fy) in line:
+                d = min([ abs(fx - node.pos[ 0 ]), abs(fy - node.pos[ 1 ]), d ])
+            assert distance(node.pos, 10) == d
+
+def test_storm_damages_what_it_sweeps_over():
+    import benchmark, storms
+    from map_items import Pipe, Well
+    setup_display()
+    storms.Init_Storms(False)
+    net = benchmark.Lattice(100)
+    random.seed(4)
+    s = [ storms.Storm(net, 1.0) for i in xrange(10) ]
+    damaged = []
+    net.Damage = lambda item, dmg, by: damaged.append(item)
+    for tick in xrange(200):
+        if ( tick == 100 ):
+            # What the storms found in advance is now out of date.
+            for pipe in net.pipe_list[ ::3 ]:
+                net.Destroy(pipe)
+            for gpos in net.item_grid.Occupied_Cells()[ ::4 ]:
+                if ( not net.ground_grid.has_key(gpos) ):
+                    net.Add_Grid_Item(Well(gpos), True)
+        for storm in s:
+            (cx, cy) = [ int(v) for v in storm.pos ]
+            expect = []
+            for x in xrange(cx - 1, cx + 2):
+                for y in xrange(cy - 1, cy + 2):
+                    expect.extend(net.item_grid.Get((x, y), Pipe))
+                    if ( net.ground_grid.has_key((x, y)) ):
+                        expect.append(net.ground_grid[ (x, y) ])
+            del damaged[ : ]
+            storm.Think(0.25)
+            assert damaged == expect
+
+## test distance fields
+
+def test_distance_field_matches_scan():
+    import distance_field
+    random.seed(8)
+    seeds = [ (random.randint(-3, 40), random.randint(-3, 30))
+                for i in xrange(25) ]
+    has_numpy = distance_field.numpy
+    try:
+        for numpy in set([ has_numpy, None ]):
+            distance_field.numpy = numpy
+            f = distance_field.Distance_Field((37, 28), 5, seeds[ :10 ])
+            f.Add(seeds[ 10: ])
+            for x in xrange(-2, 40):
+                for y in xrange(-2, 30):
+                    d2 = min([ (x - sx) ** 2 + (y - sy) ** 2
+                                for (sx, sy) in seeds ] + [ 25 ])
+                    assert f.Squared((x, y)) == d2
+                    assert f.Within((x, y), 3) == (d2 < 9)
+    finally:
+        distance_field.numpy = has_numpy
+
+## test placement
+
+def test_placement_deals_every_square_once():
+    from pygame import Rect
+    import placement
+    random.seed(9)
+    p = placement.Placement(Rect(-2, 3, 7, 5))
+    busy = set([ (0, 4), (1, 4) ])
+    def test(gpos):
+        if ( gpos in busy ):
+            return placement.LATER
+        return placement.PLACE
+    got = [ p.Pick(test) for i in xrange(33) ]
+    assert sorted(got) == sorted([ (x, y) for x in xrange(-2, 5)
+                    for y in xrange(3, 8) if (x, y) not in busy ])
+    assert p.Remaining() == 2
+    busy.clear()
+    assert p.Pick(test) in [ (0, 4), (1, 4) ] # back in the deck
+    try:
+        p.Pick(lambda gpos: placement.NEVER)
+        assert False
+    except placement.Map_Full:
+        pass
+    assert p.Remaining() == 0
+
+def test_wells_fill_the_map():
+    from network import Network
+    from placement import Map_Full
+    setup_display()
+    random.seed(10)
+    net = Network(False)
+    first = len(net.well_list)
+    try:
+        while True:
+            net.Make_Well(False, True)
+    except Map_Full:
+        pass
+    (cx, cy) = primitives.Get_Map_Centre()
+    for w in net.well_list[ first: ]:
+        assert math.hypot(w.pos[ 0 ] - cx, w.pos[ 1 ] - cy) >= 10
+        for r in net.rock_list:
+            assert primitives.distance(w.pos, r.pos) >= 3
+    assert len(set([ w.pos for w in net.well_list ])) == len(net.well_list)
+    assert len(net.well_list) > 1000
+
+## test aliens
+
+def test_alien_swarm_matches_each_alien():
+    import alien_invasion, benchmark
+    setup_display()
+    alien_invasion.Init_Aliens()
+    has_numpy = alien_invasion.numpy
+    swarm_size = alien_invasion.SWARM_SIZE
+    runs = []
+    try:
+        alien_invasion.SWARM_SIZE = 1
+        for numpy in [ has_numpy, None ]:
+            alien_invasion.numpy = numpy
+            net = benchmark.Lattice(100)
+            damaged = []
+            def Damage(item, dmg, by, damage=net.Damage, damaged=damaged):
+                damaged.append(item.pos)
+                return damage(item, dmg, by)
+            net.Damage = Damage
+            random.seed(5)
+            season = alien_invasion.Alien_Season(net, 2.0)
+            frames = []
+            for frame in xrange(800):
+                if ( frame % 100 == 0 ):
+                    season.Per_Period()
+                season.Per_Frame(0.1)
+                if ( season.swarm != None ):
+                    season.swarm.Store()
+                frames.append([ (a.pos, list(a.points), a.bbox, a.laser,
+                            a.done) for a in season.alien_list ])
+            runs.append((damaged, frames))
+    finally:
+        alien_invasion.numpy = has_numpy
+        alien_invasion.SWARM_SIZE = swarm_size
+    assert len(runs[ 0 ][ 0 ]) > 0
+    assert runs[ 0 ] == runs[ -1 ]
+
+## test map rendering
+
+def test_dirty_redraw_matches_full_redraw():
+    import pygame, ui
+    from quiet_season import Quiet_Season
+    setup_display()
+    net = make_lattice_network(4, seed=6)
+    u = ui.User_Interface(net, (800, 600))
+    out = pygame.Surface((600, 600)).convert()
+    quiet = Quiet_Season(net)
+    for f in xrange(40):
+        if f == 10:
+            net.Damage(net.node_list[3], 1, "test")
+        if f == 20:
+            net.Destroy(net.pipe_list[2])
+        net.Steam_Think()
+        u.Frame_Advance(1 / 35.0)
+        u.Draw_Game(out, quiet)
+
+    ref = pygame.Surface((600, 600)).convert()
+    ref.blit(u.background, (0, 0))
+    items = net.well_list + net.pipe_list + net.node_list + net.rock_list
+    for item in items:
+        item.Draw_Static(ref)
+    for item in items:
+        if item not in net.well_list:
+            item.Draw(ref)
+    assert pygame.image.tostring(ref, 'RGB') == (
+                pygame.image.tostring(u.base, 'RGB'))
+
+def test_camera_on_a_big_map():
+    import pygame, ui
+    from primitives import Set_Map_Size, Get_Map_Size, Set_Grid_Size
+    from primitives import Get_Grid_Size, Set_View_Origin, Get_View_Origin
+    from primitives import Scr_To_Grid, Grid_To_Scr
+    from quiet_season import Quiet_Season
+    setup_display()
+    random.seed(9)
+    old_grid_size = Get_Grid_Size()
+    Set_Map_Size((200, 150))
+    Set_Grid_Size(12)
+    try:
+        net = make_lattice_network(3, seed=9)
+        assert len(net.well_list) > 100
+        for w in net.well_list:
+            assert 0 <= w.pos[0] < 200 and 0 <= w.pos[1] < 150
+
+        u = ui.User_Interface(net, (800, 600))
+        out = pygame.Surface((600, 600)).convert()
+        quiet = Quiet_Season(net)
+        u.Draw_Game(out, quiet)
+        # centred on the City
+        assert Grid_To_Scr(net.hub.pos) == (300, 300)
+        assert Scr_To_Grid((300, 300)) == net.hub.pos
+
+        # zooming keeps the square under the mouse where it is
+        gpos = Scr_To_Grid((100, 450))
+        u.Zoom(2, (100, 450))
+        assert Scr_To_Grid((100, 450)) == gpos
+        u.Draw_Game(out, quiet)
+
+        # the camera stays on the map
+        for i in xrange(20):
+            u.camera.Scroll((-0.25, -0.25))
+        assert Get_View_Origin() == (0, 0)
+        for i in xrange(50):
+            u.camera.Scroll((0.25, 0.25))
+        (w, h) = Get_Map_Size()
+        assert Scr_To_Grid((599, 599)) == (w - 1, h - 1)
+        u.Draw_Game(out, quiet)
+        u.Zoom(-20)
+        u.Draw_Game(out, quiet)
+    finally:
+        Set_Map_Size((50, 50))
+        Set_Grid_Size(old_grid_size)
+        Set_View_Origin((0, 0))
+
+def test_new_games_keep_their_map_size():
+    import game, journal, save_format, cPickle
+    from cStringIO import StringIO
+    from primitives import Set_Map_Size, Get_Map_Size, Set_New_Map_Size
+    setup_display()
+    try:
+        Set_New_Map_Size((80, 80))
+        g = game.New_Game(primitives.MENU_BEGINNER)
+        assert g.net.map_size == Get_Map_Size() == (80, 80)
+        s = StringIO()
+        cPickle.dump((0, random.getstate()), s)
+        save_format.Write_Blocks(s, save_format.Snapshot(g))
+        records = [ ("SNAP", s.getvalue()), ("TIME", cPickle.dumps((5,))) ]
+
+        Set_New_Map_Size((60, 60))
+        g = game.New_Game(primitives.MENU_BEGINNER)
+        assert g.net.map_size == Get_Map_Size() == (60, 60)
+
+        # the journal is replayed on its own map, but if the replay
+        # fails, the game goes on with the map it had
+        sizes = []
+        def tick(g):
+            sizes.append(Get_Map_Size())
+            raise IOError("broken")
+        try:
+            journal.Play(records, tick)
+            assert False
+        except IOError:
+            pass
+        assert sizes == [ (80, 80) ]
+        assert Get_Map_Size() == (60, 60)
+
+        # and after a restored game, new games get the usual size
+        Set_Map_Size((80, 80))
+        g = game.New_Game(primitives.MENU_BEGINNER)
+        assert g.net.map_size == Get_Map_Size() == (60, 60)
+    finally:
+        Set_New_Map_Size((50, 50))
+        Set_Map_Size((50, 50))
+
+def test_culled_redraw_matches_full_redraw():
+    import pygame, ui
+    from primitives import Set_Map_Size, Set_Grid_Size, Get_Grid_Size
+    from primitives import Set_View_Origin
+    from map_items import Pipe, Node, Rock
+    from quiet_season import Quiet_Season
+    setup_display()
+    old_grid_size = Get_Grid_Size()
+    Set_Map_Size((120, 120))
+    Set_Grid_Size(12)
+    try:
+        net = make_lattice_network(8, seed=3)
+        u = ui.User_Interface(net, (800, 600))
+        out = pygame.Surface((600, 600)).convert()
+        quiet = Quiet_Season(net)
+        u.camera.Centre_On((10, 10))
+        u.Zoom(1)
+        u.Draw_Game(out, quiet)
+        seen = u.Visible_Items([Pipe, Node, Rock])
+        everything = net.pipe_list + net.node_list + net.rock_list
+        assert len(seen) < len(everything)
+        # Same order as the lists, so that overlaps are drawn the same way
+        assert seen == [item for item in everything if item in seen]
+
+        for f in xrange(40):
+            if f == 10:
+                net.Damage(net.node_list[5], 1, "test")
+            if f == 20:
+                net.Destroy(net.pipe_list[4])
+            if f == 30:
+                u.camera.Scroll((0.25, 0))
+            net.Steam_Think()
+            u.Frame_Advance(1 / 35.0)
+            u.Draw_Game(out, quiet)
+
+        ref = pygame.Surface((600, 600)).convert()
+        u._User_Interface__Draw_Background(ref)
+        items = net.well_list + net.pipe_list + net.node_list + net.rock_list
+        for item in items:
+            item.Draw_Static(ref)
+        ui.Draw_Pipes(ref, net.pipe_list)
+        for item in net.node_list + net.rock_list:
+            item.Draw(ref)
+        assert pygame.image.tostring(ref, 'RGB') == (
+                    pygame.image.tostring(u.base, 'RGB'))
+    finally:
+        Set_Map_Size((50, 50))
+        Set_Grid_Size(old_grid_size)
+        Set_View_Origin((0, 0))
+
+def test_pipe_dots_match_per_dot():
+    import pygame, map_items
+    net = make_lattice_network(5, seed=8)
+    for (i, p) in enumerate(net.pipe_list):
+        p.current_n1_to_n2 = (i % 3) - 1.0
+        p.dot_drawing_offset = (i * 97) % p.SFACTOR
+
+    def draw():
+        out = pygame.Surface((600, 600)).convert()
+        map_items.Draw_Pipes(out, net.pipe_list)
+        return pygame.image.tostring(out, 'RGB')
+
+    fast = draw()
+    saved = map_items.numpy
+    try:
+        map_items.numpy = None
+        assert draw() == fast
+    finally:
+        map_items.numpy = saved
+
+def test_colour_frames_match_per_pixel():
+    import pygame, resource, draw_obj
+    setup_display()
+    colours = [ 0, 0, 50, 250, 150 ]
+    for name in [ 'node.png', 'city1.png', 'well.png' ]:
+        img = pygame.transform.scale(resource.Load_Image(name), (24, 24))
+        (fast, fast_anim) = draw_obj.Colour_Frames(img, colours)
+        (slow, slow_anim) = draw_obj.Colour_Frames_Per_Pixel(img, colours)
+        assert fast_anim == slow_anim
+        for (f, s) in zip(fast, slow):
+            assert (pygame.image.tostring(f, 'RGBA') ==
+                    pygame.image.tostring(s, 'RGBA'))
+
+def test_sprite_cache_round_trip():
+    import shutil, tempfile, pygame, draw_obj, sprite_cache
+    setup_display()
+    tmp = tempfile.mkdtemp()
+    try:
+        sprite_cache.Initialise(directory=tmp)
+        draw_obj.Flush_Draw_Obj_Cache()
+        draw_obj.Make_Cache_Item(('city1.png', 3))
+        made = draw_obj.cache[ ('city1.png', 3) ]
+        assert len(os.listdir(tmp)) == 1
+
+        key = sprite_cache.Make_Key('city1.png', 3)
+        (frames, info) = sprite_cache.Load(key)
+        assert info == (made.offset_x, made.offset_y, True)
+        assert len(frames) == len(made.frames)
+        for (f, g) in zip(frames, made.frames):
+            assert (pygame.image.tostring(f, 'RGBA') ==
+                    pygame.image.tostring(g, 'RGBA'))
+        assert sprite_cache.Load(key[ :-1 ] + (0.0, )) is None
+    finally:
+        sprite_cache.DIRECTORY = None
+        draw_obj.Flush_Draw_Obj_Cache()
+        shutil.rmtree(tmp)
+
+def test_particle_atlas_overlaps_in_drawing_order():
+    import pygame, particle, numpy
+    setup_display()
+
+    class Two_Squares:
+        # Two still particles whose squares overlap.
+        def Trajectories(self, rng, n, steps):
+            xs = numpy.array([[ 2.0, 3.0 ]] * steps)
+            colours = numpy.array([[[ 255, 0, 0, 255 ],
+                        [ 0, 0, 255, 255 ]]] * steps)
+            return (xs, xs.copy(), colours)
+        def Max_Size(self):
+            return 8
+        def Num_Particles(self):
+            return 2
+        def Particle_Size(self):
+            return 3
+
+    size = 8
+    atlas = pygame.Surface((size, size * particle.NUM_FRAMES),
+                flags=pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    particle.Draw_Atlas(Two_Squares(), atlas)
+    for frame in particle.Slice(atlas, size):
+        assert tuple(frame.get_at((2, 2))) == (255, 0, 0, 255)
+        assert tuple(frame.get_at((4, 4))) == (0, 0, 255, 255)
+        assert tuple(frame.get_at((3, 3))) == (0, 0, 255, 255)
+        assert tuple(frame.get_at((5, 5))) == (0, 0, 255, 255)
+        assert tuple(frame.get_at((6, 6))) == (0, 0, 0, 0)
+
+def test_particle_effect_is_cached():
+    import shutil, tempfile, pygame, particle, sprite_cache, resource
+    setup_display()
+    tmp = tempfile.mkdtemp()
+    try:
+        sprite_cache.Initialise(directory=tmp)
+        first = particle.Make_Particle_Effect(particle.Steam_Particle)
+        again = particle.Make_Particle_Effect(particle.Steam_Particle)
+        assert len(first) == len(again) == particle.NUM_FRAMES
+        for (f, g) in zip(first, again):
+            assert f.get_size() == (particle.MAX_STEAM_SIZE, ) * 2
+            assert (pygame.image.tostring(f, 'RGBA') ==
+                    pygame.image.tostring(g, 'RGBA'))
+
+        # a new storm sample makes new storms
+        data_dir = resource.DATA_DIR
+        resource.DATA_DIR = tmp
+        try:
+            shutil.copy(os.path.join(data_dir, 'stormsample.png'), tmp)
+            name = os.path.join(tmp, 'stormsample.png')
+            os.utime(name, (1000000000, 1000000000))
+            key = particle.Make_Key(particle.Storm_Particle)
+            os.utime(name, (1000000500, 1000000500))
+            assert particle.Make_Key(particle.Storm_Particle) != key
+        finally:
+            resource.DATA_DIR = data_dir
+    finally:
+        sprite_cache.DIRECTORY = None
+        shutil.rmtree(tmp)
+
+## test headless games
+
+def test_headless_game_is_repeatable():
+    import headless
+    setup_display()
+    headless.Initialise(data_dir())
+
+    def play(seed):
+        g = headless.Run(primitives.MENU_BEGINNER, 35 * 40, seed)
+        return [ (hr.day, hr.supply, hr.city_pressure)
+                    for hr in g.historian ]
+
+    first = play(7)
+    assert len(first) >= 10
+    assert first == play(7)
+
+## test saved games
+
+def test_saved_game_plays_on_the_same():
+    import headless, game, simulate, save_format, gametime, pickle
+    from cStringIO import StringIO
+    setup_display()
+    headless.Initialise(data_dir())
+    g = headless.Run(primitives.MENU_BEGINNER, 35 * 60, 3,
+                simulate.Builder(3))
+    assert len(g.net.pipe_list) > 2
+
+    f = StringIO()
+    save_format.Write(f, g)
+    g2 = save_format.Read(StringIO(f.getvalue()))
+    # Saves from before the format are just pickled
+    g3 = save_format.Read(StringIO(pickle.dumps(g)))
+    assert len(f.getvalue()) * 5 < len(pickle.dumps(g))
+
+    def play_on(g):
+        random.seed(4)
+        gametime.Set_Now(g.game_time.time())
+        for i in xrange(35 * 30):
+            game.Tick(g)
+        return ([ (n.__class__, n.pos, n.health, n.steam.charge)
+                    for n in g.net.node_list ]
+                + [ (p.n1.pos, p.n2.pos, p.current_n1_to_n2)
+                    for p in g.net.pipe_list ]
+                + [ (hr.day, hr.supply) for hr in g.historian ]
+                + [ g.season_fx.name, g.net.hub.metal_quantity ])
+
+    expected = play_on(g)
+    assert play_on(g2) == expected
+    assert play_on(g3) == expected
+
+def test_autosave_in_the_background():
+    import headless, save_game, autosave
+    setup_display()
+    headless.Initialise(data_dir())
+    with temporary_home():
+        g = headless.Run(primitives.MENU_BEGINNER, 35 * 20, 5)
+        a = autosave.Autosave(10, 0)
+        assert a.Tick(g, 5) is None
+        assert not a.Busy()
+        assert a.Tick(g, 10) is None
+        a.Wait()
+        assert a.Tick(g, 11) is None # no error
+        assert save_game.Get_Info(save_game.AUTOSAVE_SLOT).startswith(
+                    "Autosave - Day 19 -")
+        assert not os.path.exists(save_game.Make_Save_Name(
+                    save_game.AUTOSAVE_SLOT) + ".tmp")
+        (g2, error) = save_game.Load(g, save_game.AUTOSAVE_SLOT)
+        assert error is None
+        assert g2.game_time.time() == g.game_time.time()
+        assert a.next_time == 20
+
+def test_journal_replays_the_same():
+    import headless, save_game, journal, game, simulate
+    import cPickle, quakes
+    from map_items import Node
+    setup_display()
+    headless.Initialise(data_dir())
+    interval = journal.SNAPSHOT_INTERVAL
+    with temporary_home():
+        try:
+            g = headless.Run(primitives.MENU_BEGINNER, 35 * 100, 7,
+                        simulate.Builder(7))
+            # a spare pipe from the city, which a quake is about to cut
+            net = g.net
+            (x, y) = net.hub.pos
+            for gpos in [ (x + dx, y + dy) for dy in (3, -3, 0)
+                        for dx in (0, 3, -3) ]:
+                spare = Node(gpos)
+                if ( net.Add_Grid_Item(spare, True) ):
+                    if ( net.Add_Pipe(net.hub, spare) ):
+                        break
+                    net.Destroy(spare)
+            (dx, dy) = (( gpos[ 0 ] - x ) / 4.0, ( gpos[ 1 ] - y ) / 4.0)
+            quake = quakes.Quake_Season(net, 1.0)
+            quake.state = quake.QUAKE
+            quake.fault_lines = [ (x + ( 2 * dx ) - dy, y + ( 2 * dy ) + dx),
+                                  (x + ( 2 * dx ) + dy, y + ( 2 * dy ) - dx) ]
+            g.season = primitives.SEASON_QUAKE
+            g.season_fx = quake
+            g.season_effect = g.game_time.time() + 1
+            g.season_ends = g.game_time.time() + primitives.LENGTH_OF_SEASON
+            journal.SNAPSHOT_INTERVAL = 5
+            journal.Enable(True)
+            journal.Start(g)
+            rng = random.Random(1)
+            for i in xrange(( 35 * 40 ) + 17): # stops between snapshots
+                game.Tick(g)
+                journal.Tick(g)
+                if ( i % 35 == 3 ):
+                    # play a little, through the journal
+                    net = g.net
+                    wells = [ w for w in net.well_list
+                                if ( net.ground_grid.get(w.pos) == w ) ]
+                    if ( len(wells) != 0 ):
+                        n = journal.Do(net, 'well_node', rng.choice(wells).pos)
+                        if ( n != None ):
+                            journal.Do(net, 'pipe', net.node_list[ 1 ], n)
+                    p = rng.choice(net.pipe_list)
+                    journal.Do(net, 'valve', p)
+                    journal.Do(net, 'upgrade', p)
+                    if ( i % ( 35 * 10 ) == 3 ):
+                        journal.Do(net, 'free_upgrade', net.hub)
+            journal.Stop()
+            assert g.game_running
+
+            name = save_game.Make_Save_Name(save_game.JOURNAL_SLOT)
+            f = file(name, "rb")
+            f.read(save_game.HEADER_SIZE)
+            records = journal.Read_Records(f)
+            f.close()
+            tags = [ tag for (tag, data) in records ]
+            assert tags.count("SNAP") == 9
+            events = [ cPickle.loads(data) for (tag, data) in records
+                        if ( tag == "EVNT" ) ]
+            assert len(events) > 0 # the season did some damage
+            # including the pipe broken by the quake
+            assert ('pipe', (x, y), gpos) in [ ref for (ticks, ref, dmg, by)
+                        in events ]
+
+            for from_start in (False, True):
+                (g2, problems) = journal.Play(records, game.Tick, from_start)
+                assert problems == []
+                assert journal.Fingerprint(g2) == journal.Fingerprint(g)
+
+            # a journal cut short just after some damage
+            last = max([ i for (i, tag) in enumerate(tags) if tag == "EVNT" ])
+            (g2, problems) = journal.Play(records[ :last + 1 ], game.Tick)
+            assert problems == []
+
+            # a crash while writing loses only the last record
+            size = os.path.getsize(name)
+            f = file(name, "r+b")
+            f.truncate(size - 3)
+            f.close()
+            f = file(name, "rb")
+            f.read(save_game.HEADER_SIZE)
+            assert journal.Read_Records(f) == records[ :-1 ]
+            f.close()
+        finally:
+            journal.Stop()
+            journal.Enable(False)
+            journal.SNAPSHOT_INTERVAL = interval
+
+def test_journal_is_not_upset_by_drawing():
+    # Drawing uses random numbers between ticks (here, for the
+    # shaking of a quake), but not those of the game.
+    import headless, save_game, journal, game, simulate
+    import mail, pygame, quakes
+    from ui import User_Interface
+    setup_display()
+    headless.Initialise(data_dir())
+    interval = journal.SNAPSHOT_INTERVAL
+    with temporary_home():
+        try:
+            g = headless.Run(primitives.MENU_BEGINNER, 35 * 10, 3,
+                        simulate.Builder(3))
+            mail.Set_Headless(False)
+            mail.Initialise()
+            ui = User_Interface(g.net, (500, 300))
+            output = pygame.Surface((300, 300))
+            quake = quakes.Quake_Season(g.net, 1.0)
+            quake.state = quake.QUAKE
+            assert quake.Is_Shaking()
+
+            journal.SNAPSHOT_INTERVAL = 5
+            journal.Enable(True)
+            journal.Start(g)
+            for i in xrange(( 35 * 12 ) + 17):
+                game.Tick(g)
+                journal.Tick(g)
+                ui.Draw_Game(output, quake)
+            journal.Stop()
+            state = random.getstate()
+
+            name = save_game.Make_Save_Name(save_game.JOURNAL_SLOT)
+            f = file(name, "rb")
+            f.read(save_game.HEADER_SIZE)
+            records = journal.Read_Records(f)
+            f.close()
+            for from_start in (False, True):
+                (g2, problems) = journal.Play(records, game.Tick, from_start)
+                assert problems == []
+                assert journal.Fingerprint(g2) == journal.Fingerprint(g)
+                assert random.getstate() == state
+        finally:
+            journal.Stop()
+            journal.Enable(False)
+            journal.SNAPSHOT_INTERVAL = interval
+            mail.Set_Headless(True)
+            mail.Initialise()
+
+def test_journal_reports_write_errors():
+    import headless, journal, game, threading
+    setup_display()
+    headless.Initialise(data_dir())
+    interval = journal.SNAPSHOT_INTERVAL
+    with temporary_home():
+        os.environ['HOME'] = os.path.join(os.environ['HOME'], 'missing')
+        try:
+            g = headless.Run(primitives.MENU_BEGINNER, 35, 3)
+            journal.SNAPSHOT_INTERVAL = 1
+            journal.Enable(True)
+            journal.Start(g)
+            for i in xrange(35 * 3):
+                game.Tick(g)
+                journal.Tick(g)
+                journal.Do(g.net, 'valve', g.net.pipe_list[ 0 ])
+
+            # restoring the journal gives an error, rather than waiting
+            # for a worker that can't write it
+            result = []
+            t = threading.Thread(target=lambda:
+                        result.append(journal.Load(g, game.Tick)))
+            t.daemon = True
+            t.start()
+            t.join(30)
+            assert not t.isAlive()
+            [ (g2, error) ] = result
+            assert g2 is None and error is not None
+
+            error = journal.Error()
+            assert error.startswith("Error writing journal:")
+            assert journal.Error() is None # just once
+            # nothing more is queued
+            assert journal.__current.queue.empty()
+        finally:
+            os.environ['HOME'] = os.path.dirname(os.environ['HOME'])
+            journal.Stop()
+            journal.Enable(False)
+            journal.SNAPSHOT_INTERVAL = interval
+
+## test game time
+
+def test_fixed_step_clock():
+    import gametime
+    f = gametime.Fixed_Step(0.25, 5)
+    assert [ f.Ticks(t) for t in (0.125, 0.125, 0.625, 0.125) ] == [0, 1, 2, 1]
+    assert f.Ticks(10.0) == 5  # capped, and the backlog is dropped
+    assert f.Ticks(0.125) == 0
+
+## test benchmarks
+
+def test_benchmark_lattice_and_compare():
+    import benchmark, headless
+    setup_display()
+    headless.Initialise(data_dir())
+    net = benchmark.Lattice(30)
+    assert len(net.node_list) >= 30
+    assert all([ net.Is_Connected(node) for node in net.node_list ])
+
+    # a big lattice gets a map to fit, for that size only
+    assert benchmark.Lattice_Map_Size(30) == primitives.GRID_SIZE
+    sizes = []
+    def Bench_Map(net):
+        sizes.append((primitives.Get_Map_Size(),
+                    max([ max(node.pos) for node in net.node_list ])))
+        return lambda: None
+    saved = benchmark.BENCHMARKS
+    benchmark.BENCHMARKS = [ ("map", Bench_Map, False) ]
+    try:
+        benchmark.Run_All([ 1000 ], None, 1)
+    finally:
+        benchmark.BENCHMARKS = saved
+    [ ((w, h), extent) ] = sizes
+    assert w == h > extent > primitives.GRID_SIZE[ 0 ]
+    assert primitives.Get_Map_Size() == primitives.GRID_SIZE
+
+    old = dict(results=[ dict(name='a', nodes=10, best=1.0),
+                         dict(name='b', nodes=10, best=1.0) ])
+    new = [ dict(name='a', nodes=10, best=1.1),
+            dict(name='b', nodes=10, best=1.5),
+            dict(name='c', nodes=10, best=9.0) ]
+    assert [ r[ 'name' ] for (r, before)
+                in benchmark.Compare(new, old, 1.25) ] == [ 'b' ]
+
+## test profiler
+
+def test_profiler_percentiles():
+    import profiler
+    profiler.Reset()
+    assert profiler.Begin() is None # off
+    for ms in xrange(1, 101):
+        profiler.Record("work", ms / 1000.0)
+    [ row ] = profiler.Summary()
+    assert row[ 'calls' ] == 100
+    assert_almost_equal(row[ 'p50' ], 51.0)
+    assert_almost_equal(row[ 'p95' ], 95.0)
+    assert_almost_equal(row[ 'max' ], 100.0)
+    profiler.Reset()
+
+## test batch simulator
 
+def test_difficulty_overrides():
+    from primitives import DIFFICULTY, MENU_EXPERT, MENU_BEGINNER
+    try:
+        DIFFICULTY.Set_Overrides({ 'GRACE_TIME' : 33 })
+        DIFFICULTY.Set(MENU_EXPERT)
+        assert DIFFICULTY.GRACE_TIME == 33
+        assert DIFFICULTY.BASIC_STEAM_PRODUCTION == 4
+    finally:
+        DIFFICULTY.Set_Overrides({})
+    DIFFICULTY.Set(MENU_BEGINNER)
+    assert DIFFICULTY.GRACE_TIME == 20
 
+def test_builder_pays_only_for_what_it_builds():
+    import headless, simulate
+    headless.Initialise(data_dir())
+    g = headless.Run(primitives.MENU_BEGINNER, 10, 3)
+    net = g.net
+    metal = net.hub.metal_quantity
+    num_nodes = len(net.node_list)
 
+    # nowhere to pipe the new steam maker to
+    net.Add_Pipe = lambda n1, n2: False
+    simulate.Builder(3).Build_Well_Node(net)
+    assert len(net.node_list) == num_nodes
+    assert net.hub.metal_quantity == metal
 
+    del net.Add_Pipe
+    simulate.Builder(3).Build_Well_Node(net)
+    assert len(net.node_list) == num_nodes + 1
+    assert net.hub.metal_quantity == metal - 25
 
+def test_simulate_jobs():
+    import simulate
+    settings = [ simulate.Parse_Setting("grace_time=10,20"),
+                 simulate.Parse_Setting("ROCK_QUANTITY=1.5e3") ]
+    assert settings == [ ('GRACE_TIME', [10, 20]),
+                         ('ROCK_QUANTITY', [1500.0]) ]
+    jobs = simulate.Make_Jobs(primitives.MENU_EXPERT, settings, [1, 2], 100)
+    assert len(jobs) == 4
+    assert jobs[0] == (primitives.MENU_EXPERT,
+                { 'GRACE_TIME' : 10, 'ROCK_QUANTITY' : 1500.0 }, 1, 100)
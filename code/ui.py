@@ -8,14 +8,23 @@
 import pygame , random
 from pygame.locals import *
 
-import stats , menu , draw_obj , mail , particle , tutor
+import stats , menu , draw_obj , mail , particle , tutor , journal
 import resource
 from map_items import *
 from primitives import *
 
+def Add_Rect(rect_list, area):
+    # Add an area to a list of rectangles, merging it with
+    # any that it overlaps. pygame.Rect is rather good.
+    ci = area.collidelist(rect_list)
+    while ( ci >= 0 ):
+        area = area.union(rect_list.pop(ci))
+        ci = area.collidelist(rect_list)
+    rect_list.append(area)
+
 class Gauge(object):
     """Round steampunk gauge"""
-    def __init__(self, x, y, d):
+    def __init__(self, x, y, d, rng=random):
         d = d * Get_Grid_Size() # diameter
         self.back_img = resource.Load_Image("gauge.png", scale_to=(d, d))
         self.hand_img = resource.Load_Image("gauge_hand.png", scale_to=(d, d))
@@ -23,7 +32,7 @@ class Gauge(object):
         self._pos = GVector(x, y).in_pixels
         self._animated_pressure = 0
         self._speed = .2
-        self._vibration = random.randint(0, 200)
+        self._vibration = rng.randint(0, 200)
 
     def rotate_hand(self, bar=None):
         """Rotate pressure hand"""
@@ -70,6 +79,7 @@ class Valve(object):
 
         self._back_img = resource.Load_Image("valve_back.png", scale_to=(None, h))
         self._handle_img = resource.Load_Image("valve_handle.png", scale_to=(d, d))
+        self._handle_pos = GVector(-.55, 1.38).in_pixels
         self._anim_rotation = self._gen_animate_rotation()
         self._anim_rotation.next()
 
@@ -94,7 +104,7 @@ class Valve(object):
         center = self._handle_img.get_rect().center
         handle = pygame.transform.rotate(self._handle_img, angle)
         newrect = handle.get_rect()
-        newrect.center = GVector(-.55, 1.38).in_pixels + PVector(center)
+        newrect.center = self._handle_pos + PVector(center)
         return handle, newrect
 
     def draw(self, output, is_open=None):
@@ -103,37 +113,142 @@ class Valve(object):
             handle, handle_rect = self.rotate_handle(is_open=is_open)
             output.blit(handle, self._pos + handle_rect)
 
+class Camera:
+    # Which part of the map is on the screen. The camera is moved
+    # by changing the grid size (the zoom) and the view origin, as
+    # everything is drawn with Grid_To_Scr; see primitives.py.
+    #
+    # At the normal zoom, GRID_SIZE squares fit on the screen. It is
+    # possible to zoom in by up to MAX_ZOOM times, and out until the
+    # whole map fits (or a grid square is MIN_GRID_SIZE pixels).
+
+    MAX_ZOOM = 3
+    MIN_GRID_SIZE = 4
+
+    def __init__(self):
+        self.normal_grid_size = self.grid_size = Get_Grid_Size()
+        self.size = None
+        self.centre = Get_Map_Centre()
+
+    def Set_View_Size(self, size):
+        # The size of the map area on the screen, in pixels.
+        if ( size != self.size ):
+            self.size = size
+            self.Centre_On(self.centre)
+
+    def Get_View(self):
+        # Changes whenever the camera moves.
+        return (self.grid_size, Get_View_Origin())
+
+    def Get_Area(self):
+        # The grid squares on the screen, as a Rect. (The whole
+        # map, until the size of the screen is known.)
+        if ( self.size == None ):
+            return Rect((0, 0), Get_Map_Size())
+        (x, y) = Get_View_Origin()
+        (w, h) = self.size
+        gs = self.grid_size
+        return Rect(x / gs, y / gs, ( w / gs ) + 2, ( h / gs ) + 2)
+
+    def Centre_On(self, (x, y)):
+        self.centre = (x, y)
+        if ( self.size == None ):
+            return
+        gs = self.grid_size
+        (w, h) = self.size
+        (mw, mh) = Get_Map_Size()
+        # Keep the map on the screen.
+        ox = max(0, min(int(( x + 0.5 ) * gs ) - ( w / 2 ), ( mw * gs ) - w))
+        oy = max(0, min(int(( y + 0.5 ) * gs ) - ( h / 2 ), ( mh * gs ) - h))
+        Set_Grid_Size(gs)
+        Set_View_Origin((ox, oy))
+        self.centre = (( ox + ( w / 2 )) / float(gs) - 0.5,
+                    ( oy + ( h / 2 )) / float(gs) - 0.5)
+
+    def Scroll(self, (dx, dy)):
+        # By a fraction of the screen.
+        if ( self.size == None ):
+            return
+        (x, y) = self.centre
+        (w, h) = self.size
+        self.Centre_On((x + ( dx * w ) / self.grid_size,
+                    y + ( dy * h ) / self.grid_size))
+
+    def Zoom(self, steps, spos=None):
+        # In (steps > 0) or out, keeping the grid square at spos
+        # (or the middle of the screen) where it is.
+        if ( self.size == None ):
+            return
+        (w, h) = self.size
+        (mw, mh) = Get_Map_Size()
+        smallest = max(self.MIN_GRID_SIZE, min(
+                    self.normal_grid_size, w / mw, h / mh))
+        largest = self.normal_grid_size * self.MAX_ZOOM
+
+        gs = self.grid_size
+        for i in xrange(abs(steps)):
+            step = max(1, gs / 4)
+            if ( steps > 0 ):
+                gs += step
+            else:
+                gs -= step
+        gs = max(smallest, min(gs, largest))
+        if ( gs == self.grid_size ):
+            return
+
+        if ( spos == None ):
+            spos = (w / 2, h / 2)
+        (sx, sy) = spos
+        (ox, oy) = Get_View_Origin()
+        (gx, gy) = (( ox + sx ) / float(self.grid_size) - 0.5,
+                    ( oy + sy ) / float(self.grid_size) - 0.5)
+        self.grid_size = gs
+        draw_obj.Flush_Draw_Obj_Cache()
+        self.Centre_On((gx + (( w / 2 ) - sx ) / float(gs),
+                    gy + (( h / 2 ) - sy ) / float(gs)))
+
 class User_Interface:
     def __init__(self, net, (width, height)):
         self.net = net
         self.control_menu = None
 
+        self.base = None
+        self.static = None
+        self.drawn = dict()
         self.Reset()
         self.blink = 0xff
 
+        # Random numbers that are only for show come from here, not
+        # from the "random" module, so that drawing the game doesn't
+        # change what happens in it (see journal.py).
+        self.rng = random.Random()
+
         # Although there is only one base image, it is scaled and
         # cropped on startup to create different backdrops.
         # (Note: These don't get saved, as they're part of the UI. That's bad.)
 
         img = resource.Load_Image("moon_surface.jpg")
-        zoom = 1 + random.random() # zoom in between 1 and 2
+        zoom = 1 + self.rng.random() # zoom in between 1 and 2
         scaled = pygame.transform.smoothscale(img,
             (int(width * zoom), int(height * zoom))
         )
 
         # get random coordinates to extract a background surface
-        x = randint(0, scaled.get_width() - width)
-        y = randint(0, scaled.get_height() - height)
+        x = self.rng.randint(0, scaled.get_width() - width)
+        y = self.rng.randint(0, scaled.get_height() - height)
         self.background = pygame.Surface((width, height),flags=pygame.SRCALPHA)
         self.background.blit(scaled, (0,0),(x, y, x + width, y + height))
-
+        self.camera = Camera()
+        self.view = None
+        self.scaled_background = (Get_Grid_Size(), self.background)
+        self.control_grid_size = Get_Grid_Size()
 
         self.steam_effect = particle.Make_Particle_Effect(particle.Steam_Particle)
         self.steam_effect_frame = 0
 
         self.gauges = dict(
-            city_pressure = Gauge(0, 0, 4),
-            selected_pressure = Gauge(4.5, 0, 4)
+            city_pressure = Gauge(0, 0, 4, self.rng),
+            selected_pressure = Gauge(4.5, 0, 4, self.rng)
         )
         self.valve = Valve()
 
@@ -148,59 +263,197 @@ class User_Interface:
     def Update_Area(self, area):
         if ( area != None ):
             self.partial_update = True
-
-            # pygame.Rect is rather good.
-
-            if ( len(self.update_area_list) == 0 ):
-                self.update_area_list = [area]
+            Add_Rect(self.update_area_list, area)
+
+    # Dirty-rectangle rendering.
+    #
+    # The parts of the map that only change when the network does
+    # (background, wells, rock images, pipe lines) are composed once
+    # on the "static" surface, which is rebuilt when Network.dirty
+    # is set or the map is resized. See Item.Draw_Static.
+    #
+    # The map proper is kept on the "base" surface: the static layer
+    # plus what items draw on top of it. Each frame, only the items
+    # whose Draw_State() has changed, and the items that appeared or
+    # went away, are redrawn on the base, clipped to their screen
+    # rectangles along with anything else that overlaps them.
+    # Everything else (steam, selection, cursor, season effects,
+    # popups and mail) is drawn straight onto the output and
+    # reported through Update_Area; next frame, those areas are
+    # copied back from the base before drawing again.
+    #
+    # If too much has changed, the whole base is redrawn instead.
+    # The static layer only covers what the camera can see, so it
+    # (and everything else) is remade when the camera moves.
+
+    MAX_DIRTY_RECTS = 40
+
+    # Only the items that may be on the screen are drawn. They are
+    # found with the Network's spatial index, in the same order as
+    # they are in its lists (the order they were added in, or for
+    # rocks, back to front). An item can be drawn up to VIEW_MARGIN
+    # grid squares away from the squares it is filed under: rocks
+    # are up to six squares across, and conveyors reach rocks up to
+    # INITIAL_NODE_EXCAVATION_DISTANCE squares from their nodes.
+
+    VIEW_MARGIN = INITIAL_NODE_EXCAVATION_DISTANCE + 4
+
+    def Visible_Items(self, kinds, area=None, margin=VIEW_MARGIN):
+        # Items of the given kinds that may be seen in an area of
+        # the map (a Rect, in grid squares), which is by default
+        # what the camera can see.
+        if ( area == None ):
+            area = self.camera.Get_Area()
+        found = self.net.item_grid.Find_In_Area(
+                    area.inflate(margin * 2, margin * 2))
+        order = self.net.item_grid.order
+        out = []
+        for kind in kinds:
+            l = [ item for item in found if isinstance(item, kind) ]
+            if ( kind == Rock ):
+                l.sort(key=lambda r: (r.Depth(), order[ r ]))
+            else:
+                l.sort(key=order.get)
+            out.extend(l)
+        return out
+
+    def __Update_Static(self, size):
+        self.static = pygame.Surface(size).convert()
+        self.__Draw_Background(self.static)
+        for item in self.Visible_Items([ Well, Pipe, Node, Rock ]):
+            item.Draw_Static(self.static)
+        self.static_grid_size = Get_Grid_Size()
+
+    def __Draw_Background(self, output):
+        # The backdrop is repeated across the map, and scaled with
+        # the zoom.
+        gs = Get_Grid_Size()
+        if ( self.scaled_background[ 0 ] != gs ):
+            (w, h) = self.background.get_size()
+            n = self.camera.normal_grid_size
+            self.scaled_background = (gs, pygame.transform.smoothscale(
+                    self.background, (( w * gs ) / n, ( h * gs ) / n)))
+        bg = self.scaled_background[ 1 ]
+        (bw, bh) = bg.get_size()
+        (ox, oy) = Get_View_Origin()
+        (w, h) = output.get_size()
+        for x in xrange(- ( ox % bw ), w, bw):
+            for y in xrange(- ( oy % bh ), h, bh):
+                output.blit(bg, (x, y))
+
+    def __Update_Base(self, size, full):
+        if (( self.base == None ) or ( self.base.get_size() != size )):
+            self.base = pygame.Surface(size).convert()
+            self.scratch = pygame.Surface(size).convert()
+            self.static = None
+
+        if (( self.static == None )
+        or ( self.static_grid_size != Get_Grid_Size() )):
+            self.__Update_Static(size)
+            full = True
+
+        items = self.Visible_Items([ Pipe, Node, Rock ])
+        dirty = []
+        drawn = dict()
+        for item in items:
+            state = item.Draw_State()
+            old = self.drawn.get(item, None)
+            if (( old != None ) and ( old[ 0 ] == state )):
+                drawn[ item ] = old
             else:
-                ci = area.collidelist(self.update_area_list)
-                if ( ci < 0 ):
-                    # New area!
-                    self.update_area_list.append(area)
-                else:
-                    # Area overlaps an existing area, which gets expanded.
-                    self.update_area_list[ ci ].union_ip(area)
+                rect = item.Get_Screen_Rect()
+                drawn[ item ] = (state, rect)
+                if ( not full ):
+                    Add_Rect(dirty, rect)
+                    if ( old != None ):
+                        Add_Rect(dirty, old[ 1 ])
+
+        if ( not full ):
+            for (item, (state, rect)) in self.drawn.iteritems():
+                if ( not drawn.has_key(item) ):
+                    Add_Rect(dirty, rect)
+
+        self.drawn = drawn
+        if ( full or ( len(dirty) > self.MAX_DIRTY_RECTS )):
+            dirty = [ self.base.get_rect() ]
+
+        # Items are drawn whole on the scratch surface and only the
+        # dirty area is copied over: pygame doesn't draw thick lines
+        # quite the same way when they are clipped.
+        rects = [ drawn[ item ][ 1 ] for item in items ]
+        for r in dirty:
+            touching = r.collidelistall(rects)
+            area = r.unionall([ rects[ i ] for i in touching ])
+            area = area.clip(self.scratch.get_rect())
+            self.scratch.blit(self.static, area.topleft, area)
+            touching = [ items[ i ] for i in touching ]
+            Draw_Pipes(self.scratch, [ item for item in touching
+                        if isinstance(item, Pipe) ])
+            for item in touching:
+                if ( not isinstance(item, Pipe) ):
+                    item.Draw(self.scratch)
+            self.base.blit(self.scratch, r.topleft, r)
+        return dirty
 
     def Draw_Game(self, output, season_fx):
+        # Returns the areas of the display that have changed, or
+        # None if all of it may have.
         blink = self.blink
+        full = self.full_redraw
+        self.full_redraw = False
+        size = output.get_size()
+
+        self.camera.Set_View_Size(size)
+        view = self.camera.Get_View()
+        if ( view != self.view ):
+            # The camera has moved, so everything has.
+            self.view = view
+            self.static = None
+            self.drawn = dict()
+            full = True
 
         if ( season_fx.Is_Shaking() and not self.Is_Menu_Open() ):
             # Earthquake effect
             m = 6
             r = output.get_rect()
-            r.left += random.randint(-m, m)
-            r.top += random.randint(-m, m)
+            r.left += self.rng.randint(-m, m)
+            r.top += self.rng.randint(-m, m)
             r = output.get_rect().clip(r)
             output = output.subsurface(r)
+            full = self.full_redraw = True
 
         if ( self.net.dirty ):
             self.net.dirty = False
+            self.static = None
+
+        if (( len(self.vehicle_list) != 0 ) or ( DEBUG_GRID )):
+            full = True
+
+        dirty = self.__Update_Base(size, full)
+        if ( full ):
+            restore = [ output.get_rect() ]
+        else:
+            restore = list(dirty)
+            for r in self.update_area_list:
+                Add_Rect(restore, r)
 
-        output.blit(self.background,(0,0))
+        for r in restore:
+            output.blit(self.base, r.topleft, r)
 
         self.__Update_Reset()
 
-        for w in self.net.well_list:
-            w.Draw(output)
-            self.Add_Steam_Effect(output, w.pos)
+        # Steam rises well above its source.
+        margin = ( max(self.steam_effect[ 0 ].get_size())
+                    / Get_Grid_Size() ) + 1
+        for item in self.Visible_Items([ Well, Node ], margin=margin):
+            if ( item.emits_steam ):
+                self.Add_Steam_Effect(output, item.pos)
 
         if ( self.selection != None ):
             # highlight selection
             r = self.selection.Draw_Selected(output, (blink, blink, 0))
             self.Update_Area(r)
 
-        for p in self.net.pipe_list:
-            p.Draw(output)
-
-        for n in self.net.node_list:
-            n.Draw(output)
-            if ( n.emits_steam ):
-                self.Add_Steam_Effect(output, n.pos)
-
-        for r in self.net.rock_list:
-            r.Draw(output)
-
         for v in self.vehicle_list:
             v.draw(output)
 
@@ -220,8 +473,10 @@ class User_Interface:
                     INITIAL_NODE_EXCAVATION_DISTANCE, (0, 0, 0, 10), 1,
                     filled=True)
                 # draw excavation limit
-                draw_ellipse(output, Point(r.topleft),
+                size = draw_ellipse(output, Point(r.topleft),
                     INITIAL_NODE_EXCAVATION_DISTANCE , (0, 0, 0, 30), 1)
+                self.Update_Area(Ellipse_Rect(Point(r.topleft) +
+                    Point(Get_Grid_Size() / 2, Get_Grid_Size() / 2), size))
 
             elif (( self.mode == BUILD_PIPE )
             and ( self.selection != None )
@@ -244,7 +499,7 @@ class User_Interface:
             r = item.Draw_Popup(output)
             self.Update_Area(r)
 
-        mail.Draw_Mail(output)
+        self.Update_Area(mail.Draw_Mail(output))
 
         if ( not self.Is_Menu_Open () ):
             self.blink = 0x80 | ( 0xff & ( self.blink + 0x10 ))
@@ -254,17 +509,31 @@ class User_Interface:
         if ( DEBUG_GRID ):
             self.Debug_Grid(output)
 
+        if ( full ):
+            return None
+
+        changed = list(restore)
+        for r in self.update_area_list:
+            Add_Rect(changed, r)
+
+        if ( DEBUG_UPDATES ):
+            for r in changed:
+                pygame.draw.rect(output, (255, 0, 255), r, 1)
+
+        (x, y) = output.get_abs_offset()
+        return [ r.move(x, y) for r in changed ]
+
     def Draw_Selection(self, output):
         output.fill((20,0,0))
         if ( self.selection != None ):
             r = output.get_rect()
             r.center = Grid_To_Scr(self.selection.pos)
+            gs = Get_Grid_Size()
+            area = Rect(Scr_To_Grid(r.topleft),
+                    (( r.width / gs ) + 2, ( r.height / gs ) + 2))
 
-            for p in self.net.pipe_list:
-                p.Draw_Mini(output, r.topleft)
-
-            for n in self.net.node_list:
-                n.Draw_Mini(output, r.topleft)
+            for item in self.Visible_Items([ Pipe, Node ], area):
+                item.Draw_Mini(output, r.topleft)
 
     def Draw_Stats(self, output, default_stats):
         if ( self.selection == None ):
@@ -310,7 +579,7 @@ class User_Interface:
         else:
             self.valve.draw(output)
 
-        self.control_menu.Draw(output, top=5*Get_Grid_Size())
+        self.control_menu.Draw(output, top=5*self.control_grid_size)
 
     def Control_Mouse_Move(self, spos):
         if ( self.control_menu != None ):
@@ -323,19 +592,35 @@ class User_Interface:
 
             if ( self.selection != None ):
                 if ( self.mode == DESTROY ):
-                    self.net.Destroy(self.selection)
+                    journal.Do(self.net, 'destroy', self.selection)
                     self.__Clear_Control_Selection()
                     self.selection = None
 
                 elif ( self.mode == UPGRADE ):
-                    self.selection.Begin_Upgrade()
+                    journal.Do(self.net, 'free_upgrade', self.selection)
                     self.__Clear_Control_Selection()
 
     def Key_Press(self, k):
-        if ( self.control_menu != None ):
+        # The arrow keys scroll the map, + and - zoom (as does the
+        # mouse wheel) and Home goes back to the City.
+        scroll = { K_LEFT : (-0.25, 0), K_RIGHT : (0.25, 0),
+                    K_UP : (0, -0.25), K_DOWN : (0, 0.25) }
+        if ( scroll.has_key(k) ):
+            self.camera.Scroll(scroll[ k ])
+        elif ( k in [ K_EQUALS, K_PLUS, K_KP_PLUS ] ):
+            self.Zoom(1)
+        elif ( k in [ K_MINUS, K_KP_MINUS ] ):
+            self.Zoom(-1)
+        elif ( k == K_HOME ):
+            self.camera.Centre_On(self.net.hub.pos)
+        elif ( self.control_menu != None ):
             self.control_menu.Key_Press(k)
             self.mode = self.control_menu.Get_Command()
 
+    def Zoom(self, steps, spos=None):
+        self.camera.Zoom(steps, spos)
+        self.mouse_pos = None
+
     def Right_Mouse_Down(self):
         self.selection = None
         self.mouse_pos = None
@@ -352,6 +637,7 @@ class User_Interface:
         self.__Clear_Control_Selection()
         self.stats_hash = 0
         self.__Update_Reset()
+        self.full_redraw = True
 
     def __Update_Reset(self):
         self.partial_update = False
@@ -362,6 +648,8 @@ class User_Interface:
 
     def Game_Mouse_Down(self, spos):
         gpos = Scr_To_Grid(spos)
+        if ( not In_Map(gpos) ):
+            return
 
         if (( self.selection != None )
         and ( self.selection.Is_Destroyed() )):
@@ -384,27 +672,23 @@ class User_Interface:
             # empty (may contain pipes)
             if ( self.mode == BUILD_NODE ):
                 # create new node!
-                if self.net.use_metal('node'):
-                    n = Node(gpos, rocks=self.net.rock_list)
-                    n.Sound_Effect()
-                    self.selection = None
-                    if ( self.net.Add_Grid_Item(n) ):
-                        self.selection = n
-                        tutor.Notify_Add_Node(n)
+                self.selection = None
+                n = journal.Do(self.net, 'node', gpos)
+                if ( n != None ):
+                    self.selection = n
+                    tutor.Notify_Add_Node(n)
 
             elif ( self.mode == DESTROY ):
                 # I presume you are referring to a pipe?
                 pipe = self.selection
                 if ( pipe != None ):
-                    self.net.Destroy(pipe)
+                    journal.Do(self.net, 'destroy', pipe)
                     self.__Clear_Control_Selection()
                 self.selection = None
 
             elif ( self.mode == UPGRADE ):
                 if ( self.selection != None ):
-
-                    if self.net.use_metal('up_node'):
-                        self.selection.Begin_Upgrade()
+                    if ( journal.Do(self.net, 'upgrade', self.selection) ):
                         self.__Clear_Control_Selection()
 
             elif ( self.selection != None ):
@@ -425,18 +709,17 @@ class User_Interface:
                 and ( isinstance(self.selection, Node) )
                 and ( n != self.selection )):
                     # end pipe here
-                    if ( self.net.Add_Pipe(self.selection, n) ):
+                    if ( journal.Do(self.net, 'pipe', self.selection, n) ):
                         tutor.Notify_Add_Pipe()
                         self.selection = None
 
             elif ( self.mode == DESTROY ):
-                self.net.Destroy(n)
+                journal.Do(self.net, 'destroy', n)
                 self.selection = None
                 self.__Clear_Control_Selection()
 
             elif ( self.mode == UPGRADE ):
-                if self.net.use_metal('up_node'):
-                    n.Begin_Upgrade()
+                journal.Do(self.net, 'upgrade', n)
                 self.selection = n
                 self.__Clear_Control_Selection()
 
@@ -449,12 +732,10 @@ class User_Interface:
             w = self.net.ground_grid[ gpos ]
             if ( self.mode == BUILD_NODE ):
                 # A node is planned on top of the well.
-                if self.net.use_metal('well'):
-                    self.selection = None
-                    n = Well_Node(gpos)
-                    if ( self.net.Add_Grid_Item(n) ):
-                        self.selection = n
-                        self.selection.Sound_Effect()
+                self.selection = None
+                n = journal.Do(self.net, 'well_node', gpos)
+                if ( n != None ):
+                    self.selection = n
 
         ## Select a rock
         #for rock in self.net.rock_list:
@@ -468,17 +749,20 @@ class User_Interface:
 
     def Game_Mouse_Move(self, spos):
         self.mouse_pos = Scr_To_Grid(spos)
+        if ( not In_Map(self.mouse_pos) ):
+            self.mouse_pos = None
         if ( self.control_menu != None ):
             self.control_menu.Mouse_Move(None)
 
     def Debug_Grid(self, output):
-        (mx, my) = GRID_SIZE
-        for y in xrange(my):
-            for x in xrange(mx):
-                if ( self.net.pipe_grid.has_key( (x,y) ) ):
+        area = self.camera.Get_Area()
+        for y in xrange(area.top, area.bottom):
+            for x in xrange(area.left, area.right):
+                pipes = self.net.item_grid.Get((x,y), Pipe)
+                if ( len(pipes) != 0 ):
                     r = Grid_To_Scr_Rect((x,y))
                     pygame.draw.rect(output, (55,55,55), r, 1)
-                    r.width = len(self.net.pipe_grid[ (x,y) ]) + 1
+                    r.width = len(pipes) + 1
                     pygame.draw.rect(output, (255,0,0), r)
 
     def Add_Steam_Effect(self, output, pos):
@@ -506,7 +790,8 @@ class User_Interface:
                 pictures, width)
 
     def Frame_Advance(self, frame_time):
-        for p in self.net.pipe_list:
-            p.Frame_Advance(frame_time)
+        # Only what can be seen is animated.
+        for item in self.Visible_Items([ Pipe, Node, Rock ]):
+            item.Frame_Advance(frame_time)
 
 